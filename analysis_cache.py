@@ -0,0 +1,234 @@
+"""
+In-memory cache of CV analyses and SSE framing helpers for /analyse-cv.
+
+The analysis runs with temperature=0, so the same CV against the same job description
+yields the same answer: it is kept in an LRU cache with a TTL, keyed on hashes of the
+normalized CV text, the normalized job description and the prompt settings. A hit is
+replayed as a few large SSE frames; a miss is streamed through a ChunkBuffer that
+coalesces the model's small deltas into frames flushed on a time or size threshold.
+timed_frames/timed_frames_async also flush on the time threshold while the model
+stalls between deltas.
+"""
+import asyncio
+import hashlib
+import json
+import queue
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Unicode (NFKC) and whitespace normalization, so trivial re-uploads map to the same key.
+    """
+    return SPACES_RE.sub(" ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def make_key(resume_text, job_description, *settings):
+    """
+    Cache key: hashes of the CV text and of the job description, plus the prompt
+    settings (system prompt, model, max_tokens) so a prompt change invalidates the cache.
+    """
+    parts = [text_hash(resume_text), text_hash(job_description)]
+    parts.extend(str(setting) for setting in settings)
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
+class AnalysisCache:
+    """
+    Thread-safe LRU cache with a TTL. Entries older than ttl_seconds are dropped on
+    access; beyond max_entries, the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached analysis for the key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries
+            }
+
+
+def sse_chunk(text):
+    return f"data: {json.dumps({'chunk': text})}\n\n"
+
+
+def replay_frames(text, frame_chars=4096):
+    """
+    SSE frames replaying a cached analysis: same {'chunk': ...} payloads as a live
+    stream, but coalesced into frames of up to frame_chars characters.
+    """
+    for start in range(0, len(text), frame_chars):
+        yield sse_chunk(text[start:start + frame_chars])
+
+
+class ChunkBuffer:
+    """
+    Coalesces streamed deltas into larger SSE frames. add() returns a frame once
+    flush_chars characters are buffered or flush_seconds have passed since the last
+    frame, None otherwise; flush() returns the remainder (or None) at the end of the stream.
+    """
+
+    def __init__(self, flush_seconds=0.05, flush_chars=256):
+        self.flush_seconds = flush_seconds
+        self.flush_chars = flush_chars
+        self._parts = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, text):
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size >= self.flush_chars or time.monotonic() - self._last_flush >= self.flush_seconds:
+            return self.flush()
+        return None
+
+    def time_left(self):
+        """
+        Seconds before the buffered text is due, or None while the buffer is empty.
+        """
+        if not self._parts:
+            return None
+        return max(0.0, self.flush_seconds - (time.monotonic() - self._last_flush))
+
+    def flush(self):
+        if not self._parts:
+            return None
+        frame = sse_chunk("".join(self._parts))
+        self._parts = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+        return frame
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+_END = object()
+
+
+def timed_frames(deltas, buffer):
+    """
+    SSE frames for an iterable of text deltas. The deltas are read in a background
+    thread, so buffered text is flushed once flush_seconds have passed even if the
+    model stalls. An exception raised by deltas is re-raised here, leaving the remainder
+    in the buffer. Closing the generator (client gone) stops the reader after its
+    current delta and closes deltas.
+    """
+    pending = queue.Queue()
+    stop = threading.Event()
+
+    def read():
+        iterator = iter(deltas)
+        try:
+            for delta in iterator:
+                pending.put(delta)
+                if stop.is_set():
+                    break
+            pending.put(_END)
+        except BaseException as e:
+            pending.put(_Failure(e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close:
+                close()
+
+    threading.Thread(target=read, daemon=True, name="sse-reader").start()
+    try:
+        while True:
+            try:
+                item = pending.get(timeout=buffer.time_left())
+            except queue.Empty:
+                frame = buffer.flush()
+            else:
+                if item is _END:
+                    return
+                if isinstance(item, _Failure):
+                    raise item.error
+                frame = buffer.add(item)
+            if frame:
+                yield frame
+    finally:
+        stop.set()
+
+
+async def timed_frames_async(deltas, buffer):
+    """
+    Async counterpart of timed_frames for an async iterable of text deltas: the next
+    delta is awaited with a timeout, without cancelling it, so a stall still flushes.
+    """
+    iterator = deltas.__aiter__()
+    next_delta = None
+    try:
+        while True:
+            if next_delta is None:
+                next_delta = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({next_delta}, timeout=buffer.time_left())
+            if done:
+                try:
+                    frame = buffer.add(next_delta.result())
+                except StopAsyncIteration:
+                    next_delta = None
+                    return
+                next_delta = None
+            else:
+                frame = buffer.flush()
+            if frame:
+                yield frame
+    finally:
+        if next_delta is not None:
+            next_delta.cancel()
+            try:
+                await next_delta
+            except BaseException:
+                pass
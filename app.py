@@ -2,98 +2,252 @@ import json
 import logging
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS, cross_origin
-from openai import AzureOpenAI
-from azure.identity import DefaultAzureCredential
-from azure.keyvault.secrets import SecretClient
-import io
-import docx2txt
-import PyPDF2
 import traceback
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import os
+from ranking import BM25Index, term_frequencies
+from extraction import ExtractionError, extract_document
+from config import LazyResource, ReadinessProbe, get_secret_store, sample_payload_logging
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, observe_stage, record_tokens, register_callback, render_metrics, timed
+from tokenizer import count_tokens
+from llm_limiter import OPENAI_TIMEOUT_SECONDS, get_limiter
+from compaction import compact_for_prompt
+from analysis_cache import AnalysisCache, ChunkBuffer, make_key as make_analysis_key, replay_frames, timed_frames
  
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "https://talent.heptasys.com"}}, allow_headers=["Content-Type", "Authorization", "X-Requested-With"])
  
 logging.basicConfig(level=logging.INFO)
  
-# Azure Key Vault for secrets management
-key_vault_name = 'AI-vault-hepta'
-key_vault_uri = f"https://{key_vault_name}.vault.azure.net/"
-credential = DefaultAzureCredential()
-secret_client = SecretClient(vault_url=key_vault_uri, credential=credential)
- 
+# Secrets (Azure Key Vault) and clients are resolved on first use, see config.py
 # MongoDB setup
-mongo_uri = secret_client.get_secret('MONGOsearchURI').value
-mongo_client = MongoClient(mongo_uri)
-db = mongo_client['AzureBlob']
+def build_mongo_client(mongo_uri):
+    return MongoClient(mongo_uri, serverSelectionTimeoutMS=int(os.getenv("MONGO_TIMEOUT_MS", "5000")))
+ 
+mongo_client = LazyResource(build_mongo_client, 'MONGOsearchURI')
+ 
+def get_db():
+    return mongo_client.get()['AzureBlob']
  
 # OpenAI client setup using Azure
-api_key = secret_client.get_secret('AZUREopenaiAPIkey').value
-azure_endpoint = secret_client.get_secret('AZUREopenaiENDPOINT').value
-azure_openai_client = AzureOpenAI(api_key=api_key, api_version="2024-02-15-preview", azure_endpoint=azure_endpoint)
+def build_openai_client(api_key, azure_endpoint):
+    from openai import AzureOpenAI
+    # Retries are handled by llm_limiter (budgets, backoff, Retry-After)
+    return AzureOpenAI(api_key=api_key, api_version="2024-02-15-preview", azure_endpoint=azure_endpoint,
+                       max_retries=0, timeout=OPENAI_TIMEOUT_SECONDS)
+ 
+openai_client = LazyResource(build_openai_client, 'AZUREopenaiAPIkey', 'AZUREopenaiENDPOINT')
+ANALYSIS_MAX_TOKENS = 3000
+ANALYSIS_MODEL = "Best"
+ 
+# Analysis results cache (temperature=0: same CV and job description, same answer), see analysis_cache.py
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").lower() == "true"
+analysis_cache = AnalysisCache(
+    max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "512")),
+    ttl_seconds=int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+)
+register_callback("cv_analysis_cache_hits_total", "Analyses served from the cache.",
+                  lambda: analysis_cache.stats()["hits"], kind="counter")
+register_callback("cv_analysis_cache_misses_total", "Analyses missing from the cache.",
+                  lambda: analysis_cache.stats()["misses"], kind="counter")
+register_callback("cv_analysis_cache_entries", "Analyses held in the cache.",
+                  lambda: analysis_cache.stats()["entries"])
+# Streamed deltas are sent in frames flushed every SSE_FLUSH_MS or SSE_FLUSH_CHARS characters
+SSE_FLUSH_SECONDS = int(os.getenv("SSE_FLUSH_MS", "50")) / 1000
+SSE_FLUSH_CHARS = int(os.getenv("SSE_FLUSH_CHARS", "256"))
+ 
+# Candidate pool ranking: BM25 pre-filter, then LLM analysis of the top K only
+RANK_TOP_K = int(os.getenv("RANK_TOP_K", "5"))
+RANK_CONCURRENCY = int(os.getenv("RANK_CONCURRENCY", "4"))
+_cv_index_ready = False
  
 def extract_text(file):
-    if 'pdf' in file.content_type:
-        return extract_text_from_pdf(file)
-    elif 'word' in file.content_type or file.filename.endswith('.docx'):
-        return extract_text_from_docx(file)
-    else:
-        raise ValueError("Unsupported file format")
- 
-def extract_text_from_pdf(file):
-    reader = PyPDF2.PdfReader(file.stream)
-    text = "".join([page.extract_text() for page in reader.pages if page.extract_text()])
-    return text
- 
-def extract_text_from_docx(file):
-    file_content = file.read()
-    file_buffer = io.BytesIO(file_content)
-    return docx2txt.process(file_buffer)
+    return extract_resume_bytes(file.read(), file.filename)
  
-def analyze_resume(resume_text, job_description):
-    messages = [
-        {
-            "role": "system",
-            "content": "Take a deep breath, act as a CV and job posting comparer, write in full sentences in French, Évaluer la correspondance du CV suivant avec le descriptif ci-dessus en donnant pour chaque tâche et technologie requise dans le descriptif le pourcentage de correspondance et donner le pourcentage global enfin donner ce qu'il faut ajouter sur le CV pour avoir un meilleur matching.\n\n"
-            "Vous êtes un recruteur professionnel strict et expert en analyse de CV. "
-            "Votre tâche est d'analyser le CV ci-dessous par rapport à une description de poste spécifique et de fournir une analyse rigoureuse et détaillée. "
-            "Veuillez extraire uniquement les informations suivantes du CV : email, téléphone, adresse, compétences clés, expériences professionnelles principales. "
-            "Ensuite, fournissez un score de correspondance détaillé entre 0 et 100, une recommandation par 'oui' ou 'non' pour l'adéquation, "
-            "et une justification détaillée pour chaque tâche et technologie requise dans le descriptif. "
-            "N'acceptez que les correspondances explicites; n'envisagez pas de potentiel futur.\n\n"
-            "1. Email\n"
-            "2. Téléphone\n"
-            "3. Adresse\n"
-            "4. Tous les Compétences clés (sous forme de points)\n"
-            "5. Tous les Expériences professionnelles principales\n"
-            "6. Score (from 1 to 100)\n"    
-            "7. Recommendation (Oui ou Non)\n"
-            "8. A short but meaningful justification in French\n"
-            "9. Pour améliorer le CV"
-        },
+def extract_resume_bytes(data, filename):
+    """Extracted text, compacted before it is sent to the model (page boilerplate, whitespace, OCR noise)."""
+    return compact_for_prompt(extract_bytes(data, filename), "analysis")
+ 
+@timed("text_extraction")
+def extract_bytes(data, filename):
+    """Extract the text of an uploaded CV with the extraction module shared with convert.py."""
+    result = extract_document(data, filename)
+    logging.info(f"Extracted {filename} ({result['format']}, {result['size_bytes']} bytes): {result['timings']}")
+    return result['text']
+ 
+# Static instructions first: every analysis shares this exact prefix, which the chat API's prompt caching can reuse
+ANALYSIS_SYSTEM_PROMPT = (
+    "Take a deep breath, act as a CV and job posting comparer, write in full sentences in French, Évaluer la correspondance du CV suivant avec le descriptif ci-dessus en donnant pour chaque tâche et technologie requise dans le descriptif le pourcentage de correspondance et donner le pourcentage global enfin donner ce qu'il faut ajouter sur le CV pour avoir un meilleur matching.\n\n"
+    "Vous êtes un recruteur professionnel strict et expert en analyse de CV. "
+    "Votre tâche est d'analyser le CV ci-dessous par rapport à une description de poste spécifique et de fournir une analyse rigoureuse et détaillée. "
+    "Veuillez extraire uniquement les informations suivantes du CV : email, téléphone, adresse, compétences clés, expériences professionnelles principales. "
+    "Ensuite, fournissez un score de correspondance détaillé entre 0 et 100, une recommandation par 'oui' ou 'non' pour l'adéquation, "
+    "et une justification détaillée pour chaque tâche et technologie requise dans le descriptif. "
+    "N'acceptez que les correspondances explicites; n'envisagez pas de potentiel futur.\n\n"
+    "1. Email\n"
+    "2. Téléphone\n"
+    "3. Adresse\n"
+    "4. Tous les Compétences clés (sous forme de points)\n"
+    "5. Tous les Expériences professionnelles principales\n"
+    "6. Score (from 1 to 100)\n"    
+    "7. Recommendation (Oui ou Non)\n"
+    "8. A short but meaningful justification in French\n"
+    "9. Pour améliorer le CV"
+)
+ 
+def build_analysis_messages(resume_text, job_description):
+    return [
+        {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
         {"role": "user", "content": f"Description du poste : {job_description}"},
         {"role": "user", "content": f"CV : {resume_text}"}
     ]
  
+def analysis_cache_key(resume_text, job_description):
+    return make_analysis_key(resume_text, job_description, ANALYSIS_SYSTEM_PROMPT, ANALYSIS_MODEL, ANALYSIS_MAX_TOKENS)
+ 
+def get_cached_analysis(cache_key):
+    return analysis_cache.get(cache_key) if ANALYSIS_CACHE_ENABLED else None
+ 
+def store_analysis(cache_key, analysis, finish_reason):
+    """Only complete answers are cached: one cut off at max_tokens ("length") or filtered is not replayed."""
+    if ANALYSIS_CACHE_ENABLED and analysis and finish_reason == "stop":
+        analysis_cache.put(cache_key, analysis)
+ 
+def new_chunk_buffer():
+    return ChunkBuffer(SSE_FLUSH_SECONDS, SSE_FLUSH_CHARS)
+ 
+def count_message_tokens(messages):
+    return sum(count_tokens(message['content']) for message in messages)
+ 
+def record_analysis_tokens(messages, completion):
+    """Streamed completions carry no usage: estimate the tokens with the local tokenizer."""
+    record_tokens("analysis_stream", count_message_tokens(messages), count_tokens(completion))
+ 
+def analyze_resume(resume_text, job_description):
+    cache_key = analysis_cache_key(resume_text, job_description)
+    cached = get_cached_analysis(cache_key)
+    if cached is not None:
+        logging.info("Analysis found in the cache, replaying it")
+        return Response(replay_frames(cached), content_type='text/event-stream', headers={'X-Analysis-Cache': 'hit'})
+    messages = build_analysis_messages(resume_text, job_description)
+    log_payload = sample_payload_logging()
+ 
     def generate():
+        parts = []
+        finish_reasons = []
+        buffer = new_chunk_buffer()
+        error = None
         try:
-            response = azure_openai_client.chat.completions.create(
-                model="Best",
-                messages=messages,
-                max_tokens=3000,
-                temperature=0,
-                stream=True
-            )
-            for chunk in response:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    # Log the content to the terminal
-                    print(content, end='', flush=True)
-                    yield f"data: {json.dumps({'chunk': content})}\n\n"
+            with observe_stage("llm_call"):
+                response = get_limiter().stream(
+                    lambda: openai_client.get().chat.completions.create(
+                        model=ANALYSIS_MODEL,
+                        messages=messages,
+                        max_tokens=ANALYSIS_MAX_TOKENS,
+                        temperature=0,
+                        stream=True
+                    ),
+                    count_message_tokens(messages), ANALYSIS_MAX_TOKENS, key="analysis_stream"
+                )
+                def contents():
+                    for chunk in response:
+                        if chunk.choices and chunk.choices[0].finish_reason:
+                            finish_reasons.append(chunk.choices[0].finish_reason)
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            parts.append(chunk.choices[0].delta.content)
+                            yield chunk.choices[0].delta.content
+                # Frames are flushed every SSE_FLUSH_MS even while the model stalls
+                yield from timed_frames(contents(), buffer)
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            error = str(e)
+        frame = buffer.flush()
+        if frame:
+            yield frame
+        if error is not None:
+            yield f"data: {json.dumps({'error': error})}\n\n"
+        else:
+            store_analysis(cache_key, "".join(parts), finish_reasons[-1] if finish_reasons else None)
+        record_analysis_tokens(messages, "".join(parts))
+        if log_payload:
+            logging.info(f"Analysis response: {''.join(parts)}")
+ 
+    return Response(generate(), content_type='text/event-stream', headers={'X-Analysis-Cache': 'miss'})
+ 
+def analyze_resume_text(resume_text, job_description):
+    """Non-streaming variant of analyze_resume, used when ranking a candidate pool (shares its cache)."""
+    cache_key = analysis_cache_key(resume_text, job_description)
+    cached = get_cached_analysis(cache_key)
+    if cached is not None:
+        return cached
+    messages = build_analysis_messages(resume_text, job_description)
+    with observe_stage("llm_call"):
+        response = get_limiter().call(
+            lambda: openai_client.get().chat.completions.create(
+                model=ANALYSIS_MODEL,
+                messages=messages,
+                max_tokens=ANALYSIS_MAX_TOKENS,
+                temperature=0
+            ),
+            count_message_tokens(messages), ANALYSIS_MAX_TOKENS, key="analysis"
+        )
+    if response.usage:
+        record_tokens("analysis", response.usage.prompt_tokens, response.usage.completion_tokens)
+    analysis = response.choices[0].message.content
+    store_analysis(cache_key, analysis, response.choices[0].finish_reason)
+    return analysis
  
-    return Response(generate(), content_type='text/event-stream')
+def safe_analysis(resume_text, job_description):
+    try:
+        return {'analysis': analyze_resume_text(resume_text, job_description)}
+    except Exception as e:
+        logging.error(f"Analysis failed: {e}")
+        return {'analysis_error': str(e)}
+ 
+def get_cv_index():
+    """Collection storing the tokenized CVs of candidate pools (created with its index on first use)."""
+    global _cv_index_ready
+    collection = get_db()['cv_index']
+    if not _cv_index_ready:
+        collection.create_index('pool_id')
+        _cv_index_ready = True
+    return collection
+ 
+def store_pool_documents(pool_id, documents):
+    """Upsert the uploaded CVs of a pool in MongoDB with a single bulk write."""
+    operations = [
+        UpdateOne(
+            {'_id': f"{pool_id}:{doc['hash']}"},
+            {'$set': {
+                'pool_id': pool_id,
+                'filename': doc['filename'],
+                'text': doc['text'],
+                # [term, tf] pairs: terms such as node.js would be invalid field names
+                'term_freqs': sorted(doc['term_freqs'].items()),
+                'length': doc['length'],
+                'updated_at': datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        for doc in documents
+    ]
+    if operations:
+        get_cv_index().bulk_write(operations, ordered=False)
+ 
+def load_pool_documents(pool_id):
+    """Return the CVs already indexed for a pool."""
+    return [
+        {
+            'hash': stored['_id'].split(':', 1)[1],
+            'filename': stored['filename'],
+            'text': stored['text'],
+            'term_freqs': dict(stored['term_freqs']),
+            'length': stored['length']
+        }
+        for stored in get_cv_index().find({'pool_id': pool_id})
+    ]
  
  
  
@@ -102,7 +256,8 @@ def analyze_resume(resume_text, job_description):
 def analyse_cv():
     logging.info("Received a request at /analyse-cv")
     try:
-        file = request.files.get('cv')
+        with observe_stage("upload"):
+            file = request.files.get('cv')
         job_description = request.form.get('jobDescription')
  
         if not file:
@@ -115,9 +270,133 @@ def analyse_cv():
         resume_text = extract_text(file)
         return analyze_resume(resume_text, job_description)
  
+    except ExtractionError as e:
+        logging.error(f"Text extraction refused: {e}")
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error processing request: {e}\n{traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+ 
+@app.route('/rank-cvs', methods=['POST'])
+@cross_origin()
+def rank_cvs():
+    """
+    Rank many CVs against one job description: every CV is scored locally with BM25,
+    then only the top K are sent to the LLM analysis, concurrently.
+    With a poolId, the CVs are stored in MongoDB and the ranking covers the whole pool.
+    """
+    logging.info("Received a request at /rank-cvs")
+    try:
+        job_description = request.form.get('jobDescription')
+        with observe_stage("upload"):
+            files = request.files.getlist('cvs')
+        pool_id = request.form.get('poolId')
+        try:
+            top_k = int(request.form.get('topK', RANK_TOP_K))
+        except ValueError:
+            top_k = -1
+        if top_k < 0:
+            logging.error("Invalid topK")
+            return jsonify({'error': "topK must be a non-negative integer"}), 400
+ 
+        if not job_description:
+            logging.error("No job description provided")
+            return jsonify({'error': "No job description provided"}), 400
+        if not files and not pool_id:
+            logging.error("No CV file provided")
+            return jsonify({'error': "No CV file provided"}), 400
+ 
+        documents = []
+        errors = []
+        uploaded = {}
+        for file in files:
+            try:
+                text = extract_text(file)
+            except Exception as e:
+                errors.append({'filename': file.filename, 'error': str(e)})
+                continue
+            doc_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            if doc_hash in uploaded:
+                # Same extracted text: ranked once, under the first filename
+                errors.append({'filename': file.filename, 'error': f"Duplicate of {uploaded[doc_hash]}"})
+                continue
+            uploaded[doc_hash] = file.filename
+            term_freqs, length = term_frequencies(text)
+            documents.append({
+                'hash': doc_hash,
+                'filename': file.filename,
+                'text': text,
+                'term_freqs': term_freqs,
+                'length': length
+            })
+ 
+        if pool_id:
+            try:
+                store_pool_documents(pool_id, documents)
+                documents = load_pool_documents(pool_id)
+            except Exception as e:
+                logging.error(f"CV index unavailable, ranking only the uploaded CVs: {e}")
+ 
+        with observe_stage("bm25_ranking"):
+            index = BM25Index()
+            by_hash = {}
+            for doc in documents:
+                index.add(doc['hash'], doc['term_freqs'], doc['length'])
+                by_hash[doc['hash']] = doc
+            scored = index.rank(job_description)
+ 
+        # CVs sharing no term with the job description are never sent to the LLM
+        shortlisted = [result for result in scored if result[1] > 0][:top_k]
+        with ThreadPoolExecutor(max_workers=RANK_CONCURRENCY) as executor:
+            analyses = list(executor.map(
+                lambda result: safe_analysis(by_hash[result[0]]['text'], job_description),
+                shortlisted
+            ))
+ 
+        ranking = []
+        for position, (doc_hash, score, matched) in enumerate(scored):
+            entry = {
+                'rank': position + 1,
+                'filename': by_hash[doc_hash]['filename'],
+                'bm25_score': round(score, 4),
+                'matched_terms': matched
+            }
+            if position < len(analyses):
+                entry.update(analyses[position])
+            ranking.append(entry)
+ 
+        return jsonify({'ranking': ranking, 'analysed': len(analyses), 'errors': errors}), 200
+ 
     except Exception as e:
         logging.error(f"Error processing request: {e}\n{traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
  
+def check_secrets():
+    store = get_secret_store()
+    for name in ('MONGOsearchURI', 'AZUREopenaiAPIkey', 'AZUREopenaiENDPOINT'):
+        store.get(name)
+ 
+readiness_probe = ReadinessProbe({
+    'secrets': check_secrets,
+    'openai_client': openai_client.get,
+    'mongodb': lambda: mongo_client.get().admin.command('ping')
+})
+ 
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Prometheus metrics: stage latencies, errors and token counts."""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+ 
+@app.route('/health', methods=['GET'])
+def health():
+    """Liveness probe: the process answers, dependencies are not checked."""
+    return jsonify({'status': 'ok'}), 200
+ 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: secrets resolved, OpenAI client built and MongoDB reachable."""
+    is_ready, checks = readiness_probe.run()
+    return jsonify({'ready': is_ready, 'checks': checks}), 200 if is_ready else 503
+ 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,130 @@
+"""
+ASGI serving mode for app.py (uvicorn app_asgi:asgi_app).
+
+/analyse-cv streams the analysis from the async Azure OpenAI client on the event
+loop, so a single process can hold hundreds of concurrent SSE streams; text
+extraction runs in a worker thread. Every other route is served by the Flask app,
+mounted through WSGI.
+"""
+import json
+import logging
+import os
+import traceback
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import app as flask_service
+from analysis_cache import replay_frames, timed_frames_async
+from config import LazyResource
+from extraction import ExtractionError
+from llm_limiter import OPENAI_TIMEOUT_SECONDS, get_limiter
+from metrics import observe_stage
+
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "16"))
+
+
+def build_async_openai_client(api_key, azure_endpoint):
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(api_key=api_key, api_version="2024-02-15-preview", azure_endpoint=azure_endpoint,
+                            max_retries=0, timeout=OPENAI_TIMEOUT_SECONDS)
+
+async_openai_client = LazyResource(build_async_openai_client, 'AZUREopenaiAPIkey', 'AZUREopenaiENDPOINT')
+
+
+async def analyze_resume_stream(resume_text, job_description, cache_key):
+    """Async counterpart of app.analyze_resume's generator (same SSE frames, same cache)."""
+    messages = flask_service.build_analysis_messages(resume_text, job_description)
+    parts = []
+    finish_reasons = []
+    buffer = flask_service.new_chunk_buffer()
+    error = None
+    try:
+        with observe_stage("llm_call"):
+            client = await run_in_threadpool(async_openai_client.get)
+            response = get_limiter().stream_async(
+                lambda: client.chat.completions.create(
+                    model=flask_service.ANALYSIS_MODEL,
+                    messages=messages,
+                    max_tokens=flask_service.ANALYSIS_MAX_TOKENS,
+                    temperature=0,
+                    stream=True
+                ),
+                flask_service.count_message_tokens(messages), flask_service.ANALYSIS_MAX_TOKENS,
+                key="analysis_stream"
+            )
+
+            async def contents():
+                async for chunk in response:
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        finish_reasons.append(chunk.choices[0].finish_reason)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            async for frame in timed_frames_async(contents(), buffer):
+                yield frame
+    except Exception as e:
+        error = str(e)
+    frame = buffer.flush()
+    if frame:
+        yield frame
+    if error is not None:
+        yield f"data: {json.dumps({'error': error})}\n\n"
+    else:
+        flask_service.store_analysis(cache_key, "".join(parts), finish_reasons[-1] if finish_reasons else None)
+    flask_service.record_analysis_tokens(messages, "".join(parts))
+
+
+async def analyse_cv(request):
+    logging.info("Received a request at /analyse-cv (ASGI)")
+    try:
+        with observe_stage("upload"):
+            form = await request.form()
+        file = form.get('cv')
+        job_description = form.get('jobDescription')
+
+        if file is None or isinstance(file, str):
+            logging.error("No CV file provided")
+            return JSONResponse({'error': "No CV file provided"}, status_code=400)
+        if not job_description:
+            logging.error("No job description provided")
+            return JSONResponse({'error': "No job description provided"}, status_code=400)
+
+        data = await file.read()
+        resume_text = await run_in_threadpool(flask_service.extract_resume_bytes, data, file.filename)
+        cache_key = flask_service.analysis_cache_key(resume_text, job_description)
+        cached = flask_service.get_cached_analysis(cache_key)
+        if cached is not None:
+            logging.info("Analysis found in the cache, replaying it")
+            return StreamingResponse(replay_frames(cached), media_type='text/event-stream',
+                                     headers={'X-Analysis-Cache': 'hit'})
+        return StreamingResponse(analyze_resume_stream(resume_text, job_description, cache_key),
+                                 media_type='text/event-stream', headers={'X-Analysis-Cache': 'miss'})
+
+    except ExtractionError as e:
+        logging.error(f"Text extraction refused: {e}")
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logging.error(f"Error processing request: {e}\n{traceback.format_exc()}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+asgi_app = Starlette(
+    routes=[
+        Route('/analyse-cv', analyse_cv, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_service.app, workers=WSGI_THREADS))
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["https://talent.heptasys.com"], allow_methods=["*"],
+                   allow_headers=["Content-Type", "Authorization", "X-Requested-With"])
+    ]
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(asgi_app, host='0.0.0.0', port=int(os.getenv("PORT", "5000")))
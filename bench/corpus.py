@@ -0,0 +1,122 @@
+"""
+Corpus de CV générés pour le banc d'essai : PDF texte, PDF scanné, DOCX et image,
+en version courte et très longue (déclenche l'extraction par segments).
+
+La génération est déterministe (graine fixe) pour que deux exécutions soient comparables.
+"""
+import io
+import random
+
+import fitz  # PyMuPDF
+from docx import Document
+from PIL import Image, ImageDraw
+
+FIRST_NAMES = ["Jean", "Marie", "Karim", "Sophie", "Lucas", "Inès", "Thomas", "Camille"]
+LAST_NAMES = ["Dupont", "Martin", "Benali", "Durand", "Lefebvre", "Moreau", "Nguyen", "Petit"]
+TITLES = ["Ingénieur DevOps", "Développeur Python", "Consultant SAP", "Data engineer", "Chef de projet"]
+COMPANIES = ["Société Générale", "Capgemini", "Orange", "Airbus", "BNP Paribas", "Thales", "SNCF", "Renault"]
+TOOLS = ["Python", "Django", "Kubernetes", "Docker", "Azure", "AWS", "Terraform", "SAP", "Java", "Spark",
+         "PostgreSQL", "Kafka", "React", "Angular", "Jenkins", "GitLab CI"]
+TASKS = ["Conception de l'architecture", "Mise en place de la chaîne CI/CD", "Migration vers le cloud",
+         "Animation des ateliers métier", "Développement des API REST", "Supervision et alerting",
+         "Rédaction des spécifications", "Optimisation des performances", "Encadrement de l'équipe"]
+
+# Nombre d'expériences par taille de CV
+SIZES = {"small": 2, "large": 40}
+KINDS = ("text_pdf", "scanned_pdf", "docx", "image")
+OCR_KINDS = ("scanned_pdf", "image")
+
+
+def cv_text(size, seed=0):
+    """
+    Texte d'un CV fictif : en-tête, `SIZES[size]` expériences datées, formation et compétences.
+    """
+    rng = random.Random(f"{size}-{seed}")
+    lines = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}", rng.choice(TITLES),
+             "06 12 34 56 78 - prenom.nom@example.com", "", "Expériences professionnelles"]
+    year = 2024
+    for _ in range(SIZES[size]):
+        start = year - rng.randint(1, 3)
+        lines.append(f"{start} - {year} {rng.choice(COMPANIES)}")
+        lines.append(f"Mission : {rng.choice(TITLES)}")
+        lines.extend(f"- {task}" for task in rng.sample(TASKS, 3))
+        lines.append("Environnement : " + ", ".join(rng.sample(TOOLS, 5)))
+        lines.append("")
+        year = start
+    lines += ["Formation", f"{year - 2} Master informatique, Université Paris-Saclay", "",
+              "Compétences", ", ".join(rng.sample(TOOLS, 8))]
+    return "\n".join(lines)
+
+
+def _pages(text, lines_per_page=50):
+    lines = text.splitlines()
+    return ["\n".join(lines[i:i + lines_per_page]) for i in range(0, len(lines), lines_per_page)] or [""]
+
+
+def text_pdf(text):
+    doc = fitz.open()
+    for page_text in _pages(text):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), page_text, fontsize=10)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _page_image(page_text, width=1240, height=1754):
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(page_text.splitlines()):
+        draw.text((80, 80 + i * 30), line, fill=0)
+    return image
+
+
+def image_png(text):
+    buffer = io.BytesIO()
+    _page_image(_pages(text)[0]).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def scanned_pdf(text):
+    """
+    PDF sans couche texte : chaque page est une image (passe par l'OCR).
+    """
+    doc = fitz.open()
+    for page_text in _pages(text):
+        buffer = io.BytesIO()
+        _page_image(page_text).save(buffer, format="PNG")
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def docx_file(text):
+    document = Document()
+    for line in text.splitlines():
+        document.add_paragraph(line)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+BUILDERS = {
+    "text_pdf": (text_pdf, "pdf"),
+    "scanned_pdf": (scanned_pdf, "pdf"),
+    "docx": (docx_file, "docx"),
+    "image": (image_png, "png"),
+}
+
+
+def build_corpus(kinds=KINDS, sizes=tuple(SIZES)):
+    """
+    Retourne la liste des documents {"name", "kind", "size", "data"}.
+    """
+    corpus = []
+    for size in sizes:
+        text = cv_text(size)
+        for kind in kinds:
+            builder, extension = BUILDERS[kind]
+            corpus.append({"name": f"{kind}_{size}.{extension}", "kind": kind, "size": size, "data": builder(text)})
+    return corpus
@@ -0,0 +1,153 @@
+"""
+Substituts locaux d'Azure OpenAI et d'Azure Blob Storage pour le banc d'essai.
+
+Les clients exposent le sous-ensemble d'API utilisé par convert.py et app.py, avec une
+latence configurable, et s'injectent à la place des LazyResource des deux services.
+"""
+import copy
+import itertools
+import json
+import os
+import time
+from types import SimpleNamespace
+
+from azure.core.exceptions import ResourceExistsError
+
+CANNED_CV = {
+    "job_title": "Ingénieur DevOps",
+    "full_name": "Jean Dupont",
+    "years_of_experience": "8",
+    "contact_information": {"phone": "06 12 34 56 78", "email": "prenom.nom@example.com", "website": ""},
+    "education": [{"degree": "Master informatique", "institution": "Université Paris-Saclay",
+                   "year_of_completion": "2014"}],
+    "professional_experience": [
+        {"company_name": company, "date_range": f"{2024 - 2 * i - 2} - {2024 - 2 * i}",
+         "mission": "Ingénieur DevOps",
+         "tasks": ["Mise en place de la chaîne CI/CD", "Migration vers le cloud", "Supervision et alerting"],
+         "tech_tools": ["Kubernetes", "Terraform", "Azure", "GitLab CI"]}
+        for i, company in enumerate(["Orange", "Airbus", "Thales", "SNCF"])
+    ],
+    "skills": {"Cloud": "Azure, AWS", "DevOps": "Kubernetes, Docker, Terraform", "Langages": "Python, Bash"},
+    "certifications": ["CKA", "AZ-104"]
+}
+
+CANNED_ANALYSIS = (
+    "1. Email : prenom.nom@example.com\n2. Téléphone : 06 12 34 56 78\n3. Adresse : non renseignée\n"
+    "4. Compétences clés :\n- Kubernetes\n- Terraform\n- Azure\n5. Expériences principales : Orange, Airbus\n"
+    "6. Score : 72\n7. Recommandation : Oui\n8. Justification : le profil couvre l'essentiel du descriptif.\n"
+    "9. Pour améliorer le CV : détailler les projets cloud."
+)
+
+
+def _split(text, chunk_chars):
+    return [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+
+
+class FakeOpenAI:
+    """
+    Client factice : complétions (extraction) et chat (analyse), en flux ou non.
+
+    latency_ms : délai avant la réponse (ou le premier fragment) ;
+    chunk_ms : délai entre deux fragments d'un flux de `chunk_chars` caractères.
+    Le JSON renvoyé varie à chaque appel pour ne pas être dédoublonné par les noms
+    de blobs adressés par le contenu.
+    """
+
+    def __init__(self, latency_ms=800, chunk_ms=20, chunk_chars=24):
+        self.latency = latency_ms / 1000
+        self.chunk_delay = chunk_ms / 1000
+        self.chunk_chars = chunk_chars
+        self._counter = itertools.count(1)
+        self.completions = SimpleNamespace(create=self._create_completion)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat))
+
+    def _cv_json(self):
+        data = copy.deepcopy(CANNED_CV)
+        data["full_name"] = f"Candidat {next(self._counter)}"
+        return json.dumps(data, ensure_ascii=False)
+
+    def _usage(self, prompt, completion):
+        return SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(completion) // 4)
+
+    def _stream(self, parts, make_chunk):
+        # Comme l'API : finish_reason vaut None sauf sur le dernier fragment
+        time.sleep(self.latency)
+        for index, part in enumerate(parts):
+            time.sleep(self.chunk_delay)
+            yield make_chunk(part, "stop" if index == len(parts) - 1 else None)
+
+    def _create_completion(self, model=None, prompt="", stream=False, **kwargs):
+        text = self._cv_json()
+        if stream:
+            return self._stream(_split(text, self.chunk_chars),
+                                lambda part, finish: SimpleNamespace(choices=[SimpleNamespace(text=part, finish_reason=finish)]))
+        time.sleep(self.latency)
+        return SimpleNamespace(choices=[SimpleNamespace(text=text, finish_reason="stop")], usage=self._usage(prompt, text))
+
+    def _create_chat(self, model=None, messages=(), stream=False, **kwargs):
+        prompt = "".join(message["content"] for message in messages)
+        if stream:
+            return self._stream(
+                _split(CANNED_ANALYSIS, self.chunk_chars),
+                lambda part, finish: SimpleNamespace(
+                    choices=[SimpleNamespace(delta=SimpleNamespace(content=part), finish_reason=finish)]))
+        time.sleep(self.latency)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=CANNED_ANALYSIS),
+                                                        finish_reason="stop")],
+                               usage=self._usage(prompt, CANNED_ANALYSIS))
+
+
+class FileBlobClient:
+    def __init__(self, store, container, blob):
+        self.path = os.path.join(store.root, container, blob)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def upload_blob(self, data, length=None, overwrite=True, **kwargs):
+        if not overwrite and os.path.exists(self.path):
+            raise ResourceExistsError("The specified blob already exists.")
+        if hasattr(data, "read"):
+            data = data.read()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+
+class FileContainerClient:
+    def __init__(self, store, container):
+        self.path = os.path.join(store.root, container)
+
+    def get_container_properties(self, **kwargs):
+        os.makedirs(self.path, exist_ok=True)
+        return {"name": os.path.basename(self.path)}
+
+
+class FileBlobStore:
+    """
+    Substitut de BlobServiceClient adossé à un répertoire local.
+    """
+    account_name = "benchaccount"
+    credential = SimpleNamespace(account_key="YmVuY2g=")
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def get_blob_client(self, container, blob):
+        return FileBlobClient(self, container, blob)
+
+    def get_container_client(self, container):
+        return FileContainerClient(self, container)
+
+
+class StaticResource:
+    """
+    Remplace une LazyResource : get() retourne toujours le même objet.
+    """
+
+    def __init__(self, instance):
+        self.instance = instance
+
+    def get(self):
+        return self.instance
@@ -0,0 +1,261 @@
+"""
+Banc d'essai hors ligne de /template (convert.py) et /analyse-cv (app.py).
+
+Les deux applications Flask tournent dans ce processus avec un client OpenAI factice
+et un stockage Blob sur disque (bench/fakes.py), sur un corpus de CV générés
+(bench/corpus.py). Pour chaque scénario et niveau de concurrence, le banc mesure les
+percentiles de latence de bout en bout et par étape (métriques de metrics.py), le débit
+et le pic de mémoire résidente. Avec --baseline, l'exécution échoue (code 1) si une
+mesure se dégrade au-delà de --max-regression.
+
+    python bench/run.py --concurrency 1,4,16 --requests 32 --output bench.json
+    python bench/run.py --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+JOB_DESCRIPTION = ("Nous recherchons un ingénieur DevOps maîtrisant Kubernetes, Terraform et Azure "
+                   "pour industrialiser la chaîne CI/CD et superviser les plateformes cloud.")
+SCENARIOS = ("template", "analyse")
+PERCENTILES = (50, 95, 99)
+
+
+def configure_environment(work_dir):
+    """
+    Secrets factices (aucun appel au Key Vault), caches d'extraction et d'analyse et
+    index des candidats (MongoDB) désactivés, avant l'import des services.
+    """
+    os.environ.setdefault("SECRET_AZUREopenaiAPIkey", "bench")
+    os.environ.setdefault("SECRET_AZUREopenaiENDPOINT", "https://bench.openai.azure.com/")
+    os.environ.setdefault("SECRET_connectstr", "DefaultEndpointsProtocol=https;AccountName=benchaccount;"
+                                               "AccountKey=YmVuY2g=;EndpointSuffix=core.windows.net")
+    os.environ.setdefault("SECRET_MONGOsearchURI", "mongodb://localhost:27017/")
+    os.environ["CV_CACHE_ENABLED"] = "false"
+    os.environ["CV_CACHE_DIR"] = os.path.join(work_dir, "cache")
+    os.environ["ANALYSIS_CACHE_ENABLED"] = "false"
+    os.environ["CANDIDATE_INDEX_ENABLED"] = "false"
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    summary = {f"p{p}": round(percentile(values, p) * 1000, 2) for p in PERCENTILES} if values else {}
+    summary["count"] = len(values)
+    return summary
+
+
+class StageRecorder:
+    """
+    Recopie chaque observation de cv_stage_duration_seconds pour calculer des percentiles exacts.
+    """
+
+    def __init__(self, histogram):
+        self.samples = {}
+        self._lock = threading.Lock()
+        observe = histogram.observe
+
+        def recording_observe(value, **labels):
+            with self._lock:
+                self.samples.setdefault(labels.get("stage", ""), []).append(value)
+            observe(value, **labels)
+        histogram.observe = recording_observe
+
+    def reset(self):
+        with self._lock:
+            samples, self.samples = self.samples, {}
+        return samples
+
+
+def peak_rss_mb():
+    # ru_maxrss est en kilo-octets sous Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def make_request(scenario, services, document):
+    if scenario == "template":
+        client = services["convert"].app.test_client()
+        response = client.post("/template", data={"file": (document["data"], document["name"])},
+                               content_type="multipart/form-data")
+        body = response.get_data()
+    else:
+        client = services["app"].app.test_client()
+        response = client.post("/analyse-cv", data={"cv": (document["data"], document["name"]),
+                                                    "jobDescription": JOB_DESCRIPTION},
+                               content_type="multipart/form-data")
+        body = response.get_data()
+        # Le flux SSE signale ses erreurs dans un événement et non par le statut HTTP
+        if b'"error"' in body:
+            return False
+    return response.status_code == 200 and bool(body)
+
+
+def run_level(scenario, services, corpus, concurrency, total_requests, recorder):
+    """
+    Envoie `total_requests` requêtes (en parcourant le corpus) avec `concurrency` clients simultanés.
+    """
+    from io import BytesIO
+    recorder.reset()
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def one(i):
+        document = corpus[i % len(corpus)]
+        request_document = {**document, "data": BytesIO(document["data"])}
+        started = time.perf_counter()
+        try:
+            ok = make_request(scenario, services, request_document)
+        except Exception as e:
+            ok = False
+            print(f"  erreur sur {document['name']} : {e}", file=sys.stderr)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                failures.append(document["name"])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total_requests)))
+    wall = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "failures": len(failures),
+        "throughput_rps": round(total_requests / wall, 3),
+        "latency_ms": summarize(latencies),
+        "stages_ms": {stage: summarize(values) for stage, values in sorted(recorder.reset().items())},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(results, baseline, max_regression):
+    """
+    Retourne la liste des régressions : latences (p50/p95) et pic mémoire en hausse,
+    ou débit en baisse, de plus de `max_regression` (fraction) par rapport à la référence.
+    """
+    regressions = []
+    for scenario, levels in results["scenarios"].items():
+        base_levels = {level["concurrency"]: level for level in baseline.get("scenarios", {}).get(scenario, [])}
+        for level in levels:
+            base = base_levels.get(level["concurrency"])
+            if not base:
+                continue
+            where = f"{scenario} c={level['concurrency']}"
+            checks = [(f"{where} latence {p}", level["latency_ms"].get(p), base["latency_ms"].get(p))
+                      for p in ("p50", "p95")]
+            for stage, summary in level["stages_ms"].items():
+                checks.append((f"{where} étape {stage} p95", summary.get("p95"),
+                               base["stages_ms"].get(stage, {}).get("p95")))
+            checks.append((f"{where} pic RSS (Mo)", level["peak_rss_mb"], base["peak_rss_mb"]))
+            for label, value, reference in checks:
+                if value is not None and reference and value > reference * (1 + max_regression):
+                    regressions.append(f"{label} : {value} contre {reference}")
+            if level["throughput_rps"] < base["throughput_rps"] * (1 - max_regression):
+                regressions.append(f"{where} débit : {level['throughput_rps']} contre {base['throughput_rps']} req/s")
+    return regressions
+
+
+def print_report(results):
+    for scenario, levels in results["scenarios"].items():
+        print(f"\n== {scenario} ==")
+        for level in levels:
+            latency = level["latency_ms"]
+            print(f"c={level['concurrency']:<3} {level['throughput_rps']:>8} req/s  "
+                  f"p50={latency.get('p50')} p95={latency.get('p95')} p99={latency.get('p99')} ms  "
+                  f"échecs={level['failures']}  RSS={level['peak_rss_mb']} Mo")
+            for stage, summary in level["stages_ms"].items():
+                print(f"      {stage:<16} p50={summary.get('p50')} p95={summary.get('p95')} "
+                      f"p99={summary.get('p99')} ms (n={summary['count']})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16", help="niveaux de concurrence, séparés par des virgules")
+    parser.add_argument("--requests", type=int, default=16, help="requêtes par niveau")
+    parser.add_argument("--kinds", default="text_pdf,scanned_pdf,docx,image")
+    parser.add_argument("--sizes", default="small,large")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--llm-chunk-ms", type=float, default=20)
+    parser.add_argument("--output", help="fichier JSON des résultats")
+    parser.add_argument("--baseline", help="résultats de référence (JSON) pour détecter les régressions")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="cv-bench-")
+    configure_environment(work_dir)
+
+    import corpus as corpus_module
+    from fakes import FakeOpenAI, FileBlobStore, StaticResource
+    import metrics
+    import convert
+    import app
+
+    fake_openai = FakeOpenAI(latency_ms=args.llm_latency_ms, chunk_ms=args.llm_chunk_ms)
+    convert.openai_client = StaticResource(fake_openai)
+    convert.blob_client_resource = StaticResource(FileBlobStore(os.path.join(work_dir, "blobs")))
+    app.openai_client = StaticResource(fake_openai)
+    services = {"convert": convert, "app": app}
+    recorder = StageRecorder(metrics.STAGE_SECONDS)
+
+    kinds = [kind for kind in args.kinds.split(",") if kind]
+    if not shutil.which("tesseract"):
+        skipped = [kind for kind in kinds if kind in corpus_module.OCR_KINDS]
+        if skipped:
+            print(f"tesseract introuvable : documents {', '.join(skipped)} ignorés", file=sys.stderr)
+        kinds = [kind for kind in kinds if kind not in corpus_module.OCR_KINDS]
+    corpus = corpus_module.build_corpus(kinds, [size for size in args.sizes.split(",") if size])
+
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "corpus": [{"name": document["name"], "bytes": len(document["data"])} for document in corpus],
+        "scenarios": {}
+    }
+    try:
+        for scenario in [name for name in args.scenarios.split(",") if name]:
+            results["scenarios"][scenario] = [
+                run_level(scenario, services, corpus, int(level), args.requests, recorder)
+                for level in args.concurrency.split(",")
+            ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n{len(regressions)} régression(s) au-delà de {args.max_regression:.0%} :")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print("\nAucune régression par rapport à la référence.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
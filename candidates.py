@@ -0,0 +1,332 @@
+"""
+Index des candidats dans MongoDB : chaque extraction est conservée avec les liens vers
+les documents générés, pour répondre aux recherches (compétences, mots-clés, expérience,
+entreprises, certifications) sans renvoyer les CV au modèle.
+
+Les écritures sont regroupées : submit() met le document en attente et un thread les
+envoie par bulk_write (au plus CANDIDATE_BATCH_SIZE documents, toutes les
+CANDIDATE_FLUSH_SECONDS secondes). Les champs de recherche sont normalisés (minuscules,
+accents retirés) et indexés : compétences et mots-clés sous forme de termes
+(ranking.tokenize), entreprises et certifications sous forme de libellés recherchés par
+préfixe, années d'expérience sous forme numérique.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from datetime import datetime, timezone
+
+from metrics import counter
+from ranking import tokenize
+
+CANDIDATE_INDEX_ENABLED = os.getenv("CANDIDATE_INDEX_ENABLED", "true").lower() == "true"
+CANDIDATE_BATCH_SIZE = int(os.getenv("CANDIDATE_BATCH_SIZE", "100"))
+CANDIDATE_FLUSH_SECONDS = float(os.getenv("CANDIDATE_FLUSH_SECONDS", "1"))
+# Documents en attente au-delà desquels les plus anciens sont abandonnés (MongoDB indisponible)
+CANDIDATE_MAX_PENDING = int(os.getenv("CANDIDATE_MAX_PENDING", "10000"))
+SEARCH_MAX_RESULTS = 100
+# Recherche de la version précédente d'un CV (extraction incrémentale) : elle précède l'appel
+# au modèle, son délai est donc borné, et elle est suspendue après un échec (MongoDB indisponible)
+CANDIDATE_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("CANDIDATE_LOOKUP_TIMEOUT_SECONDS", "0.5"))
+CANDIDATE_LOOKUP_RETRY_SECONDS = float(os.getenv("CANDIDATE_LOOKUP_RETRY_SECONDS", "60"))
+
+CANDIDATE_WRITES = counter("cv_candidates_written_total", "Candidats écrits dans l'index MongoDB, par résultat.",
+                           ("outcome",))
+
+_YEARS_RE = re.compile(r"\d+(?:[.,]\d+)?")
+# Champs renvoyés par la recherche (le JSON complet et les termes restent en base)
+SEARCH_PROJECTION = {"data": 0, "terms": 0, "blocks": 0, "block_hashes": 0}
+
+
+def normalize_label(text):
+    """
+    Libellé comparable : minuscules, sans accents, espaces simplifiés.
+    """
+    text = unicodedata.normalize("NFKD", str(text or "")).encode("ascii", "ignore").decode("ascii")
+    return " ".join(text.lower().split())
+
+
+def parse_years(value):
+    """
+    Nombre d'années d'expérience ("10 ans", "5+", "3,5 years"), ou None.
+    """
+    match = _YEARS_RE.search(str(value or ""))
+    return float(match.group().replace(",", ".")) if match else None
+
+
+def _skills_text(skills):
+    if isinstance(skills, dict):
+        return " ".join(f"{category} {value}" for category, value in skills.items())
+    return str(skills or "")
+
+
+def candidate_id(json_data):
+    """
+    Identifiant du candidat : e-mail, à défaut téléphone, à défaut empreinte du JSON.
+    Un CV mis à jour remplace ainsi l'entrée précédente du même candidat.
+    """
+    contact = json_data.get("contact_information") or {}
+    for field in ("email", "phone"):
+        value = normalize_label(contact.get(field)).replace(" ", "")
+        if value:
+            return hashlib.sha256(f"{field}:{value}".encode("utf-8")).hexdigest()[:32]
+    canonical = json.dumps(json_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def phone_key(value):
+    """
+    Numéro de téléphone comparable : ses 9 derniers chiffres (indicatif "+33" ou "0"
+    ignoré), ou None s'il en compte moins.
+    """
+    digits = re.sub(r"\D", "", str(value or ""))
+    return digits[-9:] if len(digits) >= 9 else None
+
+
+def candidate_document(json_data, files, filename=None, template_name=None, fingerprints=None):
+    """
+    Document MongoDB d'un candidat : champs de recherche normalisés, JSON extrait et
+    noms des fichiers générés ({"pdf": ..., "docx": ...}). `fingerprints` (empreintes des
+    blocs du texte, voir incremental.py) n'est renseigné que si le texte source est connu ;
+    sinon les empreintes déjà enregistrées sont conservées.
+    """
+    experiences = [exp for exp in json_data.get("professional_experience") or [] if isinstance(exp, dict)]
+    education = [edu for edu in json_data.get("education") or [] if isinstance(edu, dict)]
+    certifications = [str(c) for c in json_data.get("certifications") or []]
+    companies = [exp.get("company_name") for exp in experiences if exp.get("company_name")]
+    skills_text = _skills_text(json_data.get("skills"))
+
+    searchable = [json_data.get("job_title"), json_data.get("full_name"), skills_text] + certifications + companies
+    for exp in experiences:
+        searchable += [exp.get("mission")] + list(exp.get("tasks") or []) + list(exp.get("tech_tools") or [])
+    for edu in education:
+        searchable += [edu.get("degree"), edu.get("institution")]
+    terms = set(tokenize(" ".join(str(item) for item in searchable if item)))
+
+    document = {
+        "_id": candidate_id(json_data),
+        "full_name": json_data.get("full_name", ""),
+        "job_title": json_data.get("job_title", ""),
+        "years_of_experience": parse_years(json_data.get("years_of_experience")),
+        "skills": sorted(set(tokenize(skills_text)) | set(tokenize(" ".join(
+            " ".join(exp.get("tech_tools") or []) for exp in experiences)))),
+        "certifications": sorted({normalize_label(c) for c in certifications if normalize_label(c)}),
+        "companies": sorted({normalize_label(c) for c in companies if normalize_label(c)}),
+        "terms": sorted(terms),
+        "files": files,
+        "filename": filename,
+        "template": template_name,
+        "data": json_data
+    }
+    if fingerprints is not None:
+        document["blocks"] = fingerprints
+        document["block_hashes"] = sorted({fingerprint["hash"] for fingerprint in fingerprints})
+    return document
+
+
+class CandidateIndex:
+    """
+    Collection des candidats : écritures groupées en arrière-plan et recherche.
+    `collection_getter` retourne la collection pymongo (client résolu au premier usage).
+    """
+
+    def __init__(self, collection_getter, batch_size=CANDIDATE_BATCH_SIZE, flush_seconds=CANDIDATE_FLUSH_SECONDS,
+                 max_pending=CANDIDATE_MAX_PENDING, lookup_timeout=CANDIDATE_LOOKUP_TIMEOUT_SECONDS,
+                 lookup_retry=CANDIDATE_LOOKUP_RETRY_SECONDS):
+        self.collection_getter = collection_getter
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.lookup_timeout = lookup_timeout
+        self.lookup_retry = lookup_retry
+        self._lookup_paused_until = 0.0
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._indexes_ready = False
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def collection(self):
+        """
+        Collection des candidats, index créés au premier usage.
+        """
+        from pymongo import ASCENDING, DESCENDING
+        collection = self.collection_getter()
+        if not self._indexes_ready:
+            collection.create_index([("skills", ASCENDING)])
+            collection.create_index([("terms", ASCENDING)])
+            collection.create_index([("certifications", ASCENDING)])
+            collection.create_index([("companies", ASCENDING)])
+            collection.create_index([("years_of_experience", DESCENDING)])
+            collection.create_index([("block_hashes", ASCENDING)])
+            self._indexes_ready = True
+        return collection
+
+    def submit(self, document):
+        """
+        Met le document en attente d'écriture ; une version plus récente du même
+        candidat remplace celle en attente.
+        """
+        document = dict(document, updated_at=datetime.now(timezone.utc))
+        with self._cond:
+            self._pending.pop(document["_id"], None)
+            self._pending[document["_id"]] = document
+            while len(self._pending) > self.max_pending:
+                self._pending.pop(next(iter(self._pending)))
+                self.dropped += 1
+                CANDIDATE_WRITES.inc(outcome="dropped")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="candidate-writer")
+                self._thread.start()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _take(self):
+        with self._cond:
+            batch = list(self._pending.values())[:self.batch_size]
+            for document in batch:
+                del self._pending[document["_id"]]
+            return batch
+
+    def _run(self):
+        failed = False
+        while True:
+            with self._cond:
+                # Après un échec, attente d'un intervalle complet avant de réessayer
+                if failed or len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_seconds)
+            failed = not self.flush()
+
+    def flush(self):
+        """
+        Écrit tous les documents en attente. Retourne False si une écriture a échoué
+        (les documents concernés sont remis en attente).
+        """
+        with self._write_lock:
+            batch = self._take()
+            while batch:
+                if not self._write(batch):
+                    return False
+                batch = self._take()
+        return True
+
+    def _write(self, batch):
+        from pymongo import UpdateOne
+        operations = [
+            UpdateOne(
+                {"_id": document["_id"]},
+                {"$set": {key: value for key, value in document.items() if key != "_id"},
+                 "$setOnInsert": {"created_at": document["updated_at"]}},
+                upsert=True
+            )
+            for document in batch
+        ]
+        try:
+            self.collection().bulk_write(operations, ordered=False)
+        except Exception as e:
+            logging.error(f"Échec de l'écriture de {len(batch)} candidats dans MongoDB : {e}")
+            self.failed += len(batch)
+            CANDIDATE_WRITES.inc(len(batch), outcome="error")
+            with self._cond:
+                for document in batch:
+                    # Une version plus récente soumise entre-temps est conservée
+                    self._pending.setdefault(document["_id"], document)
+            return False
+        self.written += len(batch)
+        CANDIDATE_WRITES.inc(len(batch), outcome="written")
+        logging.info(f"{len(batch)} candidats écrits dans MongoDB.")
+        return True
+
+    def get(self, candidate_id):
+        """
+        Candidat enregistré (version en attente d'écriture comprise), ou None.
+        """
+        with self._cond:
+            pending = self._pending.get(candidate_id)
+        if pending is not None:
+            return dict(pending)
+        return self.collection().find_one({"_id": candidate_id}, {"terms": 0})
+
+    def find_previous(self, candidate_id=None, block_hashes=(), header_hash=None, phones=(), limit=5):
+        """
+        Versions enregistrées susceptibles de correspondre à un nouveau CV : celle du même
+        identifiant si le CV contient un e-mail ; sinon celles sans e-mail qui ont au moins
+        un bloc de texte identique et le même en-tête (`header_hash`, premier bloc) ou un
+        numéro de téléphone présent dans le CV (`phones`, voir phone_key). Un bloc commun
+        seul (section type, texte recopié) ne suffit pas : le JSON d'un autre candidat
+        n'est jamais repris. Seules les entrées qui ont des empreintes de blocs sont retournées.
+        La requête est limitée à lookup_timeout secondes ; après un échec (exception
+        propagée), les recherches suivantes retournent [] pendant lookup_retry secondes.
+        """
+        if time.monotonic() < self._lookup_paused_until:
+            return []
+        phones = set(phones)
+        if candidate_id:
+            query = {"_id": candidate_id}
+        elif block_hashes and (header_hash or phones):
+            same_person = [{"blocks.0.hash": header_hash}] if header_hash else []
+            if phones:
+                same_person.append({"data.contact_information.phone": {"$nin": ["", None]}})
+            query = {"block_hashes": {"$in": list(block_hashes)},
+                     "data.contact_information.email": {"$in": ["", None]},
+                     "$or": same_person}
+        else:
+            return []
+        query["blocks"] = {"$exists": True}
+        from pymongo import timeout
+        try:
+            with timeout(self.lookup_timeout):
+                versions = list(self.collection().find(query, {"data": 1, "blocks": 1}).limit(limit * 4))
+        except Exception:
+            self._lookup_paused_until = time.monotonic() + self.lookup_retry
+            raise
+        if candidate_id:
+            return versions[:limit]
+        return [
+            version for version in versions
+            if (header_hash and version["blocks"] and version["blocks"][0]["hash"] == header_hash)
+            or phone_key((version["data"].get("contact_information") or {}).get("phone")) in phones
+        ][:limit]
+
+    def search(self, skills=(), keywords="", min_years=None, max_years=None, company=None, certification=None,
+               limit=20):
+        """
+        Candidats possédant toutes les compétences et tous les mots-clés demandés, filtrés
+        par années d'expérience et par préfixe d'entreprise ou de certification ; les plus
+        expérimentés d'abord.
+        """
+        from pymongo import DESCENDING
+        query = {}
+        skill_terms = list(dict.fromkeys(term for skill in skills for term in tokenize(skill)))
+        if skill_terms:
+            query["skills"] = {"$all": skill_terms}
+        keyword_terms = list(dict.fromkeys(tokenize(keywords)))
+        if keyword_terms:
+            query["terms"] = {"$all": keyword_terms}
+        years = {}
+        if min_years is not None:
+            years["$gte"] = min_years
+        if max_years is not None:
+            years["$lte"] = max_years
+        if years:
+            query["years_of_experience"] = years
+        for field, value in (("companies", company), ("certifications", certification)):
+            label = normalize_label(value)
+            if label:
+                query[field] = {"$regex": f"^{re.escape(label)}"}
+        cursor = self.collection().find(query, SEARCH_PROJECTION).sort(
+            [("years_of_experience", DESCENDING), ("updated_at", DESCENDING)]
+        ).limit(max(1, min(limit, SEARCH_MAX_RESULTS)))
+        return list(cursor)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {"pending": pending, "written": self.written, "failed": self.failed, "dropped": self.dropped}
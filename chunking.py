@@ -0,0 +1,222 @@
+"""
+Découpage des CV longs en segments bornés en tokens et fusion des extractions partielles.
+
+Le texte est découpé sur les titres de section et les débuts d'expérience (lignes
+commençant par une date), puis les blocs sont regroupés en segments ne dépassant pas
+le budget de tokens. Les JSON partiels sont fusionnés dans l'ordre des segments, ce qui
+conserve l'ordre d'origine des expériences.
+"""
+import re
+
+from tokenizer import count_tokens
+
+SECTION_HEADING_RE = re.compile(
+    r"^\s*(expériences?|experiences?|parcours|formations?|diplômes?|diplomes?|éducation|education|"
+    r"compétences|competences|skills|certifications?|langues|projets|références|references|"
+    r"centres d'intérêt|centres d'interet|loisirs|profil|résumé|resume)\b",
+    re.IGNORECASE
+)
+MONTHS = r"(?:janv|févr|fevr|mars|avr|mai|juin|juil|août|aout|sept|oct|nov|déc|dec|jan|feb|apr|may|jun|jul|aug|sep)[a-zéû]*\.?"
+EXPERIENCE_START_RE = re.compile(
+    rf"^\s*(?:depuis\s+|de\s+|du\s+)?(?:{MONTHS}\s+)?(?:\d{{1,2}}[/.-])?(?:19|20)\d{{2}}\b",
+    re.IGNORECASE
+)
+MAX_HEADING_LENGTH = 60
+
+
+def is_block_boundary(line):
+    """
+    Indique si la ligne ouvre un nouveau bloc : titre de section ou début d'expérience daté.
+    """
+    stripped = line.strip()
+    if not stripped:
+        return False
+    if len(stripped) <= MAX_HEADING_LENGTH and SECTION_HEADING_RE.match(stripped):
+        return True
+    return bool(EXPERIENCE_START_RE.match(stripped))
+
+
+def split_blocks(text):
+    """
+    Découpe le texte en blocs (en-tête du CV, sections, expériences) dans l'ordre d'origine.
+    """
+    blocks, current = [], []
+    for line in text.splitlines():
+        if current and is_block_boundary(line):
+            blocks.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    if current:
+        blocks.append("\n".join(current).strip())
+    return [block for block in blocks if block]
+
+
+def _split_oversized(block, max_tokens):
+    """
+    Découpe ligne par ligne un bloc qui dépasse à lui seul le budget.
+    """
+    parts, current, current_tokens = [], [], 0
+    for line in block.splitlines():
+        line_tokens = count_tokens(line) + 1
+        if current and current_tokens + line_tokens > max_tokens:
+            parts.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+
+def chunk_text(text, max_tokens):
+    """
+    Regroupe les blocs du texte en segments d'au plus `max_tokens` tokens (hors prompt).
+    """
+    chunks, current, current_tokens = [], [], 0
+    for block in split_blocks(text):
+        block_tokens = count_tokens(block) + 1
+        pieces = [block] if block_tokens <= max_tokens else _split_oversized(block, max_tokens)
+        for piece in pieces:
+            piece_tokens = count_tokens(piece) + 1
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def _normalize(value):
+    return re.sub(r"\s+", " ", str(value or "")).strip().lower()
+
+
+def _split_skills(value):
+    return [skill.strip() for skill in str(value).split(",") if skill.strip()]
+
+
+def _join_unique(values):
+    seen, result = set(), []
+    for value in values:
+        key = _normalize(value)
+        if key and key not in seen:
+            seen.add(key)
+            result.append(value)
+    return result
+
+
+def _dedupe_dicts(items, keys):
+    seen, result = set(), []
+    for item in items:
+        key = tuple(_normalize(item.get(field)) for field in keys)
+        if key not in seen:
+            seen.add(key)
+            result.append(item)
+    return result
+
+
+def merge_skills(values):
+    """
+    Fusionne des champs "skills" partiels (chaînes ou dictionnaires par catégorie).
+    Retourne un dictionnaire si au moins un segment est catégorisé, sinon une chaîne.
+    """
+    values = [value for value in values if value]
+    if not any(isinstance(value, dict) for value in values):
+        skills = []
+        for value in values:
+            skills.extend(_split_skills(", ".join(value) if isinstance(value, list) else value))
+        return ", ".join(_join_unique(skills))
+
+    categories = {}
+    for value in values:
+        if isinstance(value, dict):
+            items = value.items()
+        else:
+            items = [("Compétences", ", ".join(value) if isinstance(value, list) else value)]
+        for category, skills in items:
+            if isinstance(skills, list):
+                skills = ", ".join(str(skill) for skill in skills)
+            categories.setdefault(category, []).extend(_split_skills(skills))
+    return {category: ", ".join(_join_unique(skills)) for category, skills in categories.items()}
+
+
+def _same_experience(previous, exp):
+    return (_normalize(previous.get("company_name")) == _normalize(exp.get("company_name"))
+            and _normalize(previous.get("date_range")) == _normalize(exp.get("date_range")))
+
+
+def _continues(previous, exp):
+    """
+    Vrai si `exp` n'a pas d'entreprise ou pas de dates, et que celles qu'il porte sont celles de `previous`.
+    """
+    missing = [field for field in ("company_name", "date_range") if not _normalize(exp.get(field))]
+    return bool(missing) and all(
+        not _normalize(previous.get(field)) or _normalize(previous.get(field)) == _normalize(exp.get(field))
+        for field in ("company_name", "date_range") if field not in missing
+    )
+
+
+def _extend_experience(previous, exp):
+    """
+    Rattache à `previous` les tâches, outils et champs vides complétés par la suite `exp`.
+    """
+    previous["tasks"] = _join_unique((previous.get("tasks") or []) + (exp.get("tasks") or []))
+    previous["tech_tools"] = _join_unique((previous.get("tech_tools") or []) + (exp.get("tech_tools") or []))
+    for field, value in exp.items():
+        if field not in ("tasks", "tech_tools") and value and not previous.get(field):
+            previous[field] = value
+
+
+def merge_extractions(partials):
+    """
+    Fusionne de façon déterministe les JSON extraits de chaque segment, dans l'ordre des segments :
+    premier champ non vide pour les scalaires, concaténation dédoublonnée pour les listes,
+    et fusion d'une expérience coupée entre deux segments consécutifs.
+    """
+    merged = {
+        "job_title": "",
+        "full_name": "",
+        "years_of_experience": "",
+        "contact_information": {"phone": "", "email": "", "website": ""},
+        "education": [],
+        "professional_experience": [],
+        "skills": "",
+        "certifications": []
+    }
+    last_experience = None
+    for partial in partials:
+        for field in ("job_title", "full_name", "years_of_experience"):
+            if not merged[field] and partial.get(field):
+                merged[field] = partial[field]
+        contact = partial.get("contact_information") or {}
+        if isinstance(contact, dict):
+            for field, value in contact.items():
+                if value and not merged["contact_information"].get(field):
+                    merged["contact_information"][field] = value
+
+        for edu in partial.get("education") or []:
+            if isinstance(edu, dict) and any(edu.values()):
+                merged["education"].append(edu)
+
+        # Dernière expérience du segment précédent : la suite d'une expérience coupée peut
+        # arriver sans entreprise ni dates dans la première expérience de ce segment
+        open_experience = last_experience
+        for exp in partial.get("professional_experience") or []:
+            if not isinstance(exp, dict) or not any(exp.values()):
+                continue
+            previous = merged["professional_experience"][-1] if merged["professional_experience"] else None
+            if previous is not None and (_same_experience(previous, exp)
+                                         or (previous is open_experience and _continues(previous, exp))):
+                _extend_experience(previous, exp)
+            else:
+                merged["professional_experience"].append(exp)
+            open_experience = None
+        last_experience = merged["professional_experience"][-1] if merged["professional_experience"] else None
+
+        merged["certifications"].extend(partial.get("certifications") or [])
+
+    merged["education"] = _dedupe_dicts(merged["education"], ("degree", "institution", "year_of_completion"))
+    merged["certifications"] = _join_unique(merged["certifications"])
+    merged["skills"] = merge_skills([partial.get("skills") for partial in partials])
+    return merged
@@ -0,0 +1,148 @@
+"""
+Compactage du texte extrait avant son envoi au modèle.
+
+Le texte brut d'un CV contient beaucoup de tokens inutiles : espaces et lignes vides
+répétés, en-têtes et pieds de page recopiés sur chaque page, numéros de page, puces et
+points de conduite, bruit d'OCR. compact_text() les retire sans toucher au contenu ;
+compact_for_prompt() l'applique en mesurant les tokens avant et après (tokenizer local).
+
+Les pages d'un PDF sont séparées par un saut de page (\\f) dans le texte extrait
+(voir extraction.py), ce qui permet de repérer les lignes répétées d'une page à l'autre.
+"""
+import logging
+import math
+import os
+import re
+import unicodedata
+
+from metrics import counter, timed
+from tokenizer import count_tokens
+
+COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION", "true").lower() == "true"
+# Lignes examinées en haut et en bas de chaque page pour les en-têtes/pieds de page
+EDGE_LINES = 3
+# Part des pages sur lesquelles une ligne doit figurer pour être considérée comme répétée
+REPEATED_MIN_SHARE = 0.5
+
+PROMPT_TEXT_TOKENS = counter("cv_prompt_text_tokens_total",
+                             "Tokens du texte des CV avant (raw) et après (compacted) compactage.",
+                             ("call", "stage"))
+
+_INVISIBLE_RE = re.compile("[\u00ad\u200b\u200c\u200d\u2060\ufeff]")
+_HYPHEN_BREAK_RE = re.compile(r"(?<=[a-zà-ÿ])-\n(?=[a-zà-ÿ])")
+_SPACES_RE = re.compile(r"[ \t\r\v]+")
+_LEADERS_RE = re.compile(r"(?:[.·_=~*]\s?){4,}")
+# Puces, y compris celles des polices Symbol/Wingdings (zone privée Unicode)
+_BULLET_RE = re.compile("^[\u2022\u25aa\u25a0\u25a1\u25e6\u25cf\u25cb\u27a2\u25ba\u25b6\u2713\u2714\u2192\uf0b7\uf0a7\uf0d8*>]+\\s*")
+# Numéros de page explicites : "Page 2", "p. 2", "2 / 3", "Page 2 sur 3"
+_PAGE_NUMBER_RE = re.compile(r"^(?:(?:page|p\.)\s*\d{1,3}(?:\s*(?:/|sur|of)\s*\d{1,3})?|\d{1,3}\s*(?:/|sur|of)\s*\d{1,3})$",
+                             re.IGNORECASE)
+# Nombre seul ("2", "- 2 -") : numéro de page seulement s'il se répète en haut ou en bas des pages
+_BARE_NUMBER_RE = re.compile(r"^(?:-\s*)?\d{1,3}(?:\s*-)?$")
+# Rapport minimal caractères significatifs / longueur d'une ligne (en deçà : bruit d'OCR)
+MIN_ALNUM_RATIO = 0.3
+# Caractères comptés avec les alphanumériques ("C++", "C#", ".NET", "TCP/IP")
+SIGNIFICANT_CHARS = "+#./"
+
+
+def _normalize_line(line):
+    line = _LEADERS_RE.sub(" ", line)
+    line = _SPACES_RE.sub(" ", line).strip()
+    return _BULLET_RE.sub("- ", line)
+
+
+def _line_key(line):
+    # Les numéros (page 2/3, dates d'impression...) ne distinguent pas deux en-têtes identiques
+    return re.sub(r"\d+", "#", line.lower())
+
+
+def _is_noise(line):
+    if not any(c.isalnum() for c in line):
+        return True
+    significant = sum(1 for c in line if c.isalnum() or c in SIGNIFICANT_CHARS)
+    return len(line) >= 4 and significant / len(line) < MIN_ALNUM_RATIO
+
+
+def _edge_indexes(lines):
+    """
+    Indices des EDGE_LINES premières et dernières lignes non vides d'une page ; les puces
+    (contenu des expériences) n'en font pas partie.
+    """
+    content = [i for i, line in enumerate(lines) if line]
+    return {i for i in content[:EDGE_LINES] + content[-EDGE_LINES:] if not lines[i].startswith("- ")}
+
+
+def _repeated_edge_keys(pages):
+    """
+    Clés des lignes présentes en haut ou en bas d'au moins REPEATED_MIN_SHARE des pages.
+    """
+    if len(pages) < 2:
+        return set()
+    counts = {}
+    for lines in pages:
+        for key in {_line_key(lines[i]) for i in _edge_indexes(lines)}:
+            counts[key] = counts.get(key, 0) + 1
+    threshold = max(2, math.ceil(len(pages) * REPEATED_MIN_SHARE))
+    return {key for key, count in counts.items() if count >= threshold}
+
+
+def compact_text(text):
+    """
+    Retourne (texte compacté, {"page_numbers", "repeated", "noise"} : lignes retirées).
+    Les en-têtes et pieds de page ne sont retirés qu'en haut et en bas des pages, et leur première
+    occurrence est conservée (elle porte souvent le nom du candidat). Un nombre seul n'est retiré
+    comme numéro de page que s'il se répète ainsi d'une page à l'autre.
+    """
+    removed = {"page_numbers": 0, "repeated": 0, "noise": 0}
+    if not text:
+        return text, removed
+    text = unicodedata.normalize("NFKC", _INVISIBLE_RE.sub("", text))
+    text = _HYPHEN_BREAK_RE.sub("", text)
+
+    pages = [[_normalize_line(line) for line in page.split("\n")] for page in text.split("\f")]
+    repeated = _repeated_edge_keys(pages)
+    seen_repeated = set()
+    lines = []
+    for page in pages:
+        edges = _edge_indexes(page) if repeated else ()
+        for index, line in enumerate(page):
+            if not line:
+                if lines and lines[-1]:
+                    lines.append("")
+                continue
+            key = _line_key(line) if index in edges else None
+            if _PAGE_NUMBER_RE.match(line) or (key in repeated and _BARE_NUMBER_RE.match(line)):
+                removed["page_numbers"] += 1
+                continue
+            if key in repeated:
+                if key in seen_repeated:
+                    removed["repeated"] += 1
+                    continue
+                seen_repeated.add(key)
+            if _is_noise(line):
+                removed["noise"] += 1
+                continue
+            lines.append(line)
+        if lines and lines[-1]:
+            lines.append("")
+    return "\n".join(lines).strip(), removed
+
+
+@timed("compaction")
+def compact_for_prompt(text, call="extraction"):
+    """
+    Compacte le texte d'un CV avant l'appel au modèle et journalise les tokens économisés.
+    Retourne le texte tel quel si PROMPT_COMPACTION=false ou si le compactage le viderait.
+    """
+    if not text or not COMPACTION_ENABLED:
+        return text
+    compacted, removed = compact_text(text)
+    if not compacted:
+        return text
+    tokens_before, tokens_after = count_tokens(text), count_tokens(compacted)
+    PROMPT_TEXT_TOKENS.inc(tokens_before, call=call, stage="raw")
+    PROMPT_TEXT_TOKENS.inc(tokens_after, call=call, stage="compacted")
+    saved = 100 * (tokens_before - tokens_after) / tokens_before if tokens_before else 0
+    logging.info(f"Texte compacté : {tokens_before} -> {tokens_after} tokens (-{saved:.0f} %), "
+                 f"lignes retirées : {removed}")
+    return compacted
@@ -0,0 +1,243 @@
+"""
+Configuration partagée par convert.py et app.py : secrets et clients résolus à la demande.
+
+Aucun appel réseau n'est fait à l'import : les secrets Key Vault sont lus au premier
+usage puis mis en cache, et rafraîchis en arrière-plan une fois leur durée de vie
+écoulée (la valeur en cache reste servie pendant le rafraîchissement). Chaque secret
+peut être surchargé localement par la variable d'environnement SECRET_<nom> (fichier
+.env compris) ou par le fichier JSON LOCAL_SECRETS_FILE, ce qui permet de démarrer
+sans accès au Key Vault.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+from dotenv import load_dotenv
+
+# Charger les variables d'environnement depuis le fichier .env
+load_dotenv()
+
+KEY_VAULT_URI = os.getenv("KEY_VAULT_URI", "https://AI-vault-hepta.vault.azure.net/")
+SECRET_TTL_SECONDS = int(os.getenv("SECRET_TTL_SECONDS", "3600"))
+READY_CACHE_SECONDS = float(os.getenv("READY_CACHE_SECONDS", "10"))
+# Délai avant la fermeture d'un client remplacé après une rotation (appels en cours terminés)
+RESOURCE_CLOSE_DELAY_SECONDS = float(os.getenv("RESOURCE_CLOSE_DELAY_SECONDS", "60"))
+# Part des requêtes dont le prompt et la réponse complets sont journalisés (0 = jamais)
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("PAYLOAD_LOG_SAMPLE_RATE", "0"))
+
+
+class SecretStore:
+    """
+    Cache des secrets Key Vault avec surcharges locales et rafraîchissement en arrière-plan.
+    """
+
+    def __init__(self, vault_uri=KEY_VAULT_URI, ttl_seconds=SECRET_TTL_SECONDS, local_file=None):
+        self.vault_uri = vault_uri
+        self.ttl_seconds = ttl_seconds
+        self._client = None
+        self._values = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._overrides = {}
+        local_file = local_file or os.getenv("LOCAL_SECRETS_FILE")
+        if local_file:
+            with open(local_file, "r", encoding="utf-8") as f:
+                self._overrides = json.load(f)
+
+    def _secret_client(self):
+        with self._lock:
+            if self._client is None:
+                # Import différé : azure.identity est coûteux à charger
+                from azure.identity import DefaultAzureCredential
+                from azure.keyvault.secrets import SecretClient
+                self._client = SecretClient(vault_url=self.vault_uri, credential=DefaultAzureCredential())
+            return self._client
+
+    def _fetch(self, name):
+        value = self._secret_client().get_secret(name).value
+        with self._lock:
+            self._values[name] = (value, time.monotonic())
+        return value
+
+    def _refresh(self, name):
+        try:
+            self._fetch(name)
+            logging.info(f"Secret {name} rafraîchi")
+        except Exception as e:
+            logging.warning(f"Échec du rafraîchissement du secret {name}, ancienne valeur conservée : {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(name)
+
+    def override(self, name):
+        """
+        Retourne la valeur locale du secret (SECRET_<nom> ou LOCAL_SECRETS_FILE), ou None.
+        """
+        return os.getenv(f"SECRET_{name}") or self._overrides.get(name)
+
+    def get(self, name):
+        """
+        Retourne la valeur du secret. Le premier appel interroge le Key Vault ; ensuite
+        la valeur en cache est retournée et rafraîchie en arrière-plan après expiration.
+        """
+        local = self.override(name)
+        if local:
+            return local
+        with self._lock:
+            cached = self._values.get(name)
+            expired = cached is not None and time.monotonic() - cached[1] > self.ttl_seconds
+            if expired and name not in self._refreshing:
+                self._refreshing.add(name)
+                threading.Thread(target=self._refresh, args=(name,), daemon=True,
+                                 name=f"secret-refresh-{name}").start()
+        if cached is not None:
+            return cached[0]
+        return self._fetch(name)
+
+
+class LazyResource:
+    """
+    Client construit au premier usage à partir de secrets, et reconstruit si l'un
+    d'eux change (rotation). `factory` reçoit les valeurs des secrets dans l'ordre.
+    Le client remplacé est fermé après `close_delay` secondes, le temps que les appels
+    qui l'utilisent encore se terminent, pour ne pas laisser ses connexions ouvertes.
+    """
+
+    def __init__(self, factory, *secret_names, store=None, close_delay=RESOURCE_CLOSE_DELAY_SECONDS):
+        self.factory = factory
+        self.secret_names = secret_names
+        self.store = store
+        self.close_delay = close_delay
+        self._instance = None
+        self._key = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        store = self.store or get_secret_store()
+        values = tuple(store.get(name) for name in self.secret_names)
+        with self._lock:
+            if self._instance is None or values != self._key:
+                previous = self._instance
+                self._instance = self.factory(*values)
+                self._key = values
+                if previous is not None:
+                    timer = threading.Timer(self.close_delay, _close_client, (previous,))
+                    timer.daemon = True
+                    timer.start()
+            return self._instance
+
+
+def _close_client(client):
+    """
+    Ferme un client remplacé (MongoClient, BlobServiceClient, client OpenAI synchrone ou
+    asynchrone) ; une erreur de fermeture est seulement journalisée.
+    """
+    close = getattr(client, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+        logging.info(f"Client {type(client).__name__} remplacé après rotation fermé.")
+    except Exception as e:
+        logging.warning(f"Fermeture du client {type(client).__name__} remplacé impossible : {e}")
+
+
+class ReadinessProbe:
+    """
+    Exécute les vérifications de dépendances nommées et garde le résultat en cache
+    READY_CACHE_SECONDS secondes pour ne pas solliciter les services à chaque sonde.
+    """
+
+    def __init__(self, checks, cache_seconds=READY_CACHE_SECONDS):
+        self.checks = checks
+        self.cache_seconds = cache_seconds
+        self._result = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        """
+        Retourne (prêt, {nom: "ok" ou message d'erreur}).
+        """
+        with self._lock:
+            if self._result is not None and time.monotonic() - self._checked_at < self.cache_seconds:
+                return self._result
+            status = {}
+            for name, check in self.checks.items():
+                try:
+                    check()
+                    status[name] = "ok"
+                except Exception as e:
+                    logging.warning(f"Dépendance {name} indisponible : {e}")
+                    status[name] = str(e) or type(e).__name__
+            self._result = (all(value == "ok" for value in status.values()), status)
+            self._checked_at = time.monotonic()
+            return self._result
+
+
+_secret_store = None
+_secret_store_lock = threading.Lock()
+
+
+def get_secret_store():
+    """
+    Retourne le cache de secrets partagé, créé au premier appel.
+    """
+    global _secret_store
+    with _secret_store_lock:
+        if _secret_store is None:
+            _secret_store = SecretStore()
+        return _secret_store
+
+
+def get_secret(name):
+    """
+    Raccourci pour get_secret_store().get(name).
+    """
+    return get_secret_store().get(name)
+
+
+def sample_payload_logging():
+    """
+    Indique si le contenu complet (prompt, réponse) de la requête courante doit être journalisé,
+    selon PAYLOAD_LOG_SAMPLE_RATE. Désactivé par défaut : les CV contiennent des données personnelles.
+    """
+    return PAYLOAD_LOG_SAMPLE_RATE > 0 and random.random() < PAYLOAD_LOG_SAMPLE_RATE
+
+
+def available_cpus():
+    """
+    Cœurs réellement disponibles : quota CPU du conteneur (cgroup v2 ou v1) et affinité du
+    processus, à défaut os.cpu_count() (qui compte tous les cœurs de la machine).
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        cpus = os.cpu_count() or 1
+    for quota_file, period_file in (("/sys/fs/cgroup/cpu.max", None),
+                                    ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")):
+        try:
+            with open(quota_file) as f:
+                values = f.read().split()
+            if period_file:
+                with open(period_file) as f:
+                    values.append(f.read().strip())
+            if values[0] not in ("max", "-1"):
+                return max(1, min(cpus, int(int(values[0]) / int(values[1]))))
+        except (OSError, ValueError, IndexError):
+            continue
+    return max(1, cpus)
+
+
+def default_processes(maximum=4):
+    """
+    Taille par défaut des pools de processus : cœurs disponibles, au plus `maximum`
+    (chaque processus ajoute sa mémoire à celle du pod).
+    """
+    return min(maximum, available_cpus())
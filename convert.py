@@ -1,36 +1,51 @@
+import hashlib
+import io
 import json
 import re
-import fitz  # PyMuPDF
 from docx import Document
-from PIL import Image
-import pytesseract
-from openai import AzureOpenAI
-from azure.keyvault.secrets import SecretClient
-from azure.identity import DefaultAzureCredential
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
 from reportlab.lib import colors
 from reportlab.lib.units import inch, cm
-from reportlab.lib.utils import ImageReader
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, abort, send_file
 import os
 import logging
-from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
+import multiprocessing
 from flask_cors import CORS
+import atexit
 import tempfile
-from dotenv import load_dotenv
-from datetime import datetime, timedelta, timezone
-from pdf2docx import Converter
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from docx.shared import Inches
 from docx.shared import Pt
+from docx.shared import Cm, Emu, RGBColor
+from docx.enum.table import WD_TABLE_ALIGNMENT
+from docx.enum.text import WD_ALIGN_PARAGRAPH
 
 # Nouveaux imports pour modifier le XML du DOCX
 from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 
-# Charger les variables d'environnement depuis le fichier .env
-load_dotenv()
+from candidates import CANDIDATE_INDEX_ENABLED, CandidateIndex, candidate_document, candidate_id
+from cv_cache import ExtractionCache
+from compaction import compact_for_prompt
+from cv_schema import merge_patch, normalize_cv, normalize_experience, parse_cv_json
+from extraction import extract_text
+from incremental import changed_share, find_email, find_phones, fingerprint_text, match_blocks, merge_incremental
+from jobs import JobManager, StorageJobStore
+from json_stream import IncrementalJSONParser
+from chunking import chunk_text, merge_extractions
+from tokenizer import count_tokens
+from templates import get_registry, get_template
+from config import LazyResource, ReadinessProbe, default_processes, get_secret_store, sample_payload_logging
+from storage import STORAGE_BACKEND, AzureBlobStorage, LocalStorage, content_type_for
+from llm_limiter import OPENAI_TIMEOUT_SECONDS, get_limiter
+from metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, STAGE_SECONDS, counter, observe_stage, record_stage_error,
+                     record_tokens, register_callback, render_metrics, timed)
 
 # Configuration de l’application Flask
 app = Flask(__name__)
@@ -38,24 +53,7 @@ CORS(app, resources={r"/*": {"origins": ["https://talent.heptasys.com", "http://
      allow_headers=["Content-Type", "Authorization", "X-Requested-With"])
 logging.basicConfig(level=logging.INFO)
 
-# Configuration d’Azure Key Vault
-key_vault_name = 'AI-vault-hepta'
-key_vault_uri = f"https://{key_vault_name}.vault.azure.net/"
-credential = DefaultAzureCredential()
-secret_client = SecretClient(vault_url=key_vault_uri, credential=credential)
-
-api_key = secret_client.get_secret('AZUREopenaiAPIkey').value
-azure_endpoint = secret_client.get_secret('AZUREopenaiENDPOINT').value
-connect_string = secret_client.get_secret('connectstr').value
-
-azure_openai_client = AzureOpenAI(
-    api_key=api_key,
-    api_version="2024-02-15-preview",
-    azure_endpoint=azure_endpoint
-)
-
-# Configuration du Blob Storage
-blob_service_client = BlobServiceClient.from_connection_string(connect_string)
+# Secrets (Azure Key Vault) et clients résolus au premier usage, voir config.py
 container_name = "converted"
 
 def get_account_key_from_connection_string(conn_str):
@@ -65,37 +63,149 @@ def get_account_key_from_connection_string(conn_str):
             return part.split("=", 1)[1]
     return None
 
-_account_key = None
-if hasattr(blob_service_client.credential, "account_key"):
-    _account_key = blob_service_client.credential.account_key
-else:
-    _account_key = get_account_key_from_connection_string(connect_string)
+def _build_openai_client(api_key, azure_endpoint):
+    from openai import AzureOpenAI
+    # Reprises gérées par llm_limiter (budgets, délais, Retry-After)
+    return AzureOpenAI(
+        api_key=api_key,
+        api_version="2024-02-15-preview",
+        azure_endpoint=azure_endpoint,
+        max_retries=0,
+        timeout=OPENAI_TIMEOUT_SECONDS
+    )
 
-def extract_text(file_path):
+def _build_blob_service_client(connect_string):
+    from azure.storage.blob import BlobServiceClient
+    # Upload par blocs au-delà de BLOB_SINGLE_PUT_MB, blocs envoyés en parallèle (BLOB_MAX_CONCURRENCY)
+    return BlobServiceClient.from_connection_string(
+        connect_string,
+        max_single_put_size=int(float(os.getenv("BLOB_SINGLE_PUT_MB", "4")) * 1024 * 1024),
+        max_block_size=int(float(os.getenv("BLOB_BLOCK_MB", "4")) * 1024 * 1024)
+    )
+
+openai_client = LazyResource(_build_openai_client, 'AZUREopenaiAPIkey', 'AZUREopenaiENDPOINT')
+blob_client_resource = LazyResource(_build_blob_service_client, 'connectstr')
+
+def get_account_key():
     """
-    Extrait le texte d'un fichier PDF, DOCX ou image (PNG/JPG).
-    Utilise PyMuPDF pour PDF, python-docx pour DOCX, et pytesseract pour les images.
+    Clé du compte de stockage, utilisée pour signer les SAS.
     """
-    try:
-        if file_path.lower().endswith(".pdf"):
-            with fitz.open(file_path) as doc:
-                return " ".join(page.get_text() for page in doc)
-        elif file_path.lower().endswith(".docx"):
-            doc = Document(file_path)
-            return "\n".join(paragraph.text for paragraph in doc.paragraphs)
-        else:
-            image = Image.open(file_path)
-            return pytesseract.image_to_string(image)
-    except Exception as e:
-        logging.error(f"Erreur lors de l'extraction du texte : {e}")
-        return None
+    blob_service_client = blob_client_resource.get()
+    if hasattr(blob_service_client.credential, "account_key"):
+        return blob_service_client.credential.account_key
+    return get_account_key_from_connection_string(get_secret_store().get('connectstr'))
 
-def extract_info_to_json(text):
+# Stockage des fichiers générés (STORAGE_BACKEND) : Azure Blob Storage ou disque local, voir storage.py
+_storage = None
+_storage_lock = threading.Lock()
+
+def get_storage():
     """
-    Appelle AzureOpenAI pour extraire les informations du CV.
+    Backend de stockage, construit au premier usage.
     """
-    # Exemple de JSON attendu :
-    json_format = """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if STORAGE_BACKEND == "local":
+                _storage = LocalStorage(signing_key=os.getenv("LOCAL_STORAGE_SIGNING_KEY"))
+            else:
+                _storage = AzureBlobStorage(blob_client_resource, container_name, get_account_key)
+            logging.info(f"Stockage des fichiers générés : {_storage.name}")
+        return _storage
+
+# Index des candidats (MongoDB, base AzureBlob partagée avec app.py), voir candidates.py
+def _build_mongo_client(mongo_uri):
+    from pymongo import MongoClient
+    return MongoClient(mongo_uri, serverSelectionTimeoutMS=int(os.getenv("MONGO_TIMEOUT_MS", "5000")))
+
+mongo_client = LazyResource(_build_mongo_client, 'MONGOsearchURI')
+candidate_index = CandidateIndex(lambda: mongo_client.get()['AzureBlob']['candidates'])
+atexit.register(candidate_index.flush)
+register_callback("cv_candidates_pending", "Candidats en attente d'écriture dans MongoDB.",
+                  lambda: candidate_index.stats()["pending"])
+
+# Extraction incrémentale des nouvelles versions d'un CV déjà indexé (voir incremental.py)
+INCREMENTAL_EXTRACTION = os.getenv("INCREMENTAL_EXTRACTION", "true").lower() == "true"
+# Similarité (Jaccard estimée) à partir de laquelle un bloc modifié est apparié à un bloc
+# de la version précédente (il est tout de même ré-extrait)
+BLOCK_SIMILARITY = float(os.getenv("BLOCK_SIMILARITY", "0.9"))
+# Au-delà de cette part du texte modifiée, le CV est extrait entièrement
+INCREMENTAL_MAX_CHANGED_SHARE = float(os.getenv("INCREMENTAL_MAX_CHANGED_SHARE", "0.5"))
+INCREMENTAL_EXTRACTIONS = counter("cv_incremental_extractions_total",
+                                  "Extractions par version précédente : JSON réutilisé, blocs modifiés seuls ou CV complet.",
+                                  ("outcome",))
+
+# Déploiement du modèle et version du prompt : toute modification du prompt
+# doit incrémenter PROMPT_VERSION pour invalider le cache d'extraction.
+OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT", "IndexSelector")
+PROMPT_VERSION = "3"
+EXTRACTION_MAX_TOKENS = 3000
+# Demandes de suite au modèle pour une réponse tronquée (finish_reason "length")
+JSON_MAX_CONTINUATIONS = int(os.getenv("JSON_MAX_CONTINUATIONS", "1"))
+JSON_REPAIRS = counter("cv_json_repairs_total", "Réponses du modèle réparées localement ou complétées, par type.",
+                       ("repair",))
+
+# Cache disque des extractions (texte + JSON), adressé par le contenu du fichier
+CACHE_ENABLED = os.getenv("CV_CACHE_ENABLED", "true").lower() == "true"
+extraction_cache = ExtractionCache(
+    os.getenv("CV_CACHE_DIR", os.path.join(tempfile.gettempdir(), "cv_cache")),
+    max_bytes=int(os.getenv("CV_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    max_age_seconds=int(os.getenv("CV_CACHE_MAX_AGE_HOURS", "168")) * 3600
+)
+register_callback("cv_extraction_cache_hits_total", "Extractions servies par le cache.",
+                  lambda: extraction_cache.stats()["hits"], kind="counter")
+register_callback("cv_extraction_cache_misses_total", "Extractions absentes du cache.",
+                  lambda: extraction_cache.stats()["misses"], kind="counter")
+register_callback("cv_extraction_cache_size_bytes", "Occupation du cache d'extraction.",
+                  lambda: extraction_cache.stats()["size_bytes"])
+
+# Seuil au-delà duquel les tampons en mémoire débordent sur disque
+SPOOL_THRESHOLD = int(os.getenv("SPOOL_THRESHOLD_MB", "8")) * 1024 * 1024
+
+# Extraction par segments des CV longs (budget en tokens du texte, hors instructions)
+CHUNK_THRESHOLD_TOKENS = int(os.getenv("CHUNK_THRESHOLD_TOKENS", "2500"))
+CHUNK_TEXT_TOKENS = int(os.getenv("CHUNK_TEXT_TOKENS", "1500"))
+chunk_executor = ThreadPoolExecutor(max_workers=int(os.getenv("CHUNK_CONCURRENCY", "4")), thread_name_prefix="cv-chunk")
+
+# Compilation des modèles de mise en page (styles, bannière, en-tête) en arrière-plan au démarrage
+threading.Thread(target=get_registry, daemon=True, name="template-warmup").start()
+
+# Rendu du DOCX : "native" (python-docx depuis le JSON) ou "pdf2docx" (conversion du PDF)
+DOCX_RENDERER = os.getenv("DOCX_RENDERER", "native").lower()
+render_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RENDER_THREADS", "4")), thread_name_prefix="cv-render")
+# Rendu PDF/DOCX dans un pool de processus préchauffés (0 = rendu dans les threads de render_executor) ;
+# par défaut, cœurs du conteneur (quota cgroup) dans la limite de 4
+RENDER_PROCESSES = int(os.getenv("RENDER_PROCESSES", str(default_processes())))
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+# Upload des fichiers générés : PDF et DOCX envoyés en parallèle, sous un nom dérivé
+# du contenu (JSON + modèle). RENDER_VERSION doit être incrémenté à chaque modification
+# de la mise en page pour ne pas réutiliser les fichiers déjà générés.
+RENDER_VERSION = "1"
+upload_executor = ThreadPoolExecutor(max_workers=int(os.getenv("UPLOAD_THREADS", "8")), thread_name_prefix="cv-upload")
+# Durée de validité des liens de téléchargement (SAS ou URLs signées du stockage local)
+LINK_TTL_MINUTES = int(os.getenv("LINK_TTL_MINUTES", "10"))
+
+# Traitement par lot : pool de processus pour l'extraction, appels au modèle plafonnés
+EXTRACTION_PROCESSES = int(os.getenv("EXTRACTION_PROCESSES", str(default_processes())))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_MB", "20")) * 1024 * 1024
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+# Pool borné pour le mode asynchrone de /template ; l'état des jobs est partagé via le stockage
+job_manager = JobManager(
+    max_workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_pending=int(os.getenv("JOB_QUEUE_SIZE", "32")),
+    ttl_seconds=int(os.getenv("JOB_TTL_SECONDS", "3600")),
+    store=StorageJobStore(get_storage),
+    poll_seconds=float(os.getenv("JOB_POLL_SECONDS", "1"))
+)
+
+# Exemple de JSON attendu :
+EXTRACTION_JSON_FORMAT = """
 {
   "job_title": "",
   "full_name": "",
@@ -124,104 +234,274 @@ def extract_info_to_json(text):
   "skills": [],
   "certifications": []
 }
-    """
-    
-    # Prompt renforcé pour extraire un titre et respecter l’ordre des expériences
-    prompt = f"""
-You are a helpful assistant that extracts specific information from a résumé (CV) written in French.
+"""
+
+# Instructions et format, identiques d'un appel à l'autre : placés en tête du prompt, avant le
+# texte du CV, ils forment un préfixe commun réutilisable par la mise en cache des prompts.
+# Prompt renforcé pour extraire un titre et respecter l’ordre des expériences
+EXTRACTION_PROMPT_PREFIX = f"""You are a helpful assistant that extracts specific information from a résumé (CV) written in French.
 
 IMPORTANT:
 - The text is in French. DO NOT translate it.
-- If the résumé has a distinct title (e.g. "Titre du CV", "Management de la maintenance", etc.), 
+- If the résumé has a distinct title (e.g. "Titre du CV", "Management de la maintenance", etc.),
   please store it in the "job_title" field in the JSON.
 - Extract the technical skills information from the CV and return it in the "skills" field.
   If the skills are organized in categories (i.e., each category is labeled with a title followed by a colon and a list of skills),
   return a dictionary where the keys are the category names and the values are the skills (each skill separated by a comma).
   If the skills are not organized in categories, return them as a single comma-separated string.
 - Extract the certifications from the CV and return them in the "certifications" field as a list of strings.
-- Preserve the exact order of the professional experiences as they appear in the original CV. 
-  The first experience in the CV should remain the first in the JSON output, the second remains the second, etc. 
+- Preserve the exact order of the professional experiences as they appear in the original CV.
+  The first experience in the CV should remain the first in the JSON output, the second remains the second, etc.
   Do not reorder or regroup them.
 - For each entry in "professional_experience", extract exactly the following fields as they appear in the CV:
   "date_range", "company_name", and "mission".
-  IMPORTANT: For "mission", extract only the job title – i.e. the first line immediately following 
+  IMPORTANT: For "mission", extract only the job title – i.e. the first line immediately following
   the date range and company name – and do not include any additional descriptive text.
 - Return only valid JSON (no extra text or symbols).
 
-Extract the following information from the text (in French):
-{text}
-
 Format the result as JSON according to the example below:
-{json_format}
-
+{EXTRACTION_JSON_FORMAT}
 Do not include any extra symbols.
+
+"""
+
+EXCERPT_NOTE = (
+    "NOTE: The text below is only an excerpt of a longer résumé. "
+    "Extract only what appears in this excerpt and leave every other field empty.\n\n"
+)
+
+def build_extraction_prompt(text, excerpt=False):
+    """
+    Construit le prompt d'extraction des informations du CV : préfixe statique
+    (EXTRACTION_PROMPT_PREFIX) puis texte du CV.
+    `excerpt` indique que le texte n'est qu'un segment d'un CV plus long.
     """
+    excerpt_note = EXCERPT_NOTE if excerpt else ""
+    return (f"{EXTRACTION_PROMPT_PREFIX}{excerpt_note}"
+            f"Extract the following information from the text (in French):\n{text}\n\nJSON:\n")
 
-    try:
-        logging.info("=== Prompt envoyé à l'API ===")
-        logging.info(prompt)
-        
-        response = azure_openai_client.completions.create(
-            model="IndexSelector",  # Remplacez si nécessaire par le nom de déploiement effectif (ex: "gpt-35-turbo")
+def complete(prompt, key, call="extraction"):
+    """
+    Appel de complétion non diffusé sous le limiteur. Retourne (texte, finish_reason).
+    """
+    prompt_tokens = count_tokens(prompt)
+    response = get_limiter().call(
+        lambda: openai_client.get().completions.create(
+            model=OPENAI_DEPLOYMENT,
             prompt=prompt,
-            max_tokens=3000,
+            max_tokens=EXTRACTION_MAX_TOKENS,
             temperature=0
-        )
+        ),
+        prompt_tokens, EXTRACTION_MAX_TOKENS, key=key
+    )
+    choice = response.choices[0]
+    usage = getattr(response, "usage", None)
+    if usage:
+        record_tokens(call, usage.prompt_tokens, usage.completion_tokens)
+    else:
+        record_tokens(call, prompt_tokens, count_tokens(choice.text))
+    return choice.text, getattr(choice, "finish_reason", None)
+
+@timed("llm_call", falsy_is_error=True)
+def extract_info_to_json(text, excerpt=False):
+    """
+    Appelle AzureOpenAI pour extraire les informations du CV.
+    Si la réponse est coupée par max_tokens (finish_reason "length"), seule la suite est
+    demandée, au plus JSON_MAX_CONTINUATIONS fois, au lieu de relancer toute l'extraction.
+    Le prompt et la réponse complets ne sont journalisés que pour un échantillon
+    de requêtes (PAYLOAD_LOG_SAMPLE_RATE).
+    """
+    prompt = build_extraction_prompt(text, excerpt)
+    key = "extraction_chunk" if excerpt else "extraction"
+    log_payload = sample_payload_logging()
+    try:
+        if log_payload:
+            logging.info("=== Prompt envoyé à l'API ===")
+            logging.info(prompt)
         
-        raw_json_text = response.choices[0].text.strip()
-        logging.info("=== Réponse brute de l'API AzureOpenAI ===")
-        logging.info(raw_json_text)
+        raw_json_text, finish_reason = complete(prompt, key)
+        continuations = 0
+        while finish_reason == "length" and continuations < JSON_MAX_CONTINUATIONS:
+            continuations += 1
+            JSON_REPAIRS.inc(repair="continuation")
+            logging.warning(f"Réponse du modèle tronquée, demande de la suite ({continuations}/{JSON_MAX_CONTINUATIONS})")
+            # Le modèle de complétion poursuit le texte déjà produit ; en cas d'échec,
+            # la sortie tronquée est réparée localement par parse_json_response
+            try:
+                continuation, finish_reason = complete(prompt + raw_json_text, key, call="extraction_continuation")
+            except Exception as e:
+                logging.warning(f"Échec de la demande de suite, réponse tronquée conservée : {e}")
+                break
+            raw_json_text += continuation
+        raw_json_text = raw_json_text.strip()
+        if log_payload:
+            logging.info("=== Réponse brute de l'API AzureOpenAI ===")
+            logging.info(raw_json_text)
         
         return raw_json_text
     except Exception as e:
         logging.error(f"Erreur lors de l'appel à l'API OpenAI : {e}")
         return None
 
-def clean_and_save_json(raw_json_text, file_path):
+def extract_info_to_json_stream(text):
     """
-    Nettoie le JSON renvoyé par l'API (en le parsant) et le sauvegarde dans un fichier.
+    Variante en flux de extract_info_to_json : produit les fragments de texte
+    de la complétion au fur et à mesure de leur arrivée.
+    Le flux ne renvoie pas l'usage : les tokens sont estimés avec le tokenizer local.
     """
-    try:
-        clean_json_data = json.loads(raw_json_text)
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(clean_json_data, f, ensure_ascii=False, indent=4)
-        logging.info(f"Fichier JSON sauvegardé à {file_path}.")
-    except json.JSONDecodeError as e:
-        logging.error(f"Erreur de décodage JSON : {e}")
+    prompt = build_extraction_prompt(text)
+    prompt_tokens = count_tokens(prompt)
+    parts = []
+    with observe_stage("llm_call"):
+        response = get_limiter().stream(
+            lambda: openai_client.get().completions.create(
+                model=OPENAI_DEPLOYMENT,
+                prompt=prompt,
+                max_tokens=EXTRACTION_MAX_TOKENS,
+                temperature=0,
+                stream=True
+            ),
+            prompt_tokens, EXTRACTION_MAX_TOKENS, key="extraction_stream"
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].text:
+                parts.append(chunk.choices[0].text)
+                yield chunk.choices[0].text
+    record_tokens("extraction_stream", prompt_tokens, count_tokens("".join(parts)))
+
+def extract_info_chunked(text):
+    """
+    Extraction des CV longs : le texte est découpé sur les sections et les expériences
+    en segments d'au plus CHUNK_TEXT_TOKENS tokens, chaque segment est extrait en parallèle,
+    puis les JSON partiels sont fusionnés dans l'ordre d'origine.
+    Retourne le JSON fusionné ou lève PipelineError.
+    """
+    chunks = chunk_text(text, CHUNK_TEXT_TOKENS)
+    logging.info(f"CV long découpé en {len(chunks)} segments")
+    raw_results = list(chunk_executor.map(lambda chunk: extract_info_to_json(chunk, excerpt=True), chunks))
+    partials = []
+    for index, raw_json_text in enumerate(raw_results):
+        partial = parse_json_response(raw_json_text) if raw_json_text else None
+        if partial is None:
+            logging.error(f"Échec de l'extraction du segment {index + 1}/{len(chunks)}")
+            raise PipelineError("Échec de l'extraction des informations structurées")
+        partials.append(partial)
+    return merge_extractions(partials)
+
+@timed("text_extraction", falsy_is_error=True)
+def extract_cv_text(file_bytes, filename):
+    """
+    Extraction du texte dans le processus courant (les lots passent par le pool d'extraction).
+    """
+    return extract_text(file_bytes, filename)
 
-def generate_pdf_filename(json_data, original_filename):
+def needs_chunking(text):
     """
-    Génère un nouveau nom de fichier PDF à partir du nom d'origine.
+    Indique si le texte dépasse le budget d'un appel unique et doit être extrait par segments.
     """
-    base_name, _ = os.path.splitext(original_filename)
-    return f"{base_name}_output.pdf"
+    return count_tokens(text) > CHUNK_THRESHOLD_TOKENS
 
-def generate_pdf_from_json(json_data, output_file):
+@timed("json_parse", falsy_is_error=True)
+def parse_json_response(raw_json_text):
     """
-    Génère un PDF à partir des données JSON extraites.
+    Parse le JSON renvoyé par l'API, le répare localement si besoin (bloc de code, virgules
+    finales, sortie tronquée...) et le valide contre le schéma du CV (voir cv_schema.py).
+    Retourne le dictionnaire ou None si la réponse est irrécupérable.
+    """
+    json_data, repairs, fixed = parse_cv_json(raw_json_text)
+    for repair in repairs:
+        JSON_REPAIRS.inc(repair=repair)
+    if fixed:
+        JSON_REPAIRS.inc(repair="schema")
+    if json_data is None:
+        logging.error(f"JSON du modèle irrécupérable (réparations tentées : {', '.join(repairs) or 'aucune'})")
+        return None
+    if repairs or fixed:
+        logging.warning(f"JSON du modèle réparé : {', '.join(repairs + fixed)}")
+    return json_data
+
+def render_content_hash(json_data, template_name=None):
+    """
+    Empreinte des entrées du rendu : JSON canonique, modèle, moteur DOCX et version du rendu.
+    """
+    canonical = json.dumps(json_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    template = template_name or get_registry().default_name
+    payload = "\n".join([RENDER_VERSION, template, DOCX_RENDERER, canonical])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+def generate_pdf_filename(json_data, original_filename, template_name=None):
     """
+    Génère le nom du blob PDF : <empreinte du contenu>/<nom d'origine>_output.pdf.
+    Deux fichiers de même nom mais de contenu différent ne s'écrasent plus.
+    """
+    base_name, _ = os.path.splitext(os.path.basename(original_filename))
+    return f"{render_content_hash(json_data, template_name)}/{base_name}_output.pdf"
+
+def banner_header_text(json_data):
+    """
+    Retourne le titre du CV et la ligne "initiales : années XP" affichés sur la bannière.
+    """
+    job_title = json_data.get('job_title', '').replace('\n', ' ').strip() or "CV Title"
+    full_name = json_data.get('full_name', '').strip()
+    if full_name:
+        parts = full_name.split()
+        if len(parts) >= 2:
+            initials = parts[0][0].upper() + "." + parts[-1][0].upper()
+        else:
+            initials = full_name[0].upper()
+    else:
+        initials = "?"
+    years_experience = str(json_data.get('years_of_experience', '')).replace('\n', ' ').strip()
+    return job_title, f"{initials} : {years_experience} XP"
+
+def build_experience_flowables(exp, template):
+    """
+    Construit les éléments ReportLab d'une expérience professionnelle.
+    Utilisé au rendu et, en mode flux, dès qu'une expérience est reçue du modèle.
+    """
+    styles = template.styles
+    flowables = []
+    date_range = exp.get('date_range', '').strip() or "Date non renseignée"
+    company_name = exp.get('company_name', '').replace('\n', ' ').strip()
+    mission = exp.get('mission', '').replace('\n', ' ').strip() or "Poste non renseigné"
+    
+    exp_table = Table([
+        [Paragraph(f"<b>{date_range}</b>", styles['Normal']),
+         Paragraph(f"<b>{company_name}</b>", styles['Normal'])]
+    ], colWidths=[3.0 * inch, 3.0 * inch])
+    exp_table.setStyle(template.experience_table_style)
+    flowables.append(exp_table)
+    
+    flowables.append(Paragraph(mission, styles['Bold']))
+    
+    if exp.get('tasks'):
+        flowables.append(Paragraph("Tâches :", styles['Bold']))
+        for task in exp.get('tasks'):
+            flowables.append(Paragraph("• " + task.replace('\n', ' '), styles['Normal']))
+    
+    if exp.get('tech_tools'):
+        tech_tools = ", ".join(exp.get('tech_tools', []))
+        flowables.append(Paragraph(f"<font color='#{template.accent_hex}'><b>Outils</b></font> : " + tech_tools, styles['Normal']))
+    
+    flowables.append(Spacer(1, 12))
+    return flowables
+
+@timed("pdf_render")
+def generate_pdf_from_json(json_data, output_file, template_name=None, experience_flowables=None):
+    """
+    Génère un PDF à partir des données JSON extraites, avec le modèle `template_name`
+    (styles et bannière précompilés dans le registre des modèles).
+    `output_file` peut être un chemin ou un objet fichier (BytesIO, SpooledTemporaryFile).
+    `experience_flowables` permet de fournir les expériences déjà construites (mode flux).
+    """
+    template = get_template(template_name)
     doc = SimpleDocTemplate(output_file, pagesize=A4)
-    styles = getSampleStyleSheet()
-    styles['Normal'].fontName = 'Helvetica'
-    styles['Normal'].fontSize = 10
-    styles['Normal'].leading = 12
-    styles.add(ParagraphStyle(name='Section', parent=styles['Normal'],
-                              fontName='Helvetica-Bold', fontSize=12,
-                              textColor=colors.black, alignment=1, spaceAfter=12))
-    styles.add(ParagraphStyle(name='Bold', parent=styles['Normal'],
-                              fontName='Helvetica-Bold'))
-    styles.add(ParagraphStyle(name='Center', parent=styles['Normal'], alignment=1))
-    styles.add(ParagraphStyle(name='Right', parent=styles['Normal'], alignment=2))
+    styles = template.styles
     
     def create_section_title(title_text):
         title_para = Paragraph(title_text, styles['Section'])
         title_table = Table([[title_para]], colWidths=[6*inch])
-        title_table.setStyle(TableStyle([
-            ("ALIGN", (0,0), (-1,-1), "CENTER"),
-            ("BOX", (0,0), (-1,-1), 1, colors.turquoise),
-            ("BOTTOMPADDING", (0,0), (-1,-1), 12),
-            ("TOPPADDING", (0,0), (-1,-1), 12)
-        ]))
+        title_table.setStyle(template.section_title_style)
         return title_table
 
     story = []
@@ -230,32 +510,16 @@ def generate_pdf_from_json(json_data, output_file):
         """
         Dessine la bannière en haut de la première page.
         """
-        try:
-            banner_path = "Background.png"  # Mettez ici le chemin vers votre bannière, si nécessaire
-            if os.path.exists(banner_path):
-                banner_img = ImageReader(banner_path)
-                banner_height = 2 * inch
-                canvas_obj.drawImage(banner_img, 0, A4[1] - banner_height,
+        banner_height = template.banner_height
+        if template.banner_image is not None:
+            try:
+                canvas_obj.drawImage(template.banner_image, 0, A4[1] - banner_height,
                                      width=A4[0], height=banner_height)
-            else:
-                logging.warning(f"Bannière introuvable : {banner_path}")
-                banner_height = 2 * inch
-        except Exception as e:
-            logging.error(f"Erreur lors du chargement de la bannière : {e}")
-            banner_height = 2 * inch
-
-        title_style = ParagraphStyle(
-            name='HeaderTitle',
-            parent=styles['Normal'],
-            fontName='Helvetica-Bold',
-            fontSize=14,
-            alignment=0,
-            leading=24,
-            textColor=colors.white
-        )
+            except Exception as e:
+                logging.error(f"Erreur lors du dessin de la bannière : {e}")
         
-        job_title = json_data.get('job_title', '').replace('\n', ' ').strip() or "CV Title"
-        title_para = Paragraph(job_title, title_style)
+        job_title, experience_text = banner_header_text(json_data)
+        title_para = Paragraph(job_title, styles['HeaderTitle'])
         available_width = A4[0] - 2 * inch
         w, h = title_para.wrap(available_width, 100)
         vertical_offset = 20
@@ -263,27 +527,15 @@ def generate_pdf_from_json(json_data, output_file):
         header_x = 4.5 * cm
         title_para.drawOn(canvas_obj, header_x, title_y)
         
-        full_name = json_data.get('full_name', '').strip()
-        if full_name:
-            parts = full_name.split()
-            if len(parts) >= 2:
-                initials = parts[0][0].upper() + "." + parts[-1][0].upper()
-            else:
-                initials = full_name[0].upper()
-        else:
-            initials = "?"
-        canvas_obj.setFont("Helvetica-Bold", 14)
-        years_experience = str(json_data.get('years_of_experience', '')).replace('\n', ' ').strip()
-        experience_text = f"{initials} : {years_experience} XP"
+        canvas_obj.setFont(template.bold_font_name, 14)
         canvas_obj.setFillColor(colors.white)
         canvas_obj.drawString(header_x, title_y - 20, experience_text)
         
-        # Exemple d'infos sur le header
+        # Infos du header (propres au modèle)
         icon_y_position = A4[1] - inch - 60
-        canvas_obj.setFont("Helvetica", 8)
-        canvas_obj.drawString(80, icon_y_position, "01 40 76 01 49")
-        canvas_obj.drawString(260, icon_y_position, "heptasys@heptasys.com")
-        canvas_obj.drawString(470, icon_y_position, "www.heptasys.com")
+        canvas_obj.setFont(template.font_name, 8)
+        for x_position, text in template.header_lines:
+            canvas_obj.drawString(x_position, icon_y_position, text)
     
     # Décalage avant le contenu principal
     story.append(Spacer(1, 100))
@@ -302,20 +554,14 @@ def generate_pdf_from_json(json_data, output_file):
             education_rows.append([left_text, right_text])
         if education_rows:
             edu_table = Table(education_rows, colWidths=[4.5*inch, 1.5*inch])
-            edu_table.setStyle(TableStyle([
-                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 6)
-            ]))
+            edu_table.setStyle(template.list_table_style)
             story.append(edu_table)
             story.append(Spacer(1, 12))
     if json_data.get('certifications'):
         certification_rows = [[Paragraph(cert, styles['Bold'])] for cert in json_data.get('certifications', [])]
         if certification_rows:
             certs_table = Table(certification_rows, colWidths=[6*inch])
-            certs_table.setStyle(TableStyle([
-                ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-                ('BOTTOMPADDING', (0,0), (-1,-1), 6)
-            ]))
+            certs_table.setStyle(template.list_table_style)
             story.append(certs_table)
             story.append(Spacer(1, 12))
     
@@ -346,106 +592,304 @@ def generate_pdf_from_json(json_data, output_file):
     # Expériences professionnelles
     story.append(create_section_title("Expériences professionnelles"))
     story.append(Spacer(1, 12))
+    if experience_flowables is None:
+        experience_flowables = [build_experience_flowables(exp, template)
+                                for exp in json_data.get('professional_experience', [])]
+    for flowables in experience_flowables:
+        story.extend(flowables)
+    
+    doc.build(story, onFirstPage=draw_banner)
+
+def _set_cell_borders(cell, color=None, size=8):
+    """
+    Définit les bordures d'une cellule DOCX : trait `color` (hexadécimal) ou aucune bordure.
+    """
+    tc_pr = cell._element.get_or_add_tcPr()
+    borders = OxmlElement('w:tcBorders')
+    for edge in ('top', 'left', 'bottom', 'right'):
+        border = OxmlElement(f'w:{edge}')
+        if color:
+            border.set(qn('w:val'), 'single')
+            border.set(qn('w:sz'), str(size))
+            border.set(qn('w:color'), color)
+        else:
+            border.set(qn('w:val'), 'nil')
+        borders.append(border)
+    tc_pr.append(borders)
+
+def _float_picture_behind_text(run):
+    """
+    Transforme l'image inline d'un run en image ancrée en haut à gauche de la page,
+    derrière le texte (python-docx ne sait créer que des images inline).
+    """
+    inline = run._element.xpath('.//wp:inline')[0]
+    anchor = OxmlElement('wp:anchor')
+    for attr, value in (('distT', '0'), ('distB', '0'), ('distL', '0'), ('distR', '0'),
+                        ('simplePos', '0'), ('relativeHeight', '0'), ('behindDoc', '1'),
+                        ('locked', '0'), ('layoutInCell', '1'), ('allowOverlap', '1')):
+        anchor.set(attr, value)
+    simple_pos = OxmlElement('wp:simplePos')
+    simple_pos.set('x', '0')
+    simple_pos.set('y', '0')
+    anchor.append(simple_pos)
+    for tag, relative_from in (('wp:positionH', 'page'), ('wp:positionV', 'page')):
+        position = OxmlElement(tag)
+        position.set('relativeFrom', relative_from)
+        offset = OxmlElement('wp:posOffset')
+        offset.text = '0'
+        position.append(offset)
+        anchor.append(position)
+    anchor.append(inline.find(qn('wp:extent')))
+    effect_extent = OxmlElement('wp:effectExtent')
+    for attr in ('l', 't', 'r', 'b'):
+        effect_extent.set(attr, '0')
+    anchor.append(effect_extent)
+    anchor.append(OxmlElement('wp:wrapNone'))
+    for child in list(inline):
+        if child.tag in (qn('wp:docPr'), qn('wp:cNvGraphicFramePr'), qn('a:graphic')):
+            anchor.append(child)
+    inline.getparent().replace(inline, anchor)
+
+def generate_docx_from_json(json_data, output_file, template_name=None):
+    """
+    Génère directement un DOCX à partir des données JSON extraites, avec python-docx,
+    en reprenant les sections et la bannière de generate_pdf_from_json.
+    `output_file` peut être un chemin ou un objet fichier.
+    """
+    template = get_template(template_name)
+    doc = Document()
+    section = doc.sections[0]
+    section.page_width = Pt(A4[0])
+    section.page_height = Pt(A4[1])
+    section.left_margin = section.right_margin = Inches(1)
+    section.top_margin = Inches(0.5)
+    section.bottom_margin = Inches(1)
+    section.header_distance = Inches(0.5)
+    section.different_first_page_header_footer = True
+    
+    normal = doc.styles['Normal']
+    normal.font.name = template.font_name
+    normal.font.size = Pt(template.styles['Normal'].fontSize)
+    normal.paragraph_format.space_after = Pt(0)
+    normal.paragraph_format.line_spacing = Pt(12)
+    
+    def add_paragraph(container, text='', bold=False, size=None, color=None):
+        paragraph = container.add_paragraph()
+        if text:
+            run = paragraph.add_run(text)
+            run.bold = bold
+            if size:
+                run.font.size = Pt(size)
+            if color:
+                run.font.color.rgb = RGBColor.from_string(color)
+        return paragraph
+    
+    def add_spacer(points):
+        paragraph = doc.add_paragraph()
+        paragraph.paragraph_format.line_spacing = Pt(points)
+    
+    def add_section_title(title_text):
+        table = doc.add_table(rows=1, cols=1)
+        table.alignment = WD_TABLE_ALIGNMENT.CENTER
+        cell = table.cell(0, 0)
+        cell.width = Inches(6)
+        _set_cell_borders(cell, template.accent_hex)
+        paragraph = cell.paragraphs[0]
+        paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        paragraph.paragraph_format.space_before = Pt(12)
+        paragraph.paragraph_format.space_after = Pt(12)
+        run = paragraph.add_run(title_text)
+        run.bold = True
+        run.font.size = Pt(12)
+        add_spacer(12)
+    
+    def add_two_column_table(rows, widths, bold=(True, True), right_aligned=False):
+        table = doc.add_table(rows=len(rows), cols=2)
+        for row, texts in zip(table.rows, rows):
+            for column, (cell, text, width) in enumerate(zip(row.cells, texts, widths)):
+                cell.width = Inches(width)
+                _set_cell_borders(cell)
+                cell.paragraphs[0].add_run(text).bold = bold[column]
+                cell.paragraphs[0].paragraph_format.space_after = Pt(6)
+            if right_aligned:
+                row.cells[1].paragraphs[0].alignment = WD_ALIGN_PARAGRAPH.RIGHT
+        return table
+    
+    # Bannière de la première page (image derrière le texte) et informations d'en-tête
+    header = section.first_page_header
+    job_title, experience_text = banner_header_text(json_data)
+    banner_paragraph = header.paragraphs[0]
+    if template.banner_bytes:
+        banner_run = banner_paragraph.add_run()
+        banner_run.add_picture(io.BytesIO(template.banner_bytes), width=Pt(A4[0]), height=Pt(template.banner_height))
+        _float_picture_behind_text(banner_run)
+    title_paragraph = add_paragraph(header, job_title, bold=True, size=14, color="FFFFFF")
+    title_paragraph.paragraph_format.left_indent = Cm(4.5 - 2.54)
+    experience_paragraph = add_paragraph(header, experience_text, bold=True, size=14, color="FFFFFF")
+    experience_paragraph.paragraph_format.left_indent = Cm(4.5 - 2.54)
+    experience_paragraph.paragraph_format.space_before = Pt(6)
+    contact_paragraph = header.add_paragraph()
+    contact_paragraph.paragraph_format.space_before = Pt(34)
+    contact_paragraph.paragraph_format.space_after = Pt(24)
+    for x_position, text in template.header_lines:
+        # Les positions du modèle sont relatives au bord de la page, les tabulations à la marge
+        contact_paragraph.paragraph_format.tab_stops.add_tab_stop(Emu(Pt(x_position) - section.left_margin))
+        run = contact_paragraph.add_run(f"\t{text}")
+        run.font.size = Pt(8)
+        run.font.color.rgb = RGBColor.from_string("FFFFFF")
+    
+    # Formation & Certifications
+    add_section_title("Formation & Certifications")
+    if json_data.get('education'):
+        education_rows = []
+        for edu in json_data.get('education', []):
+            degree = edu.get('degree', '').replace('\n', ' ')
+            institution = edu.get('institution', '').replace('\n', ' ')
+            year = str(edu.get('year_of_completion', '')).strip()
+            education_rows.append((f"{degree} à {institution}", year))
+        add_two_column_table(education_rows, (4.5, 1.5), bold=(True, False))
+        add_spacer(12)
+    if json_data.get('certifications'):
+        for cert in json_data.get('certifications', []):
+            add_paragraph(doc, cert, bold=True).paragraph_format.space_after = Pt(6)
+        add_spacer(12)
+    
+    # Compétences techniques
+    add_section_title("Compétences techniques")
+    skills_section = json_data.get('skills', None)
+    if isinstance(skills_section, dict) and skills_section:
+        for category_key, skills in skills_section.items():
+            cat_title = category_key.replace('_', ' ').title()
+            if isinstance(skills, str):
+                skills = skills.strip()
+            paragraph = doc.add_paragraph()
+            paragraph.paragraph_format.space_after = Pt(6)
+            if skills:
+                paragraph.add_run(f"{cat_title} :").bold = True
+                paragraph.add_run(f" {skills}")
+            else:
+                paragraph.add_run(cat_title).bold = True
+    elif isinstance(skills_section, str) and skills_section:
+        text = skills_section.strip()
+        if text.endswith(":") and len(text.split(":")[-1].strip()) == 0:
+            text = text[:-1].strip()
+        add_paragraph(doc, text)
+    else:
+        add_paragraph(doc, "Aucune compétence technique extraite.")
+    add_spacer(12)
+    
+    # Expériences professionnelles
+    add_section_title("Expériences professionnelles")
     for exp in json_data.get('professional_experience', []):
         date_range = exp.get('date_range', '').strip() or "Date non renseignée"
         company_name = exp.get('company_name', '').replace('\n', ' ').strip()
         mission = exp.get('mission', '').replace('\n', ' ').strip() or "Poste non renseigné"
         
-        exp_table = Table([
-            [Paragraph(f"<b>{date_range}</b>", styles['Normal']),
-             Paragraph(f"<b>{company_name}</b>", styles['Normal'])]
-        ], colWidths=[3.0 * inch, 3.0 * inch])
-        exp_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-            ('BOTTOMPADDING', (0,0), (-1,-1), 6)
-        ]))
-        story.append(exp_table)
-        
-        story.append(Paragraph(mission, styles['Bold']))
+        add_two_column_table([(date_range, company_name)], (3.0, 3.0), right_aligned=True)
+        add_paragraph(doc, mission, bold=True)
         
         if exp.get('tasks'):
-            story.append(Paragraph("Tâches :", styles['Bold']))
+            add_paragraph(doc, "Tâches :", bold=True)
             for task in exp.get('tasks'):
-                story.append(Paragraph("• " + task.replace('\n', ' '), styles['Normal']))
+                add_paragraph(doc, "• " + task.replace('\n', ' '))
         
         if exp.get('tech_tools'):
             tech_tools = ", ".join(exp.get('tech_tools', []))
-            story.append(Paragraph("<font color='turquoise'><b>Outils</b></font> : " + tech_tools, styles['Normal']))
+            paragraph = doc.add_paragraph()
+            tools_run = paragraph.add_run("Outils")
+            tools_run.bold = True
+            tools_run.font.color.rgb = RGBColor.from_string(template.accent_hex)
+            paragraph.add_run(" : " + tech_tools)
         
-        story.append(Spacer(1, 12))
+        add_spacer(12)
     
-    doc.build(story, onFirstPage=draw_banner)
+    doc.save(output_file)
 
-def remove_blank_paragraphs(docx_file_path):
+def remove_blank_paragraphs(doc):
     """
-    Supprime les paragraphes vides dans un DOCX, sauf ceux contenant des images (w:drawing).
+    Supprime les paragraphes vides d'un Document python-docx, sauf ceux contenant des images (w:drawing).
     """
-    doc = Document(docx_file_path)
     for paragraph in list(doc.paragraphs):
         if not paragraph.text.strip():
             if paragraph._element.xpath('.//w:drawing'):
                 continue
             p = paragraph._element
             p.getparent().remove(p)
-    doc.save(docx_file_path)
 
-def convert_pdf_to_docx(pdf_path, docx_path):
+def adjust_docx_top_margin(doc, top_margin_inch=0.5):
+    """
+    Ajuste la marge supérieure d'un Document python-docx.
+    """
+    for section in doc.sections:
+        section.top_margin = Inches(top_margin_inch)
+
+@timed("docx_conversion", falsy_is_error=True)
+def convert_pdf_to_docx(pdf_bytes, docx_output, top_margin_inch=0.5):
     """
-    Convertit un PDF en DOCX via pdf2docx, puis supprime les paragraphes vides.
+    Convertit un PDF en mémoire en DOCX via pdf2docx, supprime les paragraphes vides
+    et ajuste la marge supérieure en un seul chargement du document.
+    Le résultat est écrit dans `docx_output` (objet fichier).
     """
     try:
-        cv = Converter(pdf_path)
-        cv.convert(docx_path, start=0)
+        from pdf2docx import Converter  # import différé : pdf2docx est lent à charger
+        cv = Converter(stream=pdf_bytes)
+        raw_docx = io.BytesIO()
+        cv.convert(raw_docx, start=0)
         cv.close()
-        remove_blank_paragraphs(docx_file_path=docx_path)
-        logging.info(f"Conversion réussie : {pdf_path} -> {docx_path}")
+        raw_docx.seek(0)
+        doc = Document(raw_docx)
+        remove_blank_paragraphs(doc)
+        adjust_docx_top_margin(doc, top_margin_inch=top_margin_inch)
+        doc.save(docx_output)
+        logging.info("Conversion PDF -> DOCX réussie.")
         return True
     except Exception as e:
         logging.error(f"Erreur lors de la conversion du PDF en DOCX : {e}")
         return False
 
-def adjust_docx_top_margin(docx_file_path, top_margin_inch=0.5):
+@timed("blob_upload", falsy_is_error=True)
+def upload_to_blob_storage(data, blob_name, overwrite=True):
     """
-    Ajuste la marge supérieure d'un DOCX.
+    Enregistre un contenu (objet fichier ou octets) dans le stockage configuré (Blob Storage
+    ou disque local). Avec overwrite=False, un fichier déjà présent est conservé.
+    Retourne True si le fichier est disponible.
     """
-    doc = Document(docx_file_path)
-    for section in doc.sections:
-        section.top_margin = Inches(top_margin_inch)
-    doc.save(docx_file_path)
+    try:
+        return get_storage().upload(data, blob_name, overwrite)
+    except Exception as e:
+        logging.error(f"Erreur lors de l'upload vers le stockage : {e}")
+        return False
 
-def upload_to_blob_storage(file_path, blob_name):
+def blob_exists(blob_name):
     """
-    Upload un fichier local vers Azure Blob Storage dans le conteneur défini.
+    Indique si le fichier existe déjà (False en cas d'erreur, le fichier est alors regénéré).
     """
     try:
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-        with open(file_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
-        logging.info(f"Fichier {blob_name} uploadé vers Azure Blob Storage.")
+        return get_storage().exists(blob_name)
     except Exception as e:
-        logging.error(f"Erreur lors de l'upload vers Blob Storage : {e}")
+        logging.warning(f"Impossible de vérifier l'existence du blob {blob_name} : {e}")
+        return False
 
-def generate_sas_token(blob_name):
+@timed("sas_generation", falsy_is_error=True)
+def generate_sas_urls(blob_names, minutes=LINK_TTL_MINUTES):
     """
-    Génère un SAS token en lecture seule (valable 10 minutes) pour un blob.
+    Génère en une passe les liens de téléchargement en lecture seule (valables `minutes` minutes)
+    d'une liste de fichiers : URLs SAS avec Blob Storage, URLs signées de /files en local.
+    Retourne {nom du blob: URL} ou None.
     """
     try:
-        sas_token = generate_blob_sas(
-            account_name=blob_service_client.account_name,
-            container_name=container_name,
-            blob_name=blob_name,
-            account_key=_account_key,
-            permission=BlobSasPermissions(read=True),
-            expiry=datetime.now(timezone.utc) + timedelta(minutes=10)
-        )
-        blob_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob_name}?{sas_token}"
-        return blob_url
+        return get_storage().urls(blob_names, minutes)
     except Exception as e:
         logging.error(f"Erreur lors de la génération du SAS token : {e}")
         return None
 
+def generate_sas_token(blob_name):
+    """
+    Génère un lien de téléchargement en lecture seule (valable LINK_TTL_MINUTES minutes) pour un fichier.
+    """
+    urls = generate_sas_urls([blob_name])
+    return urls[blob_name] if urls else None
+
 @app.route('/generate-sas-token', methods=['POST'])
 def generate_sas_token_route():
     """
@@ -461,6 +905,53 @@ def generate_sas_token_route():
     else:
         return jsonify({"error": "Échec de la génération du SAS token"}), 500
 
+@app.route('/files/<path:name>', methods=['GET'])
+def download_file(name):
+    """
+    Sert un fichier du stockage local à partir d'une URL signée (expires, sig).
+    Requêtes conditionnelles (ETag, If-Modified-Since) et partielles (Range) prises en charge ;
+    le fichier est transmis par wsgi.file_wrapper (sendfile sous gunicorn).
+    """
+    storage = get_storage()
+    if storage.name != "local":
+        abort(404)
+    expires = request.args.get('expires')
+    if not storage.verify(name, expires, request.args.get('sig')):
+        return jsonify({"error": "Lien invalide ou expiré"}), 403
+    path = storage.path(name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    # Les noms étant adressés par le contenu, le fichier ne change pas pendant la validité du lien
+    response = send_file(path, mimetype=content_type_for(name), conditional=True, etag=True,
+                         max_age=max(0, int(expires) - int(time.time())),
+                         download_name=os.path.basename(name))
+    # CV : mis en cache par le navigateur uniquement, jamais par un proxy partagé
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+@app.route('/templates', methods=['GET'])
+def list_templates_route():
+    """
+    Endpoint listant les modèles de mise en page disponibles.
+    """
+    registry = get_registry()
+    return jsonify({"templates": registry.names(), "default": registry.default_name}), 200
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats_route():
+    """
+    Endpoint retournant les compteurs de succès/échecs du cache d'extraction.
+    """
+    return jsonify(extraction_cache.stats()), 200
+
+def receive_files():
+    """
+    Réception et analyse du corps multipart de la requête (étape "upload").
+    """
+    with observe_stage("upload"):
+        return request.files
+
 def allowed_file(filename):
     """
     Vérifie l'extension du fichier : PDF, DOCX, PNG, JPG, JPEG.
@@ -468,6 +959,532 @@ def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'pdf', 'docx', 'png', 'jpg', 'jpeg'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+class PipelineError(Exception):
+    """
+    Erreur d'une étape du pipeline, accompagnée du code HTTP à renvoyer.
+    """
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+def extract_incremental(extracted_text):
+    """
+    Nouvelle version d'un CV déjà indexé : ses blocs sont appariés à ceux de la version
+    enregistrée la plus proche (même e-mail, ou blocs identiques si le CV n'en contient pas),
+    seuls les blocs qui ne sont pas identiques sont envoyés au modèle et le JSON partiel est
+    fusionné dans le JSON enregistré.
+    Retourne le JSON, ou None si le CV doit être extrait entièrement.
+    """
+    if not (INCREMENTAL_EXTRACTION and CANDIDATE_INDEX_ENABLED):
+        return None
+    with observe_stage("incremental_match"):
+        blocks, fingerprints = fingerprint_text(extracted_text)
+        if len(blocks) < 2:
+            return None
+        email = find_email(extracted_text)
+        try:
+            previous_versions = candidate_index.find_previous(
+                candidate_id({"contact_information": {"email": email}}) if email else None,
+                [fingerprint["hash"] for fingerprint in fingerprints],
+                header_hash=fingerprints[0]["hash"], phones=find_phones(extracted_text)
+            )
+        except Exception as e:
+            logging.error(f"Index des candidats indisponible, extraction complète "
+                          f"(recherche suspendue {candidate_index.lookup_retry:g} s) : {e}")
+            return None
+        # Version la plus proche : la plus grande part du texte appariée (identique ou similaire)
+        previous, unchanged, edited, best = None, set(), set(), None
+        for version in previous_versions:
+            exact, similar = match_blocks(version["blocks"], fingerprints, BLOCK_SIMILARITY)
+            rank = (changed_share(fingerprints, exact | similar), changed_share(fingerprints, exact))
+            if best is None or rank < best:
+                previous, unchanged, edited, best = version, exact, similar, rank
+    
+    share = changed_share(fingerprints, unchanged)
+    if previous is None or share > INCREMENTAL_MAX_CHANGED_SHARE:
+        INCREMENTAL_EXTRACTIONS.inc(outcome="full")
+        return None
+    if len(unchanged) == len(blocks):
+        logging.info("Tous les blocs du CV sont inchangés, JSON enregistré réutilisé sans appel au modèle.")
+        INCREMENTAL_EXTRACTIONS.inc(outcome="reused")
+        return previous["data"]
+    
+    changed_text = "\n\n".join(block for index, block in enumerate(blocks) if index not in unchanged)
+    logging.info(f"Extraction incrémentale : {len(edited)} blocs modifiés et "
+                 f"{len(blocks) - len(unchanged) - len(edited)} nouveaux sur {len(blocks)} ({share:.0%} du texte)")
+    try:
+        if needs_chunking(changed_text):
+            partial = extract_info_chunked(changed_text)
+        else:
+            raw_json_text = extract_info_to_json(changed_text, excerpt=True)
+            partial = parse_json_response(raw_json_text) if raw_json_text else None
+    except PipelineError:
+        partial = None
+    if partial is None:
+        logging.error("Échec de l'extraction des blocs modifiés, extraction complète")
+        INCREMENTAL_EXTRACTIONS.inc(outcome="full")
+        return None
+    INCREMENTAL_EXTRACTIONS.inc(outcome="partial")
+    json_data, _ = normalize_cv(merge_incremental(previous["data"], partial, blocks, unchanged))
+    return json_data
+
+def structure_text(extracted_text, cache_key=None, progress=None, incremental=True):
+    """
+    Envoie le texte extrait au modèle, parse le JSON obtenu et l'enregistre dans le cache.
+    Une nouvelle version d'un CV déjà indexé n'envoie que ses blocs modifiés
+    (extract_incremental), sauf si `incremental` vaut False.
+    Retourne les données JSON ou lève PipelineError.
+    """
+    if progress:
+        progress("llm_extraction")
+    json_data = extract_incremental(extracted_text) if incremental else None
+    if json_data is not None:
+        if CACHE_ENABLED and cache_key:
+            extraction_cache.put(cache_key, extracted_text, json_data)
+        return json_data
+    if needs_chunking(extracted_text):
+        json_data = extract_info_chunked(extracted_text)
+        if CACHE_ENABLED and cache_key:
+            extraction_cache.put(cache_key, extracted_text, json_data)
+        return json_data
+    
+    raw_json_text = extract_info_to_json(extracted_text)
+    if not raw_json_text:
+        logging.error("Échec de l'extraction des informations structurées (réponse vide)")
+        raise PipelineError("Échec de l'extraction des informations structurées")
+    
+    logging.info("Informations extraites au format JSON (brut).")
+    
+    json_data = parse_json_response(raw_json_text)
+    if json_data is None:
+        raise PipelineError("Réponse JSON invalide du modèle")
+    
+    if CACHE_ENABLED and cache_key:
+        extraction_cache.put(cache_key, extracted_text, json_data)
+    return json_data
+
+@timed("docx_render", falsy_is_error=True)
+def render_docx(json_data, docx_output, template_name=None):
+    """
+    Rendu natif du DOCX depuis le JSON. Retourne True si le document a été généré.
+    """
+    try:
+        generate_docx_from_json(json_data, docx_output, template_name)
+        return True
+    except Exception as e:
+        logging.error(f"Erreur lors de la génération du DOCX : {e}")
+        return False
+
+def warm_render_worker():
+    """
+    Initialisation d'un processus de rendu : modèles compilés (polices, styles, bannière
+    décodée) et bibliothèques de conversion chargés avant le premier CV.
+    """
+    get_registry()
+    if DOCX_RENDERER == "pdf2docx":
+        import pdf2docx  # noqa: F401 (chargement lent, fait une fois par processus)
+
+def render_pdf_bytes(json_data, template_name=None):
+    """
+    Rendu du PDF dans un processus du pool. Retourne (octets, durée en secondes).
+    """
+    started = time.perf_counter()
+    output = io.BytesIO()
+    generate_pdf_from_json(json_data, output, template_name)
+    return output.getvalue(), time.perf_counter() - started
+
+def render_docx_bytes(json_data, template_name=None):
+    """
+    Rendu natif du DOCX dans un processus du pool. Retourne (octets ou None, durée).
+    """
+    started = time.perf_counter()
+    output = io.BytesIO()
+    ok = render_docx(json_data, output, template_name)
+    return output.getvalue() if ok else None, time.perf_counter() - started
+
+def convert_pdf_bytes_to_docx(pdf_bytes):
+    """
+    Conversion pdf2docx et retouches python-docx dans un processus du pool.
+    Retourne (octets ou None, durée).
+    """
+    started = time.perf_counter()
+    output = io.BytesIO()
+    ok = convert_pdf_to_docx(pdf_bytes, output, top_margin_inch=0.5)
+    return output.getvalue() if ok else None, time.perf_counter() - started
+
+def get_render_pool():
+    """
+    Retourne le pool de processus de rendu (RENDER_PROCESSES), créé au premier appel,
+    ou None si le rendu se fait dans le processus.
+    """
+    global _render_pool
+    if RENDER_PROCESSES <= 0:
+        return None
+    with _render_pool_lock:
+        if _render_pool is None:
+            # Modèles compilés avant le fork : hérités par les processus, verrou de compilation libre
+            get_registry()
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_PROCESSES, initializer=warm_render_worker)
+        return _render_pool
+
+def reset_render_pool(pool):
+    """
+    Abandonne un pool dont un processus s'est arrêté brutalement ; le suivant est recréé au prochain rendu.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False)
+
+def warm_render_pool():
+    """
+    Démarre tous les processus de rendu au lancement du service, une fois les modèles
+    compilés (hérités par les processus), pour que le premier CV ne paie pas leur démarrage.
+    Appelé par le point d'entrée du serveur (start_render_pool_warmup), jamais à l'import :
+    les outils qui importent convert (banc d'essai, scripts) ne démarrent aucun processus.
+    """
+    # Un processus du pool qui réimporte ce module (méthode spawn) ne démarre pas de pool
+    if multiprocessing.parent_process() is not None:
+        return
+    get_registry()
+    pool = get_render_pool()
+    if pool is None:
+        return
+    try:
+        for future in [pool.submit(os.getpid) for _ in range(RENDER_PROCESSES)]:
+            future.result()
+        logging.info(f"Pool de rendu prêt : {RENDER_PROCESSES} processus")
+    except Exception as e:
+        logging.error(f"Erreur lors du démarrage du pool de rendu : {e}")
+
+def _pool_result(future, stage):
+    """
+    Résultat d'un rendu du pool ; la durée mesurée dans le processus est reportée dans les métriques.
+    """
+    try:
+        data, seconds = future.result()
+    except BrokenProcessPool:
+        raise
+    except Exception:
+        record_stage_error(stage)
+        raise
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if data is None:
+        record_stage_error(stage)
+    return data
+
+def render_in_pool(pool, json_data, template_name, report):
+    """
+    Rendu du PDF et du DOCX dans le pool de processus : seuls le JSON et les octets des
+    documents transitent entre les processus. Retourne (PDF, DOCX ou None).
+    """
+    pdf_future = pool.submit(render_pdf_bytes, json_data, template_name)
+    if DOCX_RENDERER == "pdf2docx":
+        pdf_bytes = _pool_result(pdf_future, "pdf_render")
+        report("docx_conversion")
+        docx_bytes = _pool_result(pool.submit(convert_pdf_bytes_to_docx, pdf_bytes), "docx_conversion")
+    else:
+        report("docx_render")
+        docx_future = pool.submit(render_docx_bytes, json_data, template_name)
+        pdf_bytes = _pool_result(pdf_future, "pdf_render")
+        docx_bytes = _pool_result(docx_future, "docx_render")
+    return pdf_bytes, docx_bytes
+
+def spooled_buffer():
+    """
+    Tampon en mémoire qui ne déborde sur disque qu'au-delà de SPOOL_THRESHOLD octets ;
+    le fichier éventuel est supprimé à la fermeture.
+    """
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD)
+
+def render_and_upload(json_data, filename, template_name=None, progress=None, experience_flowables=None,
+                      source_text=None):
+    """
+    Génère le PDF et le DOCX en mémoire, les upload sur Blob Storage et retourne les URLs SAS.
+    `source_text` (texte compacté du CV) sert aux empreintes de blocs de l'index des candidats.
+    Lève PipelineError en cas d'échec.
+    """
+    def report(stage):
+        if progress:
+            progress(stage)
+    
+    pdf_file_name = generate_pdf_filename(json_data, filename, template_name)
+    docx_file_name = pdf_file_name[:-len('.pdf')] + '.docx'
+    
+    # Les noms étant dérivés du contenu, des blobs déjà présents sont identiques : rendu et upload ignorés
+    existing = list(upload_executor.map(blob_exists, [pdf_file_name, docx_file_name]))
+    if all(existing):
+        logging.info(f"PDF et DOCX déjà présents dans le stockage ({pdf_file_name}), rendu ignoré.")
+    else:
+        render_and_store(json_data, pdf_file_name, docx_file_name, template_name, report, experience_flowables)
+    
+    # Génération des URLs SAS
+    report("sas_generation")
+    sas_urls = generate_sas_urls([pdf_file_name, docx_file_name])
+    
+    if not sas_urls:
+        logging.error("Échec de la génération des SAS tokens")
+        raise PipelineError("Échec de la génération des SAS tokens")
+    
+    pdf_sas_url = sas_urls[pdf_file_name]
+    docx_sas_url = sas_urls[docx_file_name]
+    # Les URLs contiennent le jeton SAS : seuls les noms des blobs sont journalisés
+    logging.info(f"SAS URLs générés : PDF - {pdf_file_name}, DOCX - {docx_file_name}")
+    index_candidate(json_data, pdf_file_name, docx_file_name, filename, template_name, source_text)
+    return {
+        "pdf_sas_url": pdf_sas_url,
+        "docx_sas_url": docx_sas_url
+    }
+
+def index_candidate(json_data, pdf_file_name, docx_file_name, filename=None, template_name=None, source_text=None):
+    """
+    Met le candidat en attente d'écriture dans l'index MongoDB (écriture groupée en
+    arrière-plan), avec les empreintes des blocs du texte source s'il est connu ;
+    une erreur ne fait jamais échouer le traitement du CV.
+    """
+    if not CANDIDATE_INDEX_ENABLED:
+        return
+    try:
+        fingerprints = fingerprint_text(source_text)[1] if source_text else None
+        candidate_index.submit(candidate_document(
+            json_data, {"pdf": pdf_file_name, "docx": docx_file_name}, filename,
+            template_name or get_registry().default_name, fingerprints))
+    except Exception as e:
+        logging.error(f"Erreur lors de l'indexation du candidat : {e}")
+
+def render_and_store(json_data, pdf_file_name, docx_file_name, template_name, report, experience_flowables=None):
+    """
+    Génère le PDF et le DOCX dans des tampons en mémoire puis les upload en parallèle.
+    Lève PipelineError en cas d'échec.
+    """
+    with spooled_buffer() as pdf_buffer, spooled_buffer() as docx_buffer:
+        # Génération du PDF et du DOCX en parallèle : le DOCX est rendu directement
+        # depuis le JSON, sauf si DOCX_RENDERER=pdf2docx (conversion du PDF).
+        # Les éléments PDF préparés pendant un flux ne sont pas transmissibles à un
+        # autre processus : ce rendu reste dans le processus.
+        report("pdf_render")
+        pool = get_render_pool() if experience_flowables is None else None
+        docx_ok = None
+        if pool is not None:
+            try:
+                pdf_bytes, docx_bytes = render_in_pool(pool, json_data, template_name, report)
+                pdf_buffer.write(pdf_bytes)
+                docx_ok = docx_bytes is not None
+                if docx_ok:
+                    docx_buffer.write(docx_bytes)
+            except BrokenProcessPool:
+                logging.error("Processus de rendu arrêté brutalement, rendu dans le processus et pool recréé")
+                reset_render_pool(pool)
+        if docx_ok is None:
+            pdf_future = render_executor.submit(generate_pdf_from_json, json_data, pdf_buffer, template_name, experience_flowables)
+            if DOCX_RENDERER == "pdf2docx":
+                pdf_future.result()
+                pdf_buffer.seek(0)
+                report("docx_conversion")
+                docx_ok = convert_pdf_to_docx(pdf_buffer.read(), docx_buffer, top_margin_inch=0.5)
+            else:
+                report("docx_render")
+                docx_ok = render_docx(json_data, docx_buffer, template_name)
+                pdf_future.result()
+        logging.info(f"PDF généré : {pdf_file_name}")
+        if not docx_ok:
+            logging.error("Échec de la génération du DOCX")
+            raise PipelineError("Échec de la génération du DOCX")
+        logging.info(f"DOCX généré : {docx_file_name}")
+        
+        # Upload dans le Blob Storage, PDF et DOCX en parallèle
+        report("blob_upload")
+        pdf_upload = upload_executor.submit(upload_to_blob_storage, pdf_buffer, pdf_file_name, False)
+        docx_upload = upload_executor.submit(upload_to_blob_storage, docx_buffer, docx_file_name, False)
+        if not (pdf_upload.result() and docx_upload.result()):
+            raise PipelineError("Échec de l'upload vers Blob Storage")
+        logging.info(f"PDF et DOCX uploadés vers Blob Storage sous les noms {pdf_file_name} et {docx_file_name}")
+
+def process_cv(file_bytes, filename, template_name=None, progress=None):
+    """
+    Exécute le pipeline complet sur le contenu d'un fichier reçu en mémoire :
+    extraction, appel AzureOpenAI, génération PDF/DOCX, upload et SAS.
+    `progress` est appelé avec le nom de chaque étape.
+    Retourne le dictionnaire des URLs SAS ou lève PipelineError.
+    """
+    # Recherche dans le cache d'extraction (clé : contenu du fichier + prompt + modèle)
+    cache_key = ExtractionCache.make_key(file_bytes, PROMPT_VERSION, OPENAI_DEPLOYMENT)
+    cached = extraction_cache.get(cache_key) if CACHE_ENABLED else None
+    
+    if cached:
+        logging.info("Extraction trouvée dans le cache, OCR et appel au modèle ignorés.")
+        json_data = cached["data"]
+        extracted_text = cached.get("text")
+    else:
+        # Extraction de texte
+        if progress:
+            progress("text_extraction")
+        extracted_text = extract_cv_text(file_bytes, filename)
+        if not extracted_text:
+            logging.error("Aucun texte extrait du fichier")
+            raise PipelineError("Échec de l'extraction du texte")
+        logging.info("Texte extrait du fichier avec succès.")
+        extracted_text = compact_for_prompt(extracted_text)
+        
+        # Extraction des informations (JSON)
+        json_data = structure_text(extracted_text, cache_key, progress)
+    
+    # Le JSON complet (données personnelles) n'est journalisé que pour l'échantillon PAYLOAD_LOG_SAMPLE_RATE
+    if sample_payload_logging():
+        logging.info("Données JSON chargées : %s", json_data)
+    else:
+        logging.info(f"Données JSON chargées : {len(json_data.get('professional_experience') or [])} expériences, "
+                     f"{len(json_data.get('education') or [])} formations")
+    return render_and_upload(json_data, filename, template_name, progress, source_text=extracted_text)
+
+def get_extraction_pool():
+    """
+    Retourne le pool de processus dédié à l'extraction (PyMuPDF, pytesseract), créé au premier appel.
+    """
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_PROCESSES)
+        return _extraction_pool
+
+def read_buffer(buffer):
+    """
+    Retourne tout le contenu d'un tampon, depuis le début.
+    """
+    buffer.seek(0)
+    return buffer.read()
+
+def process_batch(items, rejected=(), template_name=None, progress=None):
+    """
+    Traite un lot de CV (liste de (nom, tampon)) : extraction en parallèle dans le pool
+    de processus, puis appels au modèle, rendu et upload avec au plus BATCH_LLM_CONCURRENCY
+    traitements simultanés. Retourne le manifeste des résultats dans l'ordre d'entrée.
+    Les tampons sont fermés à la fin, ce qui supprime les éventuels fichiers débordés.
+    """
+    results = [None] * len(items)
+    
+    def finish(index, json_data=None, extracted_text=None, cache_key=None):
+        filename = items[index][0]
+        try:
+            if json_data is None:
+                if not extracted_text:
+                    record_stage_error("text_extraction")
+                    raise PipelineError("Échec de l'extraction du texte")
+                extracted_text = compact_for_prompt(extracted_text)
+                json_data = structure_text(extracted_text, cache_key)
+            results[index] = {"filename": filename,
+                              **render_and_upload(json_data, filename, template_name, source_text=extracted_text)}
+        except PipelineError as e:
+            results[index] = {"filename": filename, "error": e.message}
+        except Exception as e:
+            logging.error(f"Erreur lors du traitement de {filename} : {e}")
+            results[index] = {"filename": filename, "error": str(e)}
+        if progress:
+            progress(f"processed:{sum(1 for r in results if r is not None)}/{len(items)}")
+    
+    try:
+        with ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY, thread_name_prefix="cv-batch") as llm_pool:
+            pending = []
+            for index, (filename, buffer) in enumerate(items):
+                cache_key = ExtractionCache.make_key(read_buffer(buffer), PROMPT_VERSION, OPENAI_DEPLOYMENT)
+                cached = extraction_cache.get(cache_key) if CACHE_ENABLED else None
+                if cached:
+                    llm_pool.submit(finish, index, json_data=cached["data"], extracted_text=cached.get("text"))
+                else:
+                    pending.append((index, cache_key))
+            
+            # Fenêtre bornée d'extractions en vol : seuls ces fichiers sont chargés en mémoire à la fois.
+            # Les appels au modèle démarrent dès qu'une extraction se termine.
+            in_flight = {}
+            window = EXTRACTION_PROCESSES * 2
+            while pending or in_flight:
+                while pending and len(in_flight) < window:
+                    index, cache_key = pending.pop(0)
+                    filename, buffer = items[index]
+                    future = get_extraction_pool().submit(extract_text, read_buffer(buffer), filename)
+                    in_flight[future] = (index, cache_key)
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, cache_key = in_flight.pop(future)
+                    try:
+                        extracted_text = future.result()
+                    except Exception as e:
+                        logging.error(f"Erreur lors de l'extraction de {items[index][0]} : {e}")
+                        extracted_text = None
+                    llm_pool.submit(finish, index, extracted_text=extracted_text, cache_key=cache_key)
+    finally:
+        for _, buffer in items:
+            buffer.close()
+    
+    results.extend(rejected)
+    failed = sum(1 for r in results if "error" in r)
+    return {"count": len(results), "succeeded": len(results) - failed, "failed": failed, "results": results}
+
+def collect_batch_files(files):
+    """
+    Charge les fichiers d'un lot dans des tampons (débordant sur disque au-delà du seuil),
+    en dépliant les archives ZIP. Retourne la liste (nom, tampon) des CV retenus
+    et la liste des fichiers rejetés.
+    """
+    items, rejected = [], []
+    used_names = set()
+    
+    def add(name, source):
+        if len(items) >= BATCH_MAX_FILES:
+            rejected.append({"filename": name, "error": f"Limite de {BATCH_MAX_FILES} fichiers atteinte"})
+            return
+        base_name = os.path.basename(name)
+        unique_name = base_name
+        counter = 1
+        while unique_name in used_names:
+            stem, ext = os.path.splitext(base_name)
+            unique_name = f"{stem}_{counter}{ext}"
+            counter += 1
+        used_names.add(unique_name)
+        buffer = spooled_buffer()
+        shutil.copyfileobj(source, buffer)
+        items.append((unique_name, buffer))
+    
+    try:
+        for file in files:
+            if not file or file.filename == '':
+                continue
+            if file.filename.lower().endswith('.zip'):
+                try:
+                    with zipfile.ZipFile(file.stream) as archive:
+                        for member in archive.infolist():
+                            name = member.filename
+                            if member.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+                                continue
+                            if not allowed_file(name):
+                                rejected.append({"filename": name, "error": "Extension non autorisée"})
+                            elif member.file_size > BATCH_MAX_FILE_BYTES:
+                                rejected.append({"filename": name, "error": "Fichier trop volumineux"})
+                            else:
+                                with archive.open(member) as source:
+                                    add(name, source)
+                except zipfile.BadZipFile:
+                    rejected.append({"filename": file.filename, "error": "Archive ZIP invalide"})
+            elif allowed_file(file.filename):
+                add(file.filename, file.stream)
+            else:
+                rejected.append({"filename": file.filename, "error": "Extension non autorisée"})
+    except Exception:
+        for _, buffer in items:
+            buffer.close()
+        raise
+    return items, rejected
+
+def wants_async(req):
+    """
+    Le mode asynchrone est activé par `?async=true`, un champ de formulaire `async`
+    ou l'en-tête `Prefer: respond-async`.
+    """
+    flag = req.args.get('async') or req.form.get('async') or ''
+    return flag.lower() in ('1', 'true', 'yes') or 'respond-async' in req.headers.get('Prefer', '')
+
 @app.route('/template', methods=['POST'])
 def upload_file():
     """
@@ -478,11 +1495,12 @@ def upload_file():
     4) Génère un PDF et un DOCX,
     5) Upload les deux sur Blob Storage, 
     6) Retourne les URLs SAS en JSON.
+    En mode asynchrone, retourne immédiatement un identifiant de job (202).
     """
     logging.info("Requête reçue sur /template")
     
     # Vérification de la présence du fichier
-    if 'file' not in request.files:
+    if 'file' not in receive_files():
         logging.error("Aucun fichier trouvé dans la requête")
         return jsonify({"error": "Aucun fichier trouvé dans la requête"}), 400
     
@@ -491,83 +1509,403 @@ def upload_file():
         logging.error("Aucun fichier sélectionné")
         return jsonify({"error": "Aucun fichier sélectionné"}), 400
     
+    template_name = request.form.get('template') or request.args.get('template')
+    if template_name and template_name not in get_registry().names():
+        logging.error(f"Modèle inconnu : {template_name}")
+        return jsonify({"error": f"Modèle inconnu : {template_name}"}), 400
+    
     # Vérification de l’extension
     if file and allowed_file(file.filename):
         filename = file.filename
-        file_path = os.path.join(tempfile.gettempdir(), filename)
-        file.save(file_path)
-        logging.info(f"Fichier sauvegardé à {file_path}")
-        
-        # Extraction de texte
-        extracted_text = extract_text(file_path)
-        if not extracted_text:
-            logging.error("Aucun texte extrait du fichier")
-            return jsonify({"error": "Échec de l'extraction du texte"}), 500
-        logging.info("Texte extrait du fichier avec succès.")
-        
-        # Extraction des informations (JSON)
-        raw_json_text = extract_info_to_json(extracted_text)
-        if not raw_json_text:
-            logging.error("Échec de l'extraction des informations structurées (réponse vide)")
-            return jsonify({"error": "Échec de l'extraction des informations structurées"}), 500
-        
-        logging.info("Informations extraites au format JSON (brut).")
-        
-        # Nettoyage & sauvegarde JSON
-        json_file_path = os.path.join(tempfile.gettempdir(), 'extracted_info.json')
-        clean_and_save_json(raw_json_text, json_file_path)
-        
-        if not os.path.exists(json_file_path):
-            logging.error(f"Fichier JSON non trouvé à {json_file_path}")
-            return jsonify({"error": "Échec de la sauvegarde du fichier JSON"}), 500
+        file_bytes = file.read()
+        logging.info(f"Fichier reçu : {filename} ({len(file_bytes)} octets)")
         
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            json_data = json.load(f)
-        
-        logging.info("Données JSON chargées : %s", json_data)
-        
-        # Génération du PDF
-        pdf_file_name = generate_pdf_filename(json_data, filename)
-        pdf_file_path = os.path.join(tempfile.gettempdir(), pdf_file_name)
-        generate_pdf_from_json(json_data, pdf_file_path)
-        logging.info(f"PDF généré à {pdf_file_path}")
-        
-        # Conversion PDF → DOCX
-        docx_file_name = pdf_file_name.replace('.pdf', '.docx')
-        docx_file_path = os.path.join(tempfile.gettempdir(), docx_file_name)
-        if not convert_pdf_to_docx(pdf_file_path, docx_file_path):
-            logging.error("Échec de la conversion du PDF en DOCX")
-            return jsonify({"error": "Échec de la conversion du PDF en DOCX"}), 500
-        
-        logging.info(f"DOCX généré à {docx_file_path}")
-        
-        # Ajustement de la marge supérieure
-        adjust_docx_top_margin(docx_file_path, top_margin_inch=0.5)
-        logging.info("Marge supérieure et espacement ajustés dans le fichier DOCX.")
-        
-        # Upload dans le Blob Storage
-        upload_to_blob_storage(pdf_file_path, pdf_file_name)
-        upload_to_blob_storage(docx_file_path, docx_file_name)
-        logging.info(f"PDF et DOCX uploadés vers Blob Storage sous les noms {pdf_file_name} et {docx_file_name}")
-        
-        # Génération des URLs SAS
-        pdf_sas_url = generate_sas_token(pdf_file_name)
-        docx_sas_url = generate_sas_token(docx_file_name)
-        
-        if pdf_sas_url and docx_sas_url:
-            logging.info(f"SAS URLs générés : PDF - {pdf_sas_url}, DOCX - {docx_sas_url}")
+        if wants_async(request):
+            job_id = job_manager.submit(process_cv, file_bytes, filename, template_name)
+            if job_id is None:
+                logging.error("File d'attente des jobs pleine")
+                return jsonify({"error": "Trop de traitements en cours, réessayez plus tard"}), 503
+            logging.info(f"Job {job_id} créé pour {filename}")
+            status_url = f"/jobs/{job_id}"
             return jsonify({
-                "pdf_sas_url": pdf_sas_url,
-                "docx_sas_url": docx_sas_url
-            }), 200
-        else:
-            logging.error("Échec de la génération des SAS tokens")
-            return jsonify({"error": "Échec de la génération des SAS tokens"}), 500
+                "job_id": job_id,
+                "status_url": status_url,
+                "events_url": f"{status_url}/events"
+            }), 202, {"Location": status_url}
+        
+        try:
+            return jsonify(process_cv(file_bytes, filename, template_name)), 200
+        except PipelineError as e:
+            return jsonify({"error": e.message}), e.status_code
     
     else:
         logging.error("Fichier non valide ou extension non autorisée")
         return jsonify({"error": "Fichier non valide ou extension non autorisée"}), 400
 
+@app.route('/template/batch', methods=['POST'])
+def upload_batch():
+    """
+    Endpoint de traitement par lot : accepte plusieurs fichiers (champ `files`)
+    et/ou des archives ZIP, et retourne un manifeste des URLs SAS et des erreurs par fichier.
+    Supporte le mode asynchrone comme /template.
+    """
+    logging.info("Requête reçue sur /template/batch")
+    uploaded = receive_files()
+    files = uploaded.getlist('files') + uploaded.getlist('file')
+    if not files:
+        logging.error("Aucun fichier trouvé dans la requête")
+        return jsonify({"error": "Aucun fichier trouvé dans la requête"}), 400
+    
+    template_name = request.form.get('template') or request.args.get('template')
+    if template_name and template_name not in get_registry().names():
+        logging.error(f"Modèle inconnu : {template_name}")
+        return jsonify({"error": f"Modèle inconnu : {template_name}"}), 400
+    
+    items, rejected = collect_batch_files(files)
+    if not items:
+        return jsonify({"error": "Aucun fichier valide dans le lot", "results": rejected}), 400
+    logging.info(f"Lot de {len(items)} fichiers reçu")
+    
+    if wants_async(request):
+        job_id = job_manager.submit(process_batch, items, rejected, template_name)
+        if job_id is None:
+            for _, buffer in items:
+                buffer.close()
+            logging.error("File d'attente des jobs pleine")
+            return jsonify({"error": "Trop de traitements en cours, réessayez plus tard"}), 503
+        status_url = f"/jobs/{job_id}"
+        return jsonify({
+            "job_id": job_id,
+            "status_url": status_url,
+            "events_url": f"{status_url}/events"
+        }), 202, {"Location": status_url}
+    
+    return jsonify(process_batch(items, rejected, template_name)), 200
+
+def sse_event(payload):
+    """
+    Formate un événement SSE.
+    """
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def section_events(json_data):
+    """
+    Événements "section" d'un JSON complet (réponse du cache ou extraction par segments).
+    """
+    return [{"event": "section", "section": key, "value": value} for key, value in json_data.items()]
+
+class StreamExtraction:
+    """
+    État d'une extraction en flux, indépendant de la source des fragments (client
+    synchrone ou asynchrone) : feed() analyse chaque fragment et retourne les événements
+    à envoyer, en construisant les éléments PDF de chaque expérience (ramenée au schéma)
+    dès sa réception ; finish() retourne le JSON final.
+    """
+    
+    def __init__(self, template_name=None):
+        self.template = get_template(template_name)
+        self.parser = IncrementalJSONParser()
+        self.raw_parts = []
+        self.experiences = []
+        self.experience_flowables = []
+    
+    def feed(self, delta):
+        self.raw_parts.append(delta)
+        events = []
+        for parsed in self.parser.feed(delta):
+            if parsed[0] == "item":
+                _, key, index, value = parsed
+                experience = normalize_experience(value) if key == "professional_experience" else None
+                if experience is not None:
+                    self.experiences.append(experience)
+                    self.experience_flowables.append(build_experience_flowables(experience, self.template))
+                events.append({"event": "item", "section": key, "index": index, "value": value})
+            else:
+                _, key, value = parsed
+                if isinstance(value, list):
+                    events.append({"event": "section", "section": key, "count": len(value)})
+                else:
+                    events.append({"event": "section", "section": key, "value": value})
+        return events
+    
+    def finish(self):
+        """
+        Retourne le JSON complet, ou None si la réponse du modèle est invalide.
+        """
+        json_data = parse_json_response("".join(self.raw_parts).strip())
+        # Les éléments construits en avance ne servent que s'ils correspondent au JSON final
+        # normalisé (réparations, expériences non conformes)
+        if json_data is None or self.experiences != json_data.get('professional_experience', []):
+            self.experience_flowables = None
+        return json_data
+
+def stream_cv(file_bytes, filename, template_name=None):
+    """
+    Pipeline en flux (générateur SSE) : le JSON de la complétion est analysé au fil des
+    tokens, chaque section de premier niveau et chaque entrée (formation, expérience...)
+    est envoyée dès sa fermeture, et les éléments PDF des expériences sont construits
+    pendant que le modèle génère la suite. Le dernier événement contient les URLs SAS.
+    """
+    try:
+        cache_key = ExtractionCache.make_key(file_bytes, PROMPT_VERSION, OPENAI_DEPLOYMENT)
+        cached = extraction_cache.get(cache_key) if CACHE_ENABLED else None
+        experience_flowables = None
+        
+        if cached:
+            logging.info("Extraction trouvée dans le cache, OCR et appel au modèle ignorés.")
+            json_data = cached["data"]
+            extracted_text = cached.get("text")
+            for payload in section_events(json_data):
+                yield sse_event(payload)
+        else:
+            yield sse_event({"event": "stage", "stage": "text_extraction"})
+            extracted_text = extract_cv_text(file_bytes, filename)
+            if not extracted_text:
+                logging.error("Aucun texte extrait du fichier")
+                yield sse_event({"error": "Échec de l'extraction du texte"})
+                return
+            extracted_text = compact_for_prompt(extracted_text)
+            
+            yield sse_event({"event": "stage", "stage": "llm_extraction"})
+            json_data = extract_incremental(extracted_text)
+            if json_data is not None or needs_chunking(extracted_text):
+                # Nouvelle version d'un CV indexé ou CV long : les sections sont envoyées après la fusion
+                if json_data is None:
+                    json_data = structure_text(extracted_text, cache_key, incremental=False)
+                elif CACHE_ENABLED:
+                    extraction_cache.put(cache_key, extracted_text, json_data)
+                for payload in section_events(json_data):
+                    yield sse_event(payload)
+            else:
+                extraction = StreamExtraction(template_name)
+                for delta in extract_info_to_json_stream(extracted_text):
+                    for payload in extraction.feed(delta):
+                        yield sse_event(payload)
+                json_data = extraction.finish()
+                if json_data is None:
+                    yield sse_event({"error": "Réponse JSON invalide du modèle"})
+                    return
+                if CACHE_ENABLED:
+                    extraction_cache.put(cache_key, extracted_text, json_data)
+                experience_flowables = extraction.experience_flowables
+        
+        yield sse_event({"event": "stage", "stage": "render"})
+        result = render_and_upload(json_data, filename, template_name,
+                                   experience_flowables=experience_flowables, source_text=extracted_text)
+        yield sse_event({"event": "result", **result})
+    except PipelineError as e:
+        yield sse_event({"error": e.message})
+    except Exception as e:
+        logging.error(f"Erreur lors du traitement en flux : {e}")
+        yield sse_event({"error": str(e)})
+
+@app.route('/template/stream', methods=['POST'])
+def upload_file_stream():
+    """
+    Variante en flux de /template : retourne un flux SSE des sections extraites
+    au fur et à mesure, puis les URLs SAS.
+    """
+    logging.info("Requête reçue sur /template/stream")
+    file = receive_files().get('file')
+    if not file or file.filename == '':
+        logging.error("Aucun fichier trouvé dans la requête")
+        return jsonify({"error": "Aucun fichier trouvé dans la requête"}), 400
+    if not allowed_file(file.filename):
+        logging.error("Fichier non valide ou extension non autorisée")
+        return jsonify({"error": "Fichier non valide ou extension non autorisée"}), 400
+    
+    template_name = request.form.get('template') or request.args.get('template')
+    if template_name and template_name not in get_registry().names():
+        logging.error(f"Modèle inconnu : {template_name}")
+        return jsonify({"error": f"Modèle inconnu : {template_name}"}), 400
+    
+    return Response(stream_cv(file.read(), file.filename, template_name), content_type='text/event-stream')
+
+@app.route('/template/render', methods=['POST'])
+def rerender():
+    """
+    Nouveau rendu sans extraction : le JSON d'un candidat indexé (`candidate_id`) ou
+    fourni tel quel (`data`) reçoit les corrections de `patch` (JSON Merge Patch),
+    puis seuls le PDF et le DOCX sont générés et uploadés. Retourne les URLs SAS.
+    """
+    logging.info("Requête reçue sur /template/render")
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Corps JSON attendu"}), 400
+    
+    template_name = body.get('template')
+    if template_name and template_name not in get_registry().names():
+        logging.error(f"Modèle inconnu : {template_name}")
+        return jsonify({"error": f"Modèle inconnu : {template_name}"}), 400
+    patch = body.get('patch') or {}
+    if not isinstance(patch, dict):
+        return jsonify({"error": "Le patch doit être un objet JSON"}), 400
+    
+    filename = body.get('filename')
+    if body.get('candidate_id'):
+        if not CANDIDATE_INDEX_ENABLED:
+            return jsonify({"error": "Index des candidats désactivé"}), 404
+        try:
+            stored = candidate_index.get(str(body['candidate_id']))
+        except Exception as e:
+            logging.error(f"Index des candidats indisponible : {e}")
+            return jsonify({"error": "Index des candidats indisponible"}), 503
+        if stored is None:
+            return jsonify({"error": "Candidat introuvable"}), 404
+        json_data = stored["data"]
+        filename = filename or stored.get("filename")
+        template_name = template_name or stored.get("template")
+    elif isinstance(body.get('data'), dict):
+        json_data = body['data']
+    else:
+        return jsonify({"error": "`candidate_id` ou `data` requis"}), 400
+    
+    json_data, fixed = normalize_cv(merge_patch(json_data, patch))
+    if json_data is None:
+        return jsonify({"error": "JSON du CV invalide"}), 400
+    if fixed:
+        logging.warning(f"JSON corrigé avant rendu : {', '.join(fixed)}")
+    
+    try:
+        return jsonify(render_and_upload(json_data, filename or "cv.pdf", template_name)), 200
+    except PipelineError as e:
+        return jsonify({"error": e.message}), e.status_code
+
+def _float_arg(name):
+    value = request.args.get(name)
+    return float(value.replace(",", ".")) if value else None
+
+@app.route('/candidates/search', methods=['GET'])
+def search_candidates():
+    """
+    Recherche dans l'index des candidats, sans nouvelle extraction : `skills` (séparées par
+    des virgules, toutes requises), `q` (mots-clés), `min_years`, `max_years`, `company`,
+    `certification` (préfixes) et `limit`. Retourne les candidats et les liens vers leurs
+    PDF/DOCX déjà générés.
+    """
+    if not CANDIDATE_INDEX_ENABLED:
+        return jsonify({"error": "Index des candidats désactivé"}), 404
+    skills = [skill for value in request.args.getlist('skills') for skill in value.split(',') if skill.strip()]
+    try:
+        min_years, max_years = _float_arg('min_years'), _float_arg('max_years')
+        limit = int(request.args.get('limit', '20'))
+    except ValueError:
+        return jsonify({"error": "Paramètre numérique invalide"}), 400
+    
+    started = time.perf_counter()
+    try:
+        with observe_stage("candidate_search"):
+            candidates = candidate_index.search(
+                skills=skills,
+                keywords=request.args.get('q', ''),
+                min_years=min_years,
+                max_years=max_years,
+                company=request.args.get('company'),
+                certification=request.args.get('certification'),
+                limit=limit
+            )
+    except Exception as e:
+        logging.error(f"Index des candidats indisponible : {e}")
+        return jsonify({"error": "Index des candidats indisponible"}), 503
+    
+    # Liens de téléchargement générés en une fois pour tous les résultats
+    names = [name for candidate in candidates for name in (candidate.get("files") or {}).values()]
+    urls = (generate_sas_urls(names) if names else None) or {}
+    results = []
+    for candidate in candidates:
+        files = candidate.pop("files", None) or {}
+        candidate["id"] = candidate.pop("_id")
+        candidate["pdf_sas_url"] = urls.get(files.get("pdf"))
+        candidate["docx_sas_url"] = urls.get(files.get("docx"))
+        results.append(candidate)
+    return jsonify({
+        "count": len(results),
+        "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        "results": results
+    }), 200
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Endpoint de polling : statut, étape courante et résultat (URLs SAS) d'un job.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job introuvable"}), 404
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Flux SSE des étapes d'un job, terminé par l'événement final (résultat ou erreur).
+    """
+    if job_manager.get(job_id) is None:
+        return jsonify({"error": "Job introuvable"}), 404
+    
+    def generate():
+        cursor = 0
+        while True:
+            update = job_manager.wait_events(job_id, cursor)
+            if update is None:
+                yield f"data: {json.dumps({'error': 'Job introuvable'})}\n\n"
+                return
+            events, finished = update
+            cursor += len(events)
+            if not events:
+                yield ": keep-alive\n\n"
+            for event in events:
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if finished:
+                return
+    
+    return Response(generate(), content_type='text/event-stream')
+
+def check_secrets():
+    store = get_secret_store()
+    names = ['AZUREopenaiAPIkey', 'AZUREopenaiENDPOINT']
+    if STORAGE_BACKEND != "local":
+        names.append('connectstr')
+    for name in names:
+        store.get(name)
+
+def check_storage():
+    get_storage().check()
+
+readiness_probe = ReadinessProbe({
+    "secrets": check_secrets,
+    "openai_client": openai_client.get,
+    "storage": check_storage
+})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """
+    Métriques au format Prometheus : durées par étape, erreurs, tokens et cache d'extraction.
+    """
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Sonde de vivacité : le processus répond, sans vérifier les dépendances.
+    """
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Sonde de disponibilité : secrets résolus, client OpenAI construit et stockage accessible.
+    """
+    is_ready, checks = readiness_probe.run()
+    return jsonify({"ready": is_ready, "checks": checks}), 200 if is_ready else 503
+
+def start_render_pool_warmup():
+    """
+    Démarre les processus de rendu en arrière-plan (lancement du serveur Flask ou ASGI).
+    """
+    threading.Thread(target=warm_render_pool, daemon=True, name="render-pool-warmup").start()
+
 if __name__ == "__main__":
-    # Démarre l’application Flask sur le port 5001
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    start_render_pool_warmup()
+    # Démarre l’application Flask sur le port 5001 (PORT pour le déploiement)
+    app.run(host='0.0.0.0', port=int(os.getenv("PORT", "5001")), debug=os.getenv("FLASK_DEBUG", "false").lower() == "true")
@@ -0,0 +1,185 @@
+"""
+Mode de service ASGI de convert.py (uvicorn convert_asgi:asgi_app).
+
+/template/stream est servi par la boucle d'événements : la complétion est lue avec le
+client Azure OpenAI asynchrone, et les étapes bloquantes (lecture du cache, extraction
+du texte, rendu et upload) sont déléguées à des exécuteurs. Un processus peut ainsi
+tenir un grand nombre de flux simultanés. Les autres routes restent celles de
+l'application Flask, montée via WSGI.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+import convert
+from config import LazyResource
+from llm_limiter import OPENAI_TIMEOUT_SECONDS, get_limiter
+from metrics import observe_stage, record_stage_error, record_tokens
+
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "16"))
+
+
+def _build_async_openai_client(api_key, azure_endpoint):
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(
+        api_key=api_key,
+        api_version="2024-02-15-preview",
+        azure_endpoint=azure_endpoint,
+        max_retries=0,
+        timeout=OPENAI_TIMEOUT_SECONDS
+    )
+
+async_openai_client = LazyResource(_build_async_openai_client, 'AZUREopenaiAPIkey', 'AZUREopenaiENDPOINT')
+
+
+async def run_blocking(fn, *args, executor=None):
+    """
+    Exécute une fonction bloquante dans un exécuteur (pool de threads par défaut).
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+async def extract_info_to_json_stream_async(text):
+    """
+    Variante asynchrone de convert.extract_info_to_json_stream.
+    """
+    prompt = convert.build_extraction_prompt(text)
+    prompt_tokens = convert.count_tokens(prompt)
+    parts = []
+    with observe_stage("llm_call"):
+        client = await run_blocking(async_openai_client.get)
+        response = get_limiter().stream_async(
+            lambda: client.completions.create(
+                model=convert.OPENAI_DEPLOYMENT,
+                prompt=prompt,
+                max_tokens=convert.EXTRACTION_MAX_TOKENS,
+                temperature=0,
+                stream=True
+            ),
+            prompt_tokens, convert.EXTRACTION_MAX_TOKENS, key="extraction_stream"
+        )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].text:
+                parts.append(chunk.choices[0].text)
+                yield chunk.choices[0].text
+    record_tokens("extraction_stream", prompt_tokens, convert.count_tokens("".join(parts)))
+
+
+async def stream_cv_async(file_bytes, filename, template_name=None):
+    """
+    Équivalent asynchrone de convert.stream_cv (mêmes événements SSE).
+    L'extraction du texte s'exécute dans le pool de processus d'extraction.
+    """
+    sse_event = convert.sse_event
+    try:
+        cache_key = convert.ExtractionCache.make_key(file_bytes, convert.PROMPT_VERSION, convert.OPENAI_DEPLOYMENT)
+        cached = await run_blocking(convert.extraction_cache.get, cache_key) if convert.CACHE_ENABLED else None
+        experience_flowables = None
+
+        if cached:
+            logging.info("Extraction trouvée dans le cache, OCR et appel au modèle ignorés.")
+            json_data = cached["data"]
+            extracted_text = cached.get("text")
+            for payload in convert.section_events(json_data):
+                yield sse_event(payload)
+        else:
+            yield sse_event({"event": "stage", "stage": "text_extraction"})
+            with observe_stage("text_extraction"):
+                extracted_text = await run_blocking(convert.extract_text, file_bytes, filename,
+                                                    executor=convert.get_extraction_pool())
+            if not extracted_text:
+                record_stage_error("text_extraction")
+                logging.error("Aucun texte extrait du fichier")
+                yield sse_event({"error": "Échec de l'extraction du texte"})
+                return
+            extracted_text = await run_blocking(convert.compact_for_prompt, extracted_text)
+
+            yield sse_event({"event": "stage", "stage": "llm_extraction"})
+            json_data = await run_blocking(convert.extract_incremental, extracted_text)
+            if json_data is not None or convert.needs_chunking(extracted_text):
+                if json_data is None:
+                    json_data = await run_blocking(convert.structure_text, extracted_text, cache_key, None, False)
+                elif convert.CACHE_ENABLED:
+                    await run_blocking(convert.extraction_cache.put, cache_key, extracted_text, json_data)
+                for payload in convert.section_events(json_data):
+                    yield sse_event(payload)
+            else:
+                extraction = convert.StreamExtraction(template_name)
+                async for delta in extract_info_to_json_stream_async(extracted_text):
+                    for payload in extraction.feed(delta):
+                        yield sse_event(payload)
+                json_data = extraction.finish()
+                if json_data is None:
+                    yield sse_event({"error": "Réponse JSON invalide du modèle"})
+                    return
+                if convert.CACHE_ENABLED:
+                    await run_blocking(convert.extraction_cache.put, cache_key, extracted_text, json_data)
+                experience_flowables = extraction.experience_flowables
+
+        yield sse_event({"event": "stage", "stage": "render"})
+        result = await run_blocking(lambda: convert.render_and_upload(
+            json_data, filename, template_name, experience_flowables=experience_flowables,
+            source_text=extracted_text))
+        yield sse_event({"event": "result", **result})
+    except convert.PipelineError as e:
+        yield sse_event({"error": e.message})
+    except Exception as e:
+        logging.error(f"Erreur lors du traitement en flux : {e}")
+        yield sse_event({"error": str(e)})
+
+
+async def upload_file_stream(request):
+    """
+    /template/stream servi par la boucle d'événements (mêmes champs que la route Flask).
+    """
+    logging.info("Requête reçue sur /template/stream (ASGI)")
+    with observe_stage("upload"):
+        form = await request.form()
+    file = form.get('file')
+    if file is None or not getattr(file, "filename", ""):
+        logging.error("Aucun fichier trouvé dans la requête")
+        return JSONResponse({"error": "Aucun fichier trouvé dans la requête"}, status_code=400)
+    if not convert.allowed_file(file.filename):
+        logging.error("Fichier non valide ou extension non autorisée")
+        return JSONResponse({"error": "Fichier non valide ou extension non autorisée"}, status_code=400)
+
+    template_name = form.get('template') or request.query_params.get('template')
+    if template_name and template_name not in convert.get_registry().names():
+        logging.error(f"Modèle inconnu : {template_name}")
+        return JSONResponse({"error": f"Modèle inconnu : {template_name}"}, status_code=400)
+
+    file_bytes = await file.read()
+    return StreamingResponse(stream_cv_async(file_bytes, file.filename, template_name),
+                             media_type='text/event-stream')
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Processus de rendu démarrés avec le serveur, pas à l'import de convert
+    convert.start_render_pool_warmup()
+    yield
+
+
+asgi_app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route('/template/stream', upload_file_stream, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(convert.app, workers=WSGI_THREADS))
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["https://talent.heptasys.com", "http://localhost:4200"],
+                   allow_methods=["*"], allow_headers=["Content-Type", "Authorization", "X-Requested-With"])
+    ]
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(asgi_app, host='0.0.0.0', port=int(os.getenv("PORT", "5001")))
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class ExtractionCache:
+    """
+    Cache disque des résultats d'extraction (texte brut + JSON structuré).
+
+    La clé est adressée par contenu : empreinte SHA-256 des octets du fichier,
+    version du prompt et nom du déploiement du modèle. Les entrées sont évincées
+    au-delà d'un âge maximal puis, si la taille totale dépasse la limite,
+    des plus anciennes aux plus récentes.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, max_age_seconds=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def make_key(file_bytes, prompt_version, deployment):
+        """
+        Calcule la clé de cache à partir du contenu du fichier, de la version du prompt et du déploiement.
+        """
+        content_hash = hashlib.sha256(file_bytes).hexdigest()
+        return hashlib.sha256(f"{content_hash}:{prompt_version}:{deployment}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _entries(self):
+        """
+        Liste les entrées présentes sur disque : (chemin, date de modification, taille).
+        """
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _remove(self, path, size):
+        try:
+            os.remove(path)
+            self._size -= size
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """
+        Retourne l'entrée {"text": ..., "data": ...} associée à la clé, ou None.
+        """
+        path = self._path(key)
+        with self._lock:
+            try:
+                stat = os.stat(path)
+                if time.time() - stat.st_mtime > self.max_age_seconds:
+                    self._remove(path, stat.st_size)
+                    raise FileNotFoundError(path)
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry
+
+    def put(self, key, text, data):
+        """
+        Enregistre le texte extrait et le JSON structuré, puis applique l'éviction.
+        """
+        path = self._path(key)
+        payload = json.dumps({"text": text, "data": data, "created_at": time.time()}, ensure_ascii=False)
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if os.path.exists(path):
+                    self._size -= os.path.getsize(path)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+                self._size += os.path.getsize(path)
+            except OSError as e:
+                logging.error(f"Erreur lors de l'écriture dans le cache : {e}")
+                return
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Supprime les entrées expirées, puis les plus anciennes jusqu'à repasser sous la taille maximale.
+        """
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, mtime, size in entries:
+            if self._size <= self.max_bytes and now - mtime <= self.max_age_seconds:
+                continue
+            self._remove(path, size)
+        logging.info(f"Éviction du cache terminée ({self._size} octets restants).")
+
+    def stats(self):
+        """
+        Retourne les compteurs de succès/échecs et l'occupation du cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
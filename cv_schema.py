@@ -0,0 +1,308 @@
+"""
+Lecture tolérante du JSON renvoyé par le modèle et validation contre le schéma du CV.
+
+repair_json() corrige localement les défauts courants de la complétion : blocs de code
+Markdown, texte avant ou après l'objet, commentaires, virgules finales, et sortie
+tronquée (chaîne, tableaux et objets refermés, dernier élément incomplet retiré).
+normalize_cv() ramène ensuite chaque champ au type attendu par le rendu PDF/DOCX.
+Une réponse réparée évite de relancer un appel complet au modèle. merge_patch() applique
+les corrections envoyées pour un nouveau rendu sans extraction.
+"""
+import json
+import re
+
+CONTACT_FIELDS = ("phone", "email", "website")
+EDUCATION_FIELDS = ("degree", "institution", "year_of_completion")
+EXPERIENCE_TEXT_FIELDS = ("company_name", "date_range", "mission")
+EXPERIENCE_LIST_FIELDS = ("tasks", "tech_tools")
+SCALAR_FIELDS = ("job_title", "full_name", "years_of_experience")
+
+_FENCE_RE = re.compile(r"^\s*```[\w-]*\s*$", re.MULTILINE)
+# Nombre maximal de points de coupe essayés pour une sortie tronquée
+MAX_TRUNCATION_CANDIDATES = 64
+
+
+def empty_cv():
+    return {
+        "job_title": "",
+        "full_name": "",
+        "years_of_experience": "",
+        "contact_information": {field: "" for field in CONTACT_FIELDS},
+        "education": [],
+        "professional_experience": [],
+        "skills": "",
+        "certifications": []
+    }
+
+
+def _loads(text):
+    # strict=False : accepte les retours à la ligne bruts dans les chaînes
+    return json.loads(text, strict=False)
+
+
+def _scan(text):
+    """
+    Réécrit le texte à partir de la première accolade : commentaires, virgules finales et
+    fermetures orphelines retirés, arrêt à la fin de l'objet racine. Retourne
+    (texte, fermetures en attente, chaîne ouverte, points de coupe, réparations).
+    Un point de coupe (longueur, fermetures en attente) marque la fin d'un élément complet.
+    """
+    out = []
+    stack = []
+    cuts = []
+    repairs = set()
+    in_string = False
+    escaped = False
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+            i += 1
+            continue
+        if c == '"':
+            in_string = True
+            out.append(c)
+        elif c in "{[":
+            stack.append("}" if c == "{" else "]")
+            out.append(c)
+            cuts.append((len(out), list(stack)))
+        elif c in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                repairs.add("trailing_comma")
+            if stack and stack[-1] == c:
+                stack.pop()
+                out.append(c)
+                if not stack:
+                    if text[i + 1:].strip():
+                        repairs.add("trailing_text")
+                    return "".join(out), stack, False, cuts, repairs
+                cuts.append((len(out), list(stack)))
+            else:
+                repairs.add("stray_bracket")
+        elif c == "/" and text.startswith("//", i):
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+            repairs.add("comment")
+            continue
+        elif c == "/" and text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            repairs.add("comment")
+            continue
+        elif c == ",":
+            cuts.append((len(out), list(stack)))
+            out.append(c)
+        else:
+            out.append(c)
+        i += 1
+    return "".join(out), stack, in_string, cuts, repairs
+
+
+def is_truncated(raw_text):
+    """
+    Indique si la sortie s'arrête avant la fin de l'objet JSON racine.
+    """
+    start = raw_text.find("{")
+    if start == -1:
+        return False
+    _, stack, in_string, _, _ = _scan(raw_text[start:])
+    return bool(stack) or in_string
+
+
+def repair_json(raw_text):
+    """
+    Retourne (objet, réparations appliquées) ou (None, réparations) si le texte est irrécupérable.
+    """
+    repairs = []
+    if raw_text is None:
+        return None, repairs
+    text = raw_text.strip()
+    try:
+        return _loads(text), repairs
+    except json.JSONDecodeError:
+        pass
+
+    if "```" in text:
+        text = _FENCE_RE.sub("", text).strip()
+        repairs.append("code_fence")
+    start = text.find("{")
+    if start == -1:
+        return None, repairs
+    if start > 0:
+        repairs.append("leading_text")
+    cleaned, stack, in_string, cuts, scan_repairs = _scan(text[start:])
+    repairs.extend(sorted(scan_repairs))
+
+    if not stack and not in_string:
+        try:
+            return _loads(cleaned), repairs
+        except json.JSONDecodeError:
+            return None, repairs
+
+    # Sortie tronquée : refermer telle quelle, sinon revenir au dernier élément complet
+    repairs.append("truncated")
+    candidates = []
+    tail = cleaned
+    if in_string:
+        if tail.endswith("\\"):
+            tail = tail[:-1]
+        tail += '"'
+    candidates.append(tail + "".join(reversed(stack)))
+    for length, pending in reversed(cuts[-MAX_TRUNCATION_CANDIDATES:]):
+        candidates.append(cleaned[:length].rstrip().rstrip(",") + "".join(reversed(pending)))
+    for candidate in candidates:
+        try:
+            return _loads(candidate), repairs
+        except json.JSONDecodeError:
+            continue
+    return None, repairs
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return ", ".join(text for text in (_text(item) for item in value) if text)
+    if isinstance(value, dict):
+        return ", ".join(f"{key} : {_text(item)}" for key, item in value.items() if _text(item))
+    return str(value)
+
+
+def _text_list(value, separator):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [text for text in (_text(item).strip() for item in value) if text]
+    return [part.strip() for part in re.split(separator, _text(value)) if part.strip()]
+
+
+def _skills(value):
+    """
+    Chaîne, ou dictionnaire {catégorie: compétences séparées par des virgules}.
+    """
+    if isinstance(value, dict):
+        return {str(category): _text(skills).strip() for category, skills in value.items()}
+    if isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+        # [{"category": ..., "skills": ...}] ou [{"Cloud": "..."}, ...]
+        categories = {}
+        for item in value:
+            if len(item) == 2 and any(key in item for key in ("category", "name", "title")):
+                category = _text(item.get("category") or item.get("name") or item.get("title"))
+                skills = next((v for k, v in item.items() if k not in ("category", "name", "title")), "")
+                categories[category] = _text(skills).strip()
+            else:
+                categories.update(_skills(item))
+        return categories
+    return _text(value).strip()
+
+
+def _records(value, text_fields, list_fields=(), list_separators=None):
+    records = []
+    for item in value if isinstance(value, list) else ([value] if isinstance(value, dict) else []):
+        if not isinstance(item, dict):
+            continue
+        record = {field: _text(item.get(field)) for field in text_fields}
+        for field in list_fields:
+            record[field] = _text_list(item.get(field), list_separators[field])
+        # Champs supplémentaires conservés tels quels
+        for key, extra in item.items():
+            record.setdefault(key, extra)
+        records.append(record)
+    return records
+
+
+def _experiences(value):
+    return _records(value, EXPERIENCE_TEXT_FIELDS, EXPERIENCE_LIST_FIELDS,
+                    {"tasks": r"\n|;", "tech_tools": r",|\n|;"})
+
+
+def normalize_experience(item):
+    """
+    Ramène une expérience isolée (reçue en flux) au schéma, comme normalize_cv ;
+    None si ce n'est pas un objet.
+    """
+    records = _experiences(item) if isinstance(item, dict) else []
+    return records[0] if records else None
+
+
+def normalize_cv(data):
+    """
+    Ramène le JSON au schéma du CV (types attendus par le rendu, champs manquants vides).
+    Retourne (cv, champs corrigés) ou (None, ["root"]) si la racine n'est pas un objet.
+    """
+    if isinstance(data, list) and len(data) == 1:
+        data = data[0]
+    if not isinstance(data, dict):
+        return None, ["root"]
+
+    cv = empty_cv()
+    for field in SCALAR_FIELDS:
+        cv[field] = _text(data.get(field))
+    contact = data.get("contact_information")
+    if isinstance(contact, dict):
+        for field in CONTACT_FIELDS:
+            cv["contact_information"][field] = _text(contact.get(field))
+    cv["education"] = _records(data.get("education"), EDUCATION_FIELDS)
+    cv["professional_experience"] = _experiences(data.get("professional_experience"))
+    cv["skills"] = _skills(data.get("skills"))
+    cv["certifications"] = _text_list(data.get("certifications"), r"\n|;")
+    for key, value in data.items():
+        cv.setdefault(key, value)
+
+    fixed = [field for field in data if _retyped(data[field], cv[field])]
+    return cv, fixed
+
+
+def _retyped(original, normalized):
+    """
+    Indique si la normalisation a changé le type d'une valeur présente (les champs
+    ajoutés vides ne comptent pas).
+    """
+    if type(original) is not type(normalized):
+        return True
+    if isinstance(original, dict):
+        return any(_retyped(value, normalized[key]) for key, value in original.items() if key in normalized)
+    if isinstance(original, list):
+        return len(original) != len(normalized) or any(map(_retyped, original, normalized))
+    return False
+
+
+def merge_patch(target, patch):
+    """
+    Applique un JSON Merge Patch (RFC 7396) : les objets sont fusionnés récursivement,
+    une valeur null supprime la clé, toute autre valeur (tableaux compris) remplace
+    l'existante. Retourne un nouvel objet, la cible n'est pas modifiée.
+    """
+    if not isinstance(patch, dict):
+        return patch
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+def parse_cv_json(raw_text):
+    """
+    Parse, répare et valide la réponse du modèle.
+    Retourne (cv, réparations, champs corrigés) ; cv vaut None si la réponse est irrécupérable.
+    """
+    data, repairs = repair_json(raw_text)
+    if data is None:
+        return None, repairs, []
+    cv, fixed = normalize_cv(data)
+    return cv, repairs, fixed
@@ -0,0 +1,265 @@
+"""
+Extraction du texte des CV (PDF, DOCX, images), partagée par convert.py et app.py.
+
+Ce module n'a aucun effet de bord à l'import afin de pouvoir être chargé
+par les processus du pool d'extraction ; PyMuPDF et pytesseract ne sont
+importés qu'à la première extraction qui en a besoin.
+"""
+import io
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, wait
+from xml.etree.ElementTree import iterparse
+
+from config import default_processes
+
+# Limites appliquées à chaque fichier
+EXTRACT_MAX_MB = float(os.getenv("EXTRACT_MAX_MB", "20"))
+EXTRACT_MAX_PAGES = int(os.getenv("EXTRACT_MAX_PAGES", "50"))
+EXTRACT_MAX_XML_MB = float(os.getenv("EXTRACT_MAX_XML_MB", "50"))
+
+# OCR des pages PDF sans couche texte (CV scannés)
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+OCR_LANG = os.getenv("OCR_LANG") or None
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "10"))
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", "20"))
+OCR_TIMEOUT_SECONDS = float(os.getenv("OCR_TIMEOUT_SECONDS", "60"))
+OCR_PROCESSES = int(os.getenv("OCR_PROCESSES", str(default_processes())))
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+
+# Espaces de noms WordprocessingML utilisés par l'analyse en flux des DOCX
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+DOCX_PART_RE = re.compile(r"^word/(header\d*|document|footer\d*)\.xml$")
+
+
+class ExtractionError(ValueError):
+    """
+    Fichier refusé ou illisible (format non pris en charge, limite de taille ou de pages dépassée).
+    """
+
+
+def get_ocr_pool():
+    """
+    Retourne le pool de processus OCR, créé au premier appel.
+    Retourne None dans un processus enfant (pool d'extraction des lots) :
+    l'OCR y est alors exécuté séquentiellement, le parallélisme venant déjà du lot.
+    """
+    global _ocr_pool
+    if multiprocessing.parent_process() is not None:
+        return None
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_PROCESSES)
+        return _ocr_pool
+
+
+def ocr_image(image_bytes):
+    """
+    OCR d'une image (octets PNG/JPG) avec pytesseract.
+    """
+    from PIL import Image
+    import pytesseract
+    image = Image.open(io.BytesIO(image_bytes))
+    if OCR_LANG:
+        return pytesseract.image_to_string(image, lang=OCR_LANG)
+    return pytesseract.image_to_string(image)
+
+
+def ocr_pages(page_images, timeout=OCR_TIMEOUT_SECONDS):
+    """
+    OCR en parallèle des pages rasterisées {numéro de page: octets PNG}.
+    Retourne {numéro de page: texte} pour les pages terminées avant l'échéance.
+    """
+    deadline = time.monotonic() + timeout
+    results = {}
+    pool = get_ocr_pool()
+    if pool is None:
+        for page_number, image_bytes in sorted(page_images.items()):
+            if time.monotonic() > deadline:
+                logging.warning(f"Délai d'OCR dépassé, pages ignorées à partir de la page {page_number + 1}")
+                break
+            results[page_number] = ocr_image(image_bytes)
+        return results
+
+    futures = {pool.submit(ocr_image, image_bytes): page_number
+               for page_number, image_bytes in page_images.items()}
+    done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+    for future in done:
+        page_number = futures[future]
+        try:
+            results[page_number] = future.result()
+        except Exception as e:
+            logging.error(f"Erreur lors de l'OCR de la page {page_number + 1} : {e}")
+    for future in not_done:
+        future.cancel()
+    if not_done:
+        logging.warning(f"Délai d'OCR dépassé : {len(not_done)} page(s) ignorée(s)")
+    return results
+
+
+def extract_pdf_text(data, timings=None):
+    """
+    Extrait le texte d'un PDF avec PyMuPDF. Les pages sans couche texte sont rasterisées
+    à OCR_DPI et passées à l'OCR en parallèle ; les textes sont fusionnés dans l'ordre des pages,
+    séparés par un saut de page (\f) pour que le compactage repère les en-têtes répétés.
+    Seules les EXTRACT_MAX_PAGES premières pages sont lues.
+    """
+    import fitz  # PyMuPDF, chargé au premier PDF
+    timings = timings if timings is not None else {}
+    started = time.perf_counter()
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        if doc.page_count > EXTRACT_MAX_PAGES:
+            logging.warning(f"PDF de {doc.page_count} pages, extraction limitée aux {EXTRACT_MAX_PAGES} premières")
+        texts = [doc[i].get_text() for i in range(min(doc.page_count, EXTRACT_MAX_PAGES))]
+        timings["text_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        missing = [i for i, text in enumerate(texts) if len(text.strip()) < OCR_MIN_PAGE_CHARS]
+        if not missing:
+            return "\f".join(texts)
+        if len(missing) > OCR_MAX_PAGES:
+            logging.warning(f"{len(missing)} pages sans texte, OCR limité aux {OCR_MAX_PAGES} premières")
+            missing = missing[:OCR_MAX_PAGES]
+        logging.info(f"OCR de {len(missing)} page(s) sans couche texte")
+        started = time.perf_counter()
+        page_images = {
+            i: doc[i].get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY).tobytes("png")
+            for i in missing
+        }
+    for page_number, text in ocr_pages(page_images).items():
+        texts[page_number] = text
+    timings["ocr_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    timings["ocr_pages"] = len(missing)
+    return "\f".join(texts)
+
+
+def _docx_part_order(name):
+    """
+    En-têtes d'abord (coordonnées), puis le corps du document, puis les pieds de page.
+    """
+    part = DOCX_PART_RE.match(name).group(1)
+    rank = 0 if part.startswith("header") else 1 if part == "document" else 2
+    return rank, name
+
+
+def _iter_docx_part(stream):
+    """
+    Parcourt en flux une partie XML WordprocessingML et produit les paragraphes non vides.
+    Les paragraphes des tableaux et des zones de texte sont inclus ; le contenu des
+    mc:Fallback (copie VML des zones de texte) est ignoré pour ne pas le dupliquer.
+    """
+    fallback_depth = 0
+    # Pile des paragraphes ouverts : une zone de texte est un paragraphe imbriqué dans un autre
+    paragraphs = []
+    for event, element in iterparse(stream, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag == MC_FALLBACK:
+                fallback_depth += 1
+            elif tag == f"{W_NS}p" and not fallback_depth:
+                paragraphs.append([])
+            continue
+
+        if tag == MC_FALLBACK:
+            fallback_depth -= 1
+        elif fallback_depth or not paragraphs:
+            pass
+        elif tag == f"{W_NS}t":
+            paragraphs[-1].append(element.text or "")
+        elif tag == f"{W_NS}tab" and f"{W_NS}val" not in element.attrib:
+            # Les taquets définis dans les propriétés du paragraphe (avec w:val) sont ignorés
+            paragraphs[-1].append("\t")
+        elif tag in (f"{W_NS}br", f"{W_NS}cr"):
+            paragraphs[-1].append("\n")
+        elif tag == f"{W_NS}p":
+            text = "".join(paragraphs.pop()).strip()
+            if text:
+                yield text
+        # Le texte utile est déjà recopié : l'élément est libéré au fil de l'eau
+        element.clear()
+
+
+def extract_docx_text(data):
+    """
+    Extrait le texte d'un DOCX en lisant directement le XML de l'archive, en flux et sans
+    construire le modèle objet python-docx : corps, tableaux, zones de texte, en-têtes
+    et pieds de page. La taille décompressée des parties lues est limitée (EXTRACT_MAX_XML_MB).
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise ExtractionError("Fichier DOCX invalide")
+    with archive:
+        parts = sorted((info for info in archive.infolist() if DOCX_PART_RE.match(info.filename)),
+                       key=lambda info: _docx_part_order(info.filename))
+        if not any(info.filename == "word/document.xml" for info in parts):
+            raise ExtractionError("Fichier DOCX invalide : word/document.xml absent")
+        if sum(info.file_size for info in parts) > EXTRACT_MAX_XML_MB * 1024 * 1024:
+            raise ExtractionError(f"Contenu DOCX trop volumineux (limite {EXTRACT_MAX_XML_MB:g} Mo décompressés)")
+        lines = []
+        for info in parts:
+            with archive.open(info) as stream:
+                lines.extend(_iter_docx_part(stream))
+    return "\n".join(lines)
+
+
+def detect_format(data, filename=""):
+    """
+    Détermine le format ("pdf", "docx" ou "image") d'après la signature du contenu,
+    puis d'après l'extension de `filename`.
+    """
+    if data[:5] == b"%PDF-":
+        return "pdf"
+    if data[:4] == b"PK\x03\x04":
+        return "docx"
+    name = (filename or "").lower()
+    if name.endswith(".pdf"):
+        return "pdf"
+    if name.endswith(".docx"):
+        return "docx"
+    if data[:4] == b"\x89PNG" or data[:3] == b"\xff\xd8\xff":
+        return "image"
+    if name.endswith((".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")):
+        return "image"
+    raise ExtractionError(f"Format de fichier non pris en charge : {filename or 'inconnu'}")
+
+
+def extract_document(data, filename=""):
+    """
+    Extrait le texte d'un fichier PDF, DOCX ou image (PNG/JPG) fourni en mémoire et
+    retourne {"text", "format", "size_bytes", "timings"} (durées en millisecondes).
+    Lève ExtractionError si le fichier dépasse EXTRACT_MAX_MB ou n'est pas pris en charge.
+    """
+    if len(data) > EXTRACT_MAX_MB * 1024 * 1024:
+        raise ExtractionError(f"Fichier trop volumineux (limite {EXTRACT_MAX_MB:g} Mo)")
+    started = time.perf_counter()
+    file_format = detect_format(data, filename)
+    timings = {}
+    if file_format == "pdf":
+        text = extract_pdf_text(data, timings)
+    elif file_format == "docx":
+        text = extract_docx_text(data)
+    else:
+        text = ocr_image(data)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return {"text": text, "format": file_format, "size_bytes": len(data), "timings": timings}
+
+
+def extract_text(data, filename):
+    """
+    Extrait le texte d'un fichier PDF, DOCX ou image (PNG/JPG) fourni en mémoire.
+    Retourne None en cas d'erreur (voir extract_document pour le détail).
+    """
+    try:
+        result = extract_document(data, filename)
+    except Exception as e:
+        logging.error(f"Erreur lors de l'extraction du texte : {e}")
+        return None
+    logging.info(f"Texte extrait de {filename} ({result['format']}, {result['size_bytes']} octets) : {result['timings']}")
+    return result["text"]
@@ -0,0 +1,223 @@
+"""
+Extraction incrémentale des nouvelles versions d'un CV.
+
+Le texte compacté est découpé en blocs (en-tête, sections, expériences : voir
+chunking.split_blocks). Chaque bloc reçoit une empreinte : un hachage exact du texte
+normalisé et une esquisse "bottom-k" de ses shingles (suites de SHINGLE_SIZE mots),
+qui estime la similarité de Jaccard entre deux blocs. Les empreintes sont conservées
+avec le candidat (candidates.py).
+
+À la réception d'une nouvelle version, les blocs sont appariés à ceux de la version
+précédente. Seuls les blocs identiques (même hachage) sont repris tels quels : un bloc
+seulement similaire (deux compétences ajoutées, un numéro de téléphone corrigé) est
+apparié pour choisir la version précédente mais renvoyé au modèle comme les blocs
+nouveaux, et le JSON partiel obtenu est fusionné dans le JSON enregistré (merge_incremental).
+"""
+import hashlib
+import re
+import unicodedata
+
+from candidates import phone_key
+from chunking import merge_skills, split_blocks
+from ranking import tokenize
+from tokenizer import count_tokens
+
+SHINGLE_SIZE = 3
+SKETCH_SIZE = 64
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+PHONE_RE = re.compile(r"\+?\d[\d .()/-]{7,}\d")
+# Les valeurs sont stockées dans MongoDB : entiers signés de 64 bits
+_HASH_MASK = (1 << 63) - 1
+# Part minimale des termes d'un élément (expérience, formation...) présents dans son bloc
+ANCHOR_MIN_SHARE = 0.5
+
+
+def normalize_block(block):
+    """
+    Texte comparable d'un bloc : minuscules, sans accents ni ponctuation, espaces simplifiés.
+    """
+    text = unicodedata.normalize("NFKD", block).encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(re.findall(r"[a-z0-9+#]+", text))
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big") & _HASH_MASK
+
+
+def block_fingerprint(block):
+    """
+    {"hash": hachage exact, "sketch": SKETCH_SIZE plus petits hachages de shingles, "tokens": taille}.
+    """
+    normalized = normalize_block(block)
+    words = normalized.split()
+    shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(max(1, len(words) - SHINGLE_SIZE + 1))}
+    return {
+        "hash": hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16],
+        "sketch": sorted(_hash64(shingle) for shingle in shingles)[:SKETCH_SIZE],
+        "tokens": count_tokens(block)
+    }
+
+
+def fingerprint_text(text):
+    """
+    Retourne (blocs, empreintes) du texte d'un CV.
+    """
+    blocks = split_blocks(text or "")
+    return blocks, [block_fingerprint(block) for block in blocks]
+
+
+def similarity(a, b):
+    """
+    Similarité de Jaccard estimée entre deux blocs (esquisses bottom-k).
+    """
+    if a["hash"] == b["hash"]:
+        return 1.0
+    sketch_a, sketch_b = set(a["sketch"]), set(b["sketch"])
+    union = sorted(sketch_a | sketch_b)[:SKETCH_SIZE]
+    if not union:
+        return 0.0
+    return sum(1 for value in union if value in sketch_a and value in sketch_b) / len(union)
+
+
+def match_blocks(previous, current, threshold):
+    """
+    Apparie les blocs de la nouvelle version à ceux de la précédente (identiques d'abord,
+    puis les plus similaires au-delà du seuil). Retourne (indices des blocs identiques,
+    indices des blocs modifiés appariés) de la nouvelle version ; les seconds sont à
+    ré-extraire, l'appariement ne sert qu'à mesurer la proximité des deux versions.
+    """
+    unchanged, edited = set(), set()
+    available = list(range(len(previous)))
+    by_hash = {}
+    for index in available:
+        by_hash.setdefault(previous[index]["hash"], []).append(index)
+    for index, fingerprint in enumerate(current):
+        candidates = by_hash.get(fingerprint["hash"])
+        if candidates:
+            available.remove(candidates.pop(0))
+            unchanged.add(index)
+    for index, fingerprint in enumerate(current):
+        if index in unchanged or not available:
+            continue
+        best = max(available, key=lambda other: similarity(previous[other], fingerprint))
+        if similarity(previous[best], fingerprint) >= threshold:
+            available.remove(best)
+            edited.add(index)
+    return unchanged, edited
+
+
+def changed_share(fingerprints, unchanged):
+    """
+    Part des tokens du CV situés dans des blocs nouveaux ou modifiés.
+    """
+    total = sum(fingerprint["tokens"] for fingerprint in fingerprints)
+    changed = sum(fingerprint["tokens"] for index, fingerprint in enumerate(fingerprints) if index not in unchanged)
+    return changed / total if total else 1.0
+
+
+def find_email(text):
+    match = EMAIL_RE.search(text or "")
+    return match.group() if match else None
+
+
+def find_phones(text):
+    """
+    Numéros de téléphone du texte, sous la forme de phone_key.
+    """
+    return {key for key in (phone_key(match) for match in PHONE_RE.findall(text or "")) if key}
+
+
+def _terms(*values):
+    return set(tokenize(" ".join(str(value) for value in values if value)))
+
+
+def _item_terms(item):
+    values = []
+    for value in item.values():
+        values.extend(value if isinstance(value, list) else [value])
+    return _terms(*values)
+
+
+def _anchor(item, block_terms):
+    """
+    Indice du bloc qui contient la plus grande part des termes de l'élément (au moins
+    ANCHOR_MIN_SHARE), ou None : l'élément ne figure plus dans le CV.
+    """
+    terms = _item_terms(item)
+    if not terms:
+        return None
+    scores = [len(terms & block) / len(terms) for block in block_terms]
+    best = max(range(len(scores)), key=scores.__getitem__, default=None)
+    return best if best is not None and scores[best] >= ANCHOR_MIN_SHARE else None
+
+
+def _key(item, fields):
+    return tuple(" ".join(str(item.get(field) or "").lower().split()) for field in fields)
+
+
+def _merge_items(stored, partial, key_fields, block_terms, unchanged):
+    """
+    Conserve les éléments enregistrés ancrés dans un bloc inchangé, ajoute ceux extraits des
+    blocs modifiés (qui remplacent un élément enregistré de même clé), puis les ordonne selon
+    la position de leur bloc dans la nouvelle version.
+    """
+    items = {}
+    for item in stored or []:
+        if isinstance(item, dict):
+            position = _anchor(item, block_terms)
+            if position in unchanged:
+                items[_key(item, key_fields)] = (position, item)
+    for item in partial or []:
+        if isinstance(item, dict) and any(item.values()):
+            position = _anchor(item, block_terms)
+            items[_key(item, key_fields)] = (len(block_terms) if position is None else position, item)
+    return [item for _, item in sorted(items.values(), key=lambda entry: entry[0])]
+
+
+def _kept_skills(skills, text_terms):
+    """
+    Compétences enregistrées encore présentes dans le texte de la nouvelle version.
+    """
+    def keep(values):
+        return ", ".join(skill.strip() for skill in str(values or "").split(",")
+                         if skill.strip() and _terms(skill) & text_terms)
+    if isinstance(skills, dict):
+        return {category: keep(values) for category, values in skills.items() if keep(values)}
+    return keep(skills)
+
+
+def merge_incremental(stored, partial, blocks, unchanged):
+    """
+    Fusionne le JSON enregistré et le JSON extrait des blocs modifiés :
+    - expériences, formations et certifications enregistrées conservées si elles sont
+      ancrées dans un bloc inchangé, remplacées sinon par celles du JSON partiel ;
+    - compétences enregistrées conservées si elles figurent encore dans le texte, complétées
+      par celles du JSON partiel ;
+    - champs d'en-tête (nom, poste, contact) remplacés par les valeurs non vides du JSON
+      partiel seulement si le premier bloc (en-tête du CV) a changé.
+    """
+    block_terms = [_terms(block) for block in blocks]
+    text_terms = set().union(*block_terms) if block_terms else set()
+    merged = dict(stored)
+    header_changed = bool(blocks) and 0 not in unchanged
+    if header_changed:
+        for field in ("job_title", "full_name", "years_of_experience"):
+            if partial.get(field):
+                merged[field] = partial[field]
+        contact = dict(stored.get("contact_information") or {})
+        for field, value in (partial.get("contact_information") or {}).items():
+            if value:
+                contact[field] = value
+        merged["contact_information"] = contact
+    merged["professional_experience"] = _merge_items(
+        stored.get("professional_experience"), partial.get("professional_experience"),
+        ("company_name", "date_range"), block_terms, unchanged)
+    merged["education"] = _merge_items(
+        stored.get("education"), partial.get("education"),
+        ("degree", "institution", "year_of_completion"), block_terms, unchanged)
+    certifications = [{"name": name} for name in stored.get("certifications") or []]
+    merged["certifications"] = [item["name"] for item in _merge_items(
+        certifications, [{"name": name} for name in partial.get("certifications") or []],
+        ("name",), block_terms, unchanged)]
+    merged["skills"] = merge_skills([_kept_skills(stored.get("skills"), text_terms), partial.get("skills")])
+    return merged
@@ -0,0 +1,209 @@
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+
+class StorageJobStore:
+    """
+    État des jobs enregistré dans le stockage des fichiers (jobs/<id>.json), partagé par
+    tous les workers et réplicas : un statut demandé à un autre processus que celui qui
+    exécute le job y est lu. `storage_getter` retourne le backend (voir storage.py).
+    """
+
+    def __init__(self, storage_getter, prefix="jobs/"):
+        self.storage_getter = storage_getter
+        self.prefix = prefix
+
+    def save(self, job):
+        data = json.dumps(job, ensure_ascii=False).encode("utf-8")
+        if not self.storage_getter().upload(data, f"{self.prefix}{job['job_id']}.json"):
+            logging.error(f"État du job {job['job_id']} non enregistré dans le stockage")
+
+    def load(self, job_id):
+        if not JOB_ID_RE.fullmatch(job_id or ""):
+            return None
+        data = self.storage_getter().read(f"{self.prefix}{job_id}.json")
+        return json.loads(data) if data else None
+
+
+class JobManager:
+    """
+    Exécute des traitements en arrière-plan dans un pool de threads borné.
+
+    Chaque job conserve son statut, l'étape en cours et la liste de ses événements
+    de progression, consultables par polling ou en flux SSE. Avec un `store`
+    (StorageJobStore), chaque changement d'état y est aussi écrit, et un job exécuté
+    par un autre processus y est lu (relu toutes les `poll_seconds` pour le flux SSE).
+    """
+
+    def __init__(self, max_workers=4, max_pending=32, ttl_seconds=3600, store=None, poll_seconds=1.0):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cv-job")
+        # Nombre maximal de jobs en cours + en attente : au-delà, les soumissions sont refusées
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+        self._ttl_seconds = ttl_seconds
+        self._store = store
+        self._poll_seconds = poll_seconds
+        self._jobs = {}
+        self._save_locks = {}
+        self._cond = threading.Condition()
+
+    def submit(self, fn, *args):
+        """
+        Soumet fn(*args, progress=callback) et retourne l'identifiant du job,
+        ou None si la file d'attente est pleine.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+        self._purge()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._cond:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "stage": None,
+                "result": None,
+                "error": None,
+                "events": [{"status": "queued", "stage": None, "time": now}],
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._save_locks[job_id] = threading.Lock()
+        # Enregistré avant la réponse 202 : le statut est lisible depuis tous les processus
+        self._persist(job_id)
+        try:
+            self._executor.submit(self._run, job_id, fn, args)
+        except RuntimeError:
+            self._slots.release()
+            raise
+        return job_id
+
+    def _record(self, job_id, status=None, stage=None, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            if status:
+                job["status"] = status
+            if stage:
+                job["stage"] = stage
+            job.update(fields)
+            job["updated_at"] = time.time()
+            event = {"status": job["status"], "stage": job["stage"], "time": job["updated_at"]}
+            event.update(fields)
+            job["events"].append(event)
+            self._cond.notify_all()
+        self._persist(job_id)
+
+    def _persist(self, job_id):
+        """
+        Écrit l'état courant du job dans le store ; les écritures d'un même job sont
+        sérialisées et relisent l'état sous le verrou, la dernière est donc la plus récente.
+        """
+        if self._store is None:
+            return
+        with self._cond:
+            save_lock = self._save_locks.get(job_id)
+        if save_lock is None:
+            return
+        with save_lock:
+            with self._cond:
+                job = self._jobs.get(job_id)
+                snapshot = json.loads(json.dumps(job)) if job is not None else None
+            if snapshot is None:
+                return
+            try:
+                self._store.save(snapshot)
+            except Exception as e:
+                logging.error(f"État du job {job_id} non enregistré : {e}")
+
+    def _run(self, job_id, fn, args):
+        self._record(job_id, status="running")
+        try:
+            result = fn(*args, progress=lambda stage: self._record(job_id, stage=stage))
+            self._record(job_id, status="succeeded", stage="done", result=result)
+        except Exception as e:
+            logging.error(f"Échec du job {job_id} : {e}")
+            self._record(job_id, status="failed", error=str(e))
+        finally:
+            self._slots.release()
+
+    def _purge(self):
+        """
+        Supprime les jobs terminés depuis plus longtemps que la durée de rétention.
+        """
+        limit = time.time() - self._ttl_seconds
+        with self._cond:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job["status"] in ("succeeded", "failed") and job["updated_at"] < limit]
+            for job_id in expired:
+                del self._jobs[job_id]
+                self._save_locks.pop(job_id, None)
+
+    def _load(self, job_id):
+        """
+        Job exécuté par un autre processus, lu dans le store (None si inconnu ou expiré).
+        """
+        if self._store is None:
+            return None
+        try:
+            job = self._store.load(job_id)
+        except Exception as e:
+            logging.error(f"Lecture de l'état du job {job_id} impossible : {e}")
+            return None
+        if job and job["status"] in ("succeeded", "failed") and job["updated_at"] < time.time() - self._ttl_seconds:
+            return None
+        return job
+
+    def get(self, job_id):
+        """
+        Retourne l'état courant du job (sans l'historique des événements), ou None.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return {key: value for key, value in job.items() if key != "events"}
+        job = self._load(job_id)
+        if job is None:
+            return None
+        return {key: value for key, value in job.items() if key != "events"}
+
+    def wait_events(self, job_id, cursor=0, timeout=15):
+        """
+        Attend de nouveaux événements au-delà de `cursor`.
+        Retourne (événements, terminé) ou None si le job est inconnu.
+        """
+        with self._cond:
+            local = job_id in self._jobs
+        if not local:
+            return self._wait_stored_events(job_id, cursor, timeout)
+        with self._cond:
+            def has_news():
+                job = self._jobs.get(job_id)
+                return job is None or len(job["events"]) > cursor
+            self._cond.wait_for(has_news, timeout=timeout)
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            finished = job["status"] in ("succeeded", "failed")
+            return list(job["events"][cursor:]), finished
+
+    def _wait_stored_events(self, job_id, cursor, timeout):
+        """
+        wait_events pour un job d'un autre processus : le store est relu toutes les poll_seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._load(job_id)
+            if job is None:
+                return None
+            finished = job["status"] in ("succeeded", "failed")
+            if len(job["events"]) > cursor or finished or time.monotonic() >= deadline:
+                return list(job["events"][cursor:]), finished
+            time.sleep(min(self._poll_seconds, max(0.0, deadline - time.monotonic())))
@@ -0,0 +1,118 @@
+"""
+Analyse incrémentale d'un objet JSON reçu par morceaux (flux de complétion).
+
+Le parseur signale chaque membre de premier niveau dès que sa valeur est complète,
+ainsi que chaque élément des tableaux de premier niveau (par exemple chaque entrée
+de "professional_experience") dès qu'il se ferme.
+"""
+import json
+import logging
+
+
+class IncrementalJSONParser:
+    """
+    Alimenté avec feed(texte), retourne la liste des événements devenus disponibles :
+    - ("item", clé, index, valeur) pour un élément d'un tableau de premier niveau,
+    - ("section", clé, valeur) pour un membre de premier niveau complet.
+    Le texte précédant la première accolade (balises de code, espaces) est ignoré.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        self._key_start = None
+        self._expect_key = False
+        self._value_start = None
+        self._item_start = None
+        self._item_index = 0
+        self.finished = False
+
+    def _decode(self, fragment):
+        try:
+            return json.loads(fragment)
+        except json.JSONDecodeError as e:
+            logging.debug(f"Fragment JSON incomplet ignoré : {e}")
+            return None
+
+    def feed(self, chunk):
+        events = []
+        self._text += chunk
+        text = self._text
+        while self._pos < len(text) and not self.finished:
+            char = text[self._pos]
+            i = self._pos
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key_start is not None:
+                        self._key = self._decode(text[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+
+            if char.isspace():
+                continue
+
+            # Début d'une valeur de premier niveau ou d'un élément de tableau de premier niveau
+            if self._depth == 1 and self._key is not None and self._value_start is None and char not in ":,}":
+                self._value_start = i
+            elif (self._depth == 2 and self._item_start is None and char not in ",]"
+                  and text[self._value_start] == "["):
+                self._item_start = i
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = i
+                    self._expect_key = False
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 2 and self._item_start is not None:
+                    events.extend(self._close_item(text, i))
+                self._depth -= 1
+                if self._depth == 0:
+                    events.extend(self._close_value(text, i))
+                    self.finished = True
+            elif char == ",":
+                if self._depth == 1:
+                    events.extend(self._close_value(text, i))
+                    self._expect_key = True
+                elif self._depth == 2 and self._item_start is not None:
+                    events.extend(self._close_item(text, i))
+        return events
+
+    def _close_item(self, text, end):
+        value = self._decode(text[self._item_start:end])
+        self._item_start = None
+        index = self._item_index
+        self._item_index += 1
+        if value is None:
+            return []
+        return [("item", self._key, index, value)]
+
+    def _close_value(self, text, end):
+        events = []
+        if self._key is not None and self._value_start is not None:
+            value = self._decode(text[self._value_start:end])
+            if value is not None or text[self._value_start:end].strip() == "null":
+                events.append(("section", self._key, value))
+        self._key = None
+        self._value_start = None
+        self._item_index = 0
+        return events
@@ -0,0 +1,445 @@
+"""
+Régulation des appels Azure OpenAI partagée par convert.py et app.py.
+
+Chaque appel réserve, avant de partir, sa part des budgets du déploiement :
+tokens par minute (prompt + max_tokens, le surplus étant rendu à la réponse) et requêtes
+par minute, tous deux en seaux à jetons. Le nombre d'appels simultanés est ajusté
+en AIMD : +1/limite par succès, division par deux sur un 429, réduction de 10 % quand
+la latence dépasse LLM_LATENCY_TOLERANCE fois la latence de référence du type d'appel.
+Un 429 suspend toutes les réservations pendant la durée Retry-After.
+
+Les appelants attendent dans une file équitable : un tour par type d'appel (extraction,
+analyse, segments...), dans l'ordre d'arrivée pour un même type, pour qu'un lot ne
+bloque pas les requêtes interactives. Les erreurs transitoires (429, délai dépassé,
+connexion, 5xx) sont réessayées avec un délai aléatoire (full jitter) ou Retry-After.
+Les clients OpenAI sont construits avec max_retries=0 : les reprises se font ici.
+
+Les budgets s'appliquent par processus : avec plusieurs réplicas, diviser le quota.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metrics import counter, register_callback
+
+LLM_TPM = int(os.getenv("LLM_TPM", "120000"))
+LLM_RPM = int(os.getenv("LLM_RPM", "720"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "30"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "120"))
+LLM_LATENCY_TOLERANCE = float(os.getenv("LLM_LATENCY_TOLERANCE", "2.0"))
+# Délai maximal de chaque appel HTTP au modèle (au-delà, l'appel est réessayé)
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "120"))
+
+# Intervalle minimal entre deux réductions de la limite (une rafale de 429 ne compte qu'une fois)
+DECREASE_COOLDOWN_SECONDS = 1.0
+
+LLM_RETRIES = counter("cv_llm_retries_total", "Appels au modèle réessayés, par motif.", ("reason",))
+LLM_THROTTLED = counter("cv_llm_throttled_total", "Réponses 429 du modèle.")
+
+
+class LimiterTimeout(TimeoutError):
+    """
+    Attente dans la file au-delà de LLM_QUEUE_TIMEOUT_SECONDS.
+    """
+
+
+def retry_reason(error):
+    """
+    Motif de reprise d'une erreur du client OpenAI, ou None si elle n'est pas transitoire.
+    """
+    status = getattr(error, "status_code", None)
+    if status == 429:
+        return "throttled"
+    name = type(error).__name__
+    if name == "APITimeoutError" or isinstance(error, TimeoutError):
+        return "timeout"
+    if name == "APIConnectionError":
+        return "connection"
+    if status in (408, 409) or (status is not None and status >= 500):
+        return "server"
+    return None
+
+
+def retry_after_seconds(error):
+    """
+    Délai demandé par le service (retry-after-ms ou retry-after, en secondes), ou None.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1)):
+        try:
+            value = headers.get(header)
+            if value is not None:
+                return max(0.0, float(value) * scale)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def usage_tokens(response):
+    """
+    Tokens réellement consommés par une réponse non diffusée (None si l'usage est absent).
+    """
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
+
+
+class _Ticket:
+    __slots__ = ("key", "tokens", "prompt_tokens")
+
+    def __init__(self, key, tokens, prompt_tokens):
+        self.key = key
+        self.tokens = tokens
+        self.prompt_tokens = prompt_tokens
+
+
+class Permit:
+    """
+    Autorisation d'appel : tokens réservés et instant de départ.
+    """
+    __slots__ = ("key", "tokens", "prompt_tokens", "started")
+
+    def __init__(self, ticket):
+        self.key = ticket.key
+        self.tokens = ticket.tokens
+        self.prompt_tokens = ticket.prompt_tokens
+        self.started = time.monotonic()
+
+
+class AdaptiveLimiter:
+    """
+    Budgets TPM/RPM, concurrence adaptative et file équitable pour un déploiement.
+    """
+
+    def __init__(self, tokens_per_minute=LLM_TPM, requests_per_minute=LLM_RPM,
+                 max_concurrency=LLM_MAX_CONCURRENCY, min_concurrency=LLM_MIN_CONCURRENCY,
+                 max_retries=LLM_MAX_RETRIES, retry_base=LLM_RETRY_BASE_SECONDS,
+                 retry_max=LLM_RETRY_MAX_SECONDS, queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS,
+                 latency_tolerance=LLM_LATENCY_TOLERANCE):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.queue_timeout = queue_timeout
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._requests = float(requests_per_minute)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latency = {}
+        self._queues = OrderedDict()
+        self._cond = threading.Condition()
+
+    # --- file et budgets (appelés sous self._cond) ---
+
+    def _refill(self, now):
+        elapsed = now - self._refilled
+        self._refilled = now
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+
+    def _enqueue(self, ticket):
+        self._queues.setdefault(ticket.key, deque()).append(ticket)
+
+    def _dequeue(self, ticket):
+        queue = self._queues.get(ticket.key)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.key]
+
+    def _wait_time(self, ticket):
+        """
+        0 si le ticket peut partir, sinon le délai avant de réessayer (None : attendre une libération).
+        """
+        now = time.monotonic()
+        head_key = next(iter(self._queues))
+        if self._queues[head_key][0] is not ticket:
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        self._refill(now)
+        missing_tokens = ticket.tokens - self._tokens
+        missing_requests = 1 - self._requests
+        if missing_tokens <= 0 and missing_requests <= 0:
+            return 0
+        return max(missing_tokens * 60 / self.tokens_per_minute, missing_requests * 60 / self.requests_per_minute)
+
+    def _grant(self, ticket):
+        self._tokens -= ticket.tokens
+        self._requests -= 1
+        self.in_flight += 1
+        queue = self._queues[ticket.key]
+        queue.popleft()
+        # Tour suivant : le type d'appel servi passe en fin de file
+        if queue:
+            self._queues.move_to_end(ticket.key)
+        else:
+            del self._queues[ticket.key]
+        self._cond.notify_all()
+        return Permit(ticket)
+
+    def _ticket(self, prompt_tokens, max_tokens, key):
+        # Une réservation ne peut dépasser le seau, sinon elle n'aboutirait jamais
+        tokens = min(prompt_tokens + max_tokens, self.tokens_per_minute)
+        return _Ticket(key, tokens, prompt_tokens)
+
+    def _abandon(self, ticket):
+        # Un ticket abandonné en tête de file bloquerait tous les suivants
+        self._dequeue(ticket)
+        self._cond.notify_all()
+
+    def _timeout(self, ticket, waited):
+        self._abandon(ticket)
+        return LimiterTimeout(f"Appel au modèle non servi après {waited:g} s d'attente ({ticket.key})")
+
+    # --- acquisition / libération ---
+
+    def acquire(self, prompt_tokens, max_tokens, key="default"):
+        """
+        Attend son tour et la disponibilité des budgets ; retourne un Permit.
+        Lève LimiterTimeout au-delà de queue_timeout secondes ; le ticket quitte la file
+        sur toute sortie sans Permit (délai dépassé, interruption).
+        """
+        ticket = self._ticket(prompt_tokens, max_tokens, key)
+        started = time.monotonic()
+        with self._cond:
+            self._enqueue(ticket)
+            try:
+                while True:
+                    wait = self._wait_time(ticket)
+                    if wait == 0:
+                        return self._grant(ticket)
+                    remaining = self.queue_timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        raise self._timeout(ticket, self.queue_timeout)
+                    self._cond.wait(remaining if wait is None else min(wait, remaining))
+            except BaseException:
+                self._abandon(ticket)
+                raise
+
+    async def acquire_async(self, prompt_tokens, max_tokens, key="default"):
+        """
+        Équivalent de acquire pour la boucle d'événements (attente par courtes pauses).
+        Une tâche annulée pendant l'attente (client déconnecté) retire son ticket de la file.
+        """
+        ticket = self._ticket(prompt_tokens, max_tokens, key)
+        started = time.monotonic()
+        with self._cond:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._wait_time(ticket)
+                    if wait == 0:
+                        return self._grant(ticket)
+                    remaining = self.queue_timeout - (time.monotonic() - started)
+                    if remaining <= 0:
+                        raise self._timeout(ticket, self.queue_timeout)
+                await asyncio.sleep(min(0.05 if wait is None else wait, remaining, 0.25))
+        except BaseException:
+            with self._cond:
+                self._abandon(ticket)
+            raise
+
+    def release(self, permit, outcome, latency=None, used_tokens=None, retry_after=None):
+        """
+        Libère la place et ajuste la limite : outcome vaut "ok", un motif de retry_reason ou "error".
+        used_tokens rend au seau la part non consommée de la réservation.
+        """
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                self._refill(now)
+                self._tokens = min(self.tokens_per_minute, self._tokens + permit.tokens - used_tokens)
+            if outcome == "throttled":
+                LLM_THROTTLED.inc()
+                self._decrease(now, 0.5)
+                if retry_after:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+            elif outcome == "ok" and latency is not None:
+                baseline = self._latency.get(permit.key)
+                if baseline is None or latency < baseline:
+                    self._latency[permit.key] = latency
+                else:
+                    # La référence suit lentement les hausses durables (changement de charge du service)
+                    self._latency[permit.key] = baseline + 0.02 * (latency - baseline)
+                if baseline is not None and latency > self.latency_tolerance * baseline:
+                    self._decrease(now, 0.9)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def _decrease(self, now, factor):
+        if now - self._last_decrease < DECREASE_COOLDOWN_SECONDS:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        logging.info(f"Limite d'appels simultanés au modèle ramenée à {self.limit:.1f}")
+
+    def retry_delay(self, attempt, retry_after=None):
+        """
+        Délai avant la reprise n° attempt : Retry-After s'il est fourni (plus un peu d'aléa
+        pour désynchroniser les appelants), sinon full jitter exponentiel.
+        """
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.retry_base)
+        return random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt))
+
+    def _on_error(self, permit, error, attempt):
+        """
+        Libère le Permit d'un appel en échec ; retourne le délai avant reprise, ou None pour abandonner.
+        """
+        reason = retry_reason(error)
+        retry_after = retry_after_seconds(error)
+        # Un appel refusé (429) ne consomme pas de quota : la réservation est rendue
+        self.release(permit, reason or "error", used_tokens=0 if reason == "throttled" else None,
+                     retry_after=retry_after)
+        if reason is None or attempt >= self.max_retries:
+            return None
+        LLM_RETRIES.inc(reason=reason)
+        delay = self.retry_delay(attempt, retry_after)
+        logging.warning(f"Appel au modèle ({permit.key}) en échec ({reason}), "
+                        f"nouvel essai {attempt + 1}/{self.max_retries} dans {delay:.1f} s")
+        return delay
+
+    # --- appels ---
+
+    def call(self, create, prompt_tokens, max_tokens, key="default"):
+        """
+        Exécute create() (appel non diffusé) sous le limiteur, avec reprises.
+        """
+        attempt = 0
+        while True:
+            permit = self.acquire(prompt_tokens, max_tokens, key)
+            try:
+                response = create()
+            except Exception as e:
+                delay = self._on_error(permit, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.release(permit, "ok", time.monotonic() - permit.started, usage_tokens(response))
+            return response
+
+    def stream(self, create, prompt_tokens, max_tokens, key="default"):
+        """
+        Générateur des fragments d'un appel diffusé. Seule l'ouverture du flux est réessayée ;
+        la place est occupée jusqu'à la fin du flux, la latence retenue est celle du premier fragment.
+        """
+        attempt = 0
+        while True:
+            permit = self.acquire(prompt_tokens, max_tokens, key)
+            try:
+                response = create()
+                break
+            except Exception as e:
+                delay = self._on_error(permit, e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+        latency, chunks, outcome = None, 0, "error"
+        try:
+            for chunk in response:
+                if latency is None:
+                    latency = time.monotonic() - permit.started
+                chunks += 1
+                yield chunk
+            outcome = "ok"
+        finally:
+            # Un fragment de flux porte en général un token
+            self.release(permit, outcome, latency, permit.prompt_tokens + chunks)
+
+    async def call_async(self, create, prompt_tokens, max_tokens, key="default"):
+        """
+        Équivalent asynchrone de call : create() retourne une coroutine.
+        """
+        attempt = 0
+        while True:
+            permit = await self.acquire_async(prompt_tokens, max_tokens, key)
+            try:
+                response = await create()
+            except Exception as e:
+                delay = self._on_error(permit, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.release(permit, "ok", time.monotonic() - permit.started, usage_tokens(response))
+            return response
+
+    async def stream_async(self, create, prompt_tokens, max_tokens, key="default"):
+        """
+        Équivalent asynchrone de stream : create() retourne une coroutine donnant un flux asynchrone.
+        """
+        attempt = 0
+        while True:
+            permit = await self.acquire_async(prompt_tokens, max_tokens, key)
+            try:
+                response = await create()
+                break
+            except Exception as e:
+                delay = self._on_error(permit, e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+        latency, chunks, outcome = None, 0, "error"
+        try:
+            async for chunk in response:
+                if latency is None:
+                    latency = time.monotonic() - permit.started
+                chunks += 1
+                yield chunk
+            outcome = "ok"
+        finally:
+            self.release(permit, outcome, latency, permit.prompt_tokens + chunks)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self.in_flight,
+                "queued": sum(len(queue) for queue in self._queues.values())
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """
+    Limiteur du processus (un déploiement par service), créé au premier usage.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = AdaptiveLimiter()
+        return _limiter
+
+
+register_callback("cv_llm_concurrency_limit", "Limite courante d'appels simultanés au modèle.",
+                  lambda: get_limiter().stats()["limit"])
+register_callback("cv_llm_in_flight", "Appels au modèle en cours.", lambda: get_limiter().stats()["in_flight"])
+register_callback("cv_llm_queued", "Appels au modèle en attente dans la file.", lambda: get_limiter().stats()["queued"])
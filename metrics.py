@@ -0,0 +1,204 @@
+"""
+Instrumentation des services : histogrammes de durée par étape, compteurs de tokens
+et d'erreurs, valeurs lues à la collecte (caches), exposés au format texte Prometheus sur /metrics.
+
+Les métriques sont propres au processus (pas d'agrégation entre les processus du pool
+d'extraction) : les durées sont mesurées dans le processus du serveur, autour des appels.
+"""
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Compteur monotone, éventuellement ventilé par étiquettes.
+    """
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    """
+    Histogramme cumulatif (seaux, somme et nombre d'observations) par étiquettes.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), count))
+                samples.append((f"{self.name}_sum", key, total))
+                samples.append((f"{self.name}_count", key, counts[-1]))
+        return samples
+
+
+class Callback:
+    """
+    Valeur lue à chaque collecte (par exemple les compteurs internes d'un cache).
+    """
+
+    def __init__(self, name, documentation, kind, fn):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.fn = fn
+
+    def collect(self):
+        return [(self.name, (), self.fn())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Enregistre la métrique ; si le nom existe déjà, la métrique existante est retournée.
+        """
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        """
+        Exposition au format texte Prometheus.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                samples = metric.collect()
+            except Exception:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def register_callback(name, documentation, fn, kind="gauge"):
+    return REGISTRY.register(Callback(name, documentation, kind, fn))
+
+
+STAGE_SECONDS = histogram("cv_stage_duration_seconds", "Durée de chaque étape du pipeline.", ("stage",))
+STAGE_ERRORS = counter("cv_stage_errors_total", "Échecs par étape du pipeline.", ("stage",))
+LLM_TOKENS = counter("cv_llm_tokens_total", "Tokens envoyés (prompt) et reçus (completion) par appel au modèle.",
+                     ("call", "kind"))
+
+
+@contextmanager
+def observe_stage(stage):
+    """
+    Mesure la durée du bloc dans cv_stage_duration_seconds ; une exception est comptée
+    dans cv_stage_errors_total puis propagée.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+def timed(stage, falsy_is_error=False):
+    """
+    Décorateur équivalent à observe_stage. Avec falsy_is_error, un résultat None ou False
+    (convention des fonctions qui journalisent leurs erreurs) est aussi compté comme échec.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                result = fn(*args, **kwargs)
+            if falsy_is_error and (result is None or result is False):
+                STAGE_ERRORS.inc(stage=stage)
+            return result
+        return wrapper
+    return decorator
+
+
+def record_stage_error(stage):
+    STAGE_ERRORS.inc(stage=stage)
+
+
+def record_tokens(call, prompt_tokens, completion_tokens):
+    LLM_TOKENS.inc(prompt_tokens or 0, call=call, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens or 0, call=call, kind="completion")
+
+
+def render_metrics():
+    return REGISTRY.render()
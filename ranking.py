@@ -0,0 +1,91 @@
+"""
+Local lexical pre-filter for CV ranking (BM25 over the extracted CV text).
+
+Used to score a whole candidate pool against one job description before any
+LLM call, so only the most relevant CVs are sent to the full analysis.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+
+TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9+#]*(?:\.[a-z0-9]+)*")
+
+STOPWORDS = {
+    # French
+    "a", "au", "aux", "avec", "ce", "ces", "dans", "de", "des", "du", "elle", "en", "et", "est",
+    "etre", "il", "ils", "je", "la", "le", "les", "leur", "lui", "ma", "mais", "me", "mes", "mon",
+    "ne", "nos", "notre", "nous", "on", "ou", "par", "pas", "pour", "qu", "que", "qui", "sa", "se",
+    "ses", "son", "sur", "ta", "te", "tes", "ton", "tu", "un", "une", "vos", "votre", "vous",
+    "afin", "ainsi", "aussi", "cette", "comme", "dont", "entre", "leurs", "plus", "sans", "sous",
+    "tout", "tous", "tres",
+    # English
+    "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it", "of", "on",
+    "or", "the", "to", "with", "will", "you", "your", "we", "our",
+}
+
+
+def tokenize(text):
+    """
+    Lowercase, strip accents and split into terms, keeping tech tokens such as c++, c# or node.js.
+    """
+    normalized = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    return [token for token in TOKEN_RE.findall(normalized) if len(token) > 1 and token not in STOPWORDS]
+
+
+def term_frequencies(text):
+    """
+    Return the term frequencies and the length (in terms) of a document.
+    """
+    tokens = tokenize(text)
+    return dict(Counter(tokens)), len(tokens)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a set of documents described by their term frequencies.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = {}
+        self.document_frequencies = Counter()
+        self.total_length = 0
+
+    def add(self, doc_id, term_freqs, length):
+        if doc_id in self.documents:
+            return
+        self.documents[doc_id] = (term_freqs, length)
+        self.document_frequencies.update(term_freqs.keys())
+        self.total_length += length
+
+    def idf(self, term):
+        n = len(self.documents)
+        df = self.document_frequencies.get(term, 0)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def rank(self, query):
+        """
+        Score every document against the query text.
+        Returns a list of (doc_id, score, matched_terms) sorted by decreasing score.
+        """
+        if not self.documents:
+            return []
+        query_terms = list(dict.fromkeys(tokenize(query)))
+        average_length = self.total_length / len(self.documents) or 1
+        idf = {term: self.idf(term) for term in query_terms}
+        results = []
+        for doc_id, (term_freqs, length) in self.documents.items():
+            score = 0.0
+            matched = []
+            norm = self.k1 * (1 - self.b + self.b * length / average_length)
+            for term in query_terms:
+                tf = term_freqs.get(term)
+                if not tf:
+                    continue
+                matched.append(term)
+                score += idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            results.append((doc_id, score, matched))
+        results.sort(key=lambda result: (-result[1], str(result[0])))
+        return results
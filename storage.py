@@ -0,0 +1,223 @@
+"""
+Stockage des fichiers générés (PDF et DOCX) : Azure Blob Storage ou disque local.
+
+Les deux backends exposent la même interface (upload, read, exists, urls, check). Avec le
+backend Azure, les liens sont des URLs SAS en lecture seule. Avec le backend local, les
+fichiers sont écrits sous LOCAL_STORAGE_DIR et servis par le service lui-même (route
+/files de convert.py) via des URLs signées (HMAC-SHA256) qui expirent.
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+from werkzeug.security import safe_join
+
+# "azure" (défaut) ou "local"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "azure").lower()
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", os.path.join(tempfile.gettempdir(), "cv_files"))
+# Préfixe des URLs des fichiers locaux (ex. https://cv.example.com) ; vide = URLs relatives
+LOCAL_STORAGE_BASE_URL = os.getenv("LOCAL_STORAGE_BASE_URL", "").rstrip("/")
+BLOB_MAX_CONCURRENCY = int(os.getenv("BLOB_MAX_CONCURRENCY", "4"))
+CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+}
+
+
+def content_type_for(name):
+    return CONTENT_TYPES.get(os.path.splitext(name)[1].lower())
+
+
+def _payload_length(data):
+    """
+    Longueur d'un contenu (objet fichier ou octets), objet fichier rembobiné.
+    """
+    if hasattr(data, "seek"):
+        length = data.seek(0, os.SEEK_END)
+        data.seek(0)
+        return length
+    return len(data)
+
+
+class AzureBlobStorage:
+    """
+    Conteneur Azure Blob Storage ; liens SAS en lecture seule.
+    """
+    name = "azure"
+
+    def __init__(self, client_resource, container, account_key):
+        self.client_resource = client_resource
+        self.container = container
+        self.account_key = account_key
+
+    def upload(self, data, name, overwrite=True):
+        """
+        Upload par blocs envoyés en parallèle (BLOB_MAX_CONCURRENCY). Avec overwrite=False,
+        un blob déjà présent est conservé. Retourne True si le blob est disponible.
+        """
+        from azure.core.exceptions import ResourceExistsError
+        from azure.storage.blob import ContentSettings
+        try:
+            blob_client = self.client_resource.get().get_blob_client(container=self.container, blob=name)
+            content_type = content_type_for(name)
+            # Longueur passée explicitement : sinon le SDK appelle fileno(), ce qui ferait
+            # déborder un SpooledTemporaryFile sur disque
+            blob_client.upload_blob(
+                data,
+                length=_payload_length(data),
+                overwrite=overwrite,
+                max_concurrency=BLOB_MAX_CONCURRENCY,
+                content_settings=ContentSettings(content_type=content_type) if content_type else None
+            )
+            logging.info(f"Fichier {name} uploadé vers Azure Blob Storage.")
+            return True
+        except ResourceExistsError:
+            logging.info(f"Fichier {name} déjà présent dans Blob Storage, upload ignoré.")
+            return True
+        except Exception as e:
+            logging.error(f"Erreur lors de l'upload vers Blob Storage : {e}")
+            return False
+
+    def read(self, name):
+        """
+        Contenu du blob, ou None s'il n'existe pas.
+        """
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            return self.client_resource.get().get_blob_client(container=self.container, blob=name).download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+
+    def exists(self, name):
+        return self.client_resource.get().get_blob_client(container=self.container, blob=name).exists()
+
+    def urls(self, names, minutes=10):
+        """
+        URLs SAS en lecture seule valables `minutes` minutes : compte, clé et échéance
+        ne sont résolus qu'une fois. Retourne {nom: URL}.
+        """
+        from azure.storage.blob import generate_blob_sas, BlobSasPermissions
+        account_name = self.client_resource.get().account_name
+        account_key = self.account_key()
+        expiry = datetime.now(timezone.utc) + timedelta(minutes=minutes)
+        permission = BlobSasPermissions(read=True)
+        urls = {}
+        for name in names:
+            sas_token = generate_blob_sas(
+                account_name=account_name,
+                container_name=self.container,
+                blob_name=name,
+                account_key=account_key,
+                permission=permission,
+                expiry=expiry
+            )
+            urls[name] = f"https://{account_name}.blob.core.windows.net/{self.container}/{name}?{sas_token}"
+        return urls
+
+    def check(self):
+        self.client_resource.get().get_container_client(self.container).get_container_properties(
+            timeout=5, retry_total=0, connection_timeout=5)
+
+
+class LocalStorage:
+    """
+    Répertoire local ; les fichiers sont servis par /files/<nom>?expires=<ts>&sig=<signature>.
+
+    Les écritures passent par un fichier temporaire renommé atomiquement : un fichier
+    visible est toujours complet. La clé de signature doit être partagée par toutes les
+    instances qui servent le même répertoire ; à défaut, une clé aléatoire est générée et
+    les liens ne survivent pas à un redémarrage.
+    """
+    name = "local"
+
+    def __init__(self, root=LOCAL_STORAGE_DIR, signing_key=None, base_url=LOCAL_STORAGE_BASE_URL):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url
+        if not signing_key:
+            logging.warning("LOCAL_STORAGE_SIGNING_KEY absente : clé aléatoire, liens invalidés au redémarrage")
+            signing_key = secrets.token_hex(32)
+        self._key = signing_key.encode("utf-8")
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, name):
+        """
+        Chemin du fichier sous la racine, ou None si le nom en sort (../, chemin absolu).
+        """
+        return safe_join(self.root, name)
+
+    def upload(self, data, name, overwrite=True):
+        path = self.path(name)
+        if path is None:
+            logging.error(f"Nom de fichier refusé : {name}")
+            return False
+        if not overwrite and os.path.exists(path):
+            logging.info(f"Fichier {name} déjà présent dans le stockage local, écriture ignorée.")
+            return True
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".upload-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    if hasattr(data, "read"):
+                        data.seek(0)
+                        shutil.copyfileobj(data, f)
+                    else:
+                        f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            logging.info(f"Fichier {name} écrit dans le stockage local.")
+            return True
+        except Exception as e:
+            logging.error(f"Erreur lors de l'écriture dans le stockage local : {e}")
+            return False
+
+    def read(self, name):
+        """
+        Contenu du fichier, ou None s'il n'existe pas.
+        """
+        path = self.path(name)
+        if path is None or not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def exists(self, name):
+        path = self.path(name)
+        return path is not None and os.path.isfile(path)
+
+    def sign(self, name, expires):
+        digest = hmac.new(self._key, f"{name}\n{expires}".encode("utf-8"), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+    def verify(self, name, expires, signature):
+        """
+        Vérifie la signature et l'échéance d'un lien.
+        """
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        if expires < time.time() or not signature:
+            return False
+        return hmac.compare_digest(self.sign(name, expires), signature)
+
+    def urls(self, names, minutes=10):
+        expires = int(time.time()) + minutes * 60
+        return {
+            name: f"{self.base_url}/files/{quote(name)}?expires={expires}&sig={self.sign(name, expires)}"
+            for name in names
+        }
+
+    def check(self):
+        if not os.access(self.root, os.W_OK):
+            raise PermissionError(f"Répertoire {self.root} non accessible en écriture")
@@ -0,0 +1,170 @@
+"""
+Registre des modèles de mise en page des CV générés (PDF et DOCX).
+
+Chaque modèle est compilé une seule fois : feuille de styles ReportLab, style des
+titres de section, bannière (octets et ImageReader) et texte d'en-tête. Le rendu
+d'un CV ne fait plus ensuite que le travail propre au document.
+"""
+import copy
+import io
+import json
+import logging
+import os
+import threading
+
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import TableStyle
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TEMPLATE = os.getenv("CV_DEFAULT_TEMPLATE", "heptasys")
+
+# Définition des modèles disponibles. Les modèles supplémentaires (CV_TEMPLATES_FILE)
+# héritent des valeurs du modèle par défaut pour les clés non renseignées.
+TEMPLATE_DEFINITIONS = {
+    "heptasys": {
+        "banner_path": "Background.png",
+        "banner_height_inch": 2,
+        "accent_color": "#40E0D0",
+        "font_name": "Helvetica",
+        "bold_font_name": "Helvetica-Bold",
+        "font_size": 10,
+        "leading": 12,
+        # Texte affiché sur le bandeau de la bannière : (abscisse en points, texte)
+        "header_lines": [
+            [80, "01 40 76 01 49"],
+            [260, "heptasys@heptasys.com"],
+            [470, "www.heptasys.com"]
+        ]
+    }
+}
+
+
+class CVTemplate:
+    """
+    Modèle compilé : styles, bannière et en-tête prêts à l'emploi pour les deux rendus.
+    """
+
+    def __init__(self, name, definition):
+        self.name = name
+        self.font_name = definition["font_name"]
+        self.bold_font_name = definition["bold_font_name"]
+        self.accent_hex = definition["accent_color"].lstrip("#").upper()
+        self.accent_color = colors.HexColor(f"#{self.accent_hex}")
+        self.banner_height = definition["banner_height_inch"] * inch
+        self.header_lines = [(x, text) for x, text in definition["header_lines"]]
+
+        styles = getSampleStyleSheet()
+        styles['Normal'].fontName = self.font_name
+        styles['Normal'].fontSize = definition["font_size"]
+        styles['Normal'].leading = definition["leading"]
+        styles.add(ParagraphStyle(name='Section', parent=styles['Normal'],
+                                  fontName=self.bold_font_name, fontSize=12,
+                                  textColor=colors.black, alignment=1, spaceAfter=12))
+        styles.add(ParagraphStyle(name='Bold', parent=styles['Normal'],
+                                  fontName=self.bold_font_name))
+        styles.add(ParagraphStyle(name='Center', parent=styles['Normal'], alignment=1))
+        styles.add(ParagraphStyle(name='Right', parent=styles['Normal'], alignment=2))
+        styles.add(ParagraphStyle(name='HeaderTitle', parent=styles['Normal'],
+                                  fontName=self.bold_font_name, fontSize=14,
+                                  alignment=0, leading=24, textColor=colors.white))
+        self.styles = styles
+
+        self.section_title_style = TableStyle([
+            ("ALIGN", (0,0), (-1,-1), "CENTER"),
+            ("BOX", (0,0), (-1,-1), 1, self.accent_color),
+            ("BOTTOMPADDING", (0,0), (-1,-1), 12),
+            ("TOPPADDING", (0,0), (-1,-1), 12)
+        ])
+        self.list_table_style = TableStyle([
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 6)
+        ])
+        self.experience_table_style = TableStyle([
+            ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+            ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+            ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+            ('BOTTOMPADDING', (0,0), (-1,-1), 6)
+        ])
+
+        # La bannière est lue et décodée une seule fois
+        self.banner_bytes = None
+        self.banner_image = None
+        banner_path = definition.get("banner_path")
+        if banner_path:
+            if not os.path.isabs(banner_path):
+                banner_path = os.path.join(BASE_DIR, banner_path)
+            try:
+                with open(banner_path, "rb") as f:
+                    self.banner_bytes = f.read()
+                self.banner_image = ImageReader(io.BytesIO(self.banner_bytes))
+                self.banner_image.getRGBData()
+            except (OSError, IOError) as e:
+                logging.warning(f"Bannière introuvable pour le modèle {name} : {banner_path} ({e})")
+                self.banner_bytes = None
+                self.banner_image = None
+
+
+class TemplateRegistry:
+    """
+    Ensemble des modèles compilés, indexés par nom.
+    """
+
+    def __init__(self, definitions, default_name=DEFAULT_TEMPLATE):
+        self.default_name = default_name
+        self._templates = {name: CVTemplate(name, definition) for name, definition in definitions.items()}
+        if default_name not in self._templates:
+            raise KeyError(f"Modèle par défaut inconnu : {default_name}")
+
+    def get(self, name=None):
+        """
+        Retourne le modèle demandé (ou le modèle par défaut). Lève KeyError si le nom est inconnu.
+        """
+        name = name or self.default_name
+        if name not in self._templates:
+            raise KeyError(f"Modèle inconnu : {name}")
+        return self._templates[name]
+
+    def names(self):
+        return sorted(self._templates)
+
+
+def load_definitions(path=None):
+    """
+    Retourne les définitions intégrées complétées par celles du fichier JSON `path`
+    (par défaut la variable d'environnement CV_TEMPLATES_FILE).
+    """
+    definitions = copy.deepcopy(TEMPLATE_DEFINITIONS)
+    path = path or os.getenv("CV_TEMPLATES_FILE")
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            extra = json.load(f)
+        base = TEMPLATE_DEFINITIONS["heptasys"]
+        for name, definition in extra.items():
+            definitions[name] = {**base, **definition}
+    return definitions
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Retourne le registre des modèles, compilé au premier appel.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = TemplateRegistry(load_definitions())
+            logging.info(f"Modèles de CV chargés : {', '.join(_registry.names())}")
+        return _registry
+
+
+def get_template(name=None):
+    """
+    Raccourci pour get_registry().get(name).
+    """
+    return get_registry().get(name)
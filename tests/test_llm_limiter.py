@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+
+from llm_limiter import AdaptiveLimiter, LimiterTimeout
+
+
+class AcquireCancellationTest(unittest.TestCase):
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        limiter = AdaptiveLimiter(max_concurrency=1, min_concurrency=1, queue_timeout=1)
+
+        async def scenario():
+            permit = await limiter.acquire_async(10, 10)
+            waiter = asyncio.ensure_future(limiter.acquire_async(10, 10))
+            await asyncio.sleep(0.1)
+            self.assertEqual(limiter.stats()["queued"], 1)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            limiter.release(permit, "ok")
+            self.assertEqual(limiter.stats()["queued"], 0)
+            # Le ticket annulé ne bloque plus la tête de file
+            limiter.release(await limiter.acquire_async(10, 10), "ok")
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter.stats()["in_flight"], 0)
+
+    def test_timed_out_waiter_leaves_the_queue(self):
+        limiter = AdaptiveLimiter(max_concurrency=1, min_concurrency=1, queue_timeout=0.1)
+        permit = limiter.acquire(10, 10)
+        with self.assertRaises(LimiterTimeout):
+            limiter.acquire(10, 10)
+        self.assertEqual(limiter.stats()["queued"], 0)
+        limiter.release(permit, "ok")
+        limiter.release(limiter.acquire(10, 10), "ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""
+Comptage des tokens hors ligne.
+
+Utilise tiktoken si l'encodage est présent dans TIKTOKEN_CACHE_DIR (fichier
+téléchargé à la construction de l'image Docker), sinon une estimation prudente
+fondée sur le nombre de caractères. L'encodage n'est jamais téléchargé pendant
+une requête.
+"""
+import logging
+import math
+import os
+import threading
+
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+# Le français compte en moyenne un peu moins de 4 caractères par token
+CHARS_PER_TOKEN = 3.5
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """
+    Retourne l'encodage tiktoken, ou None s'il n'est pas disponible hors ligne.
+    """
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            _encoding_loaded = True
+            cache_dir = os.getenv("TIKTOKEN_CACHE_DIR")
+            # Sans cache local, tiktoken téléchargerait l'encodage au premier comptage
+            if not cache_dir or not os.path.isdir(cache_dir) or not os.listdir(cache_dir):
+                logging.warning("Encodage tiktoken absent de TIKTOKEN_CACHE_DIR, estimation par caractères utilisée")
+                return None
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception as e:
+                logging.warning(f"Tokenizer tiktoken indisponible, estimation par caractères utilisée : {e}")
+                _encoding = None
+        return _encoding
+
+
+def count_tokens(text):
+    """
+    Retourne le nombre de tokens de `text` (exact avec tiktoken, estimé sinon).
+    """
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)